@@ -0,0 +1,239 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from main import FileLoader, DataProcessor, GroupKernel, copy_csv_parallel
+from scheduler import WorkerPool
+
+
+REGIONS = {
+    'Europe': ['Norway', 'Germany', 'France', 'Czech Republic', 'Spain'],
+    'Asia': ['Japan', 'India', 'Vietnam', 'Mongolia'],
+    'Sub-Saharan Africa': ['Chad', 'Kenya', 'Ghana', 'Namibia'],
+    'North America': ['Canada', 'United States of America', 'Mexico'],
+    'Australia and Oceania': ['Australia', 'Fiji', 'Samoa'],
+}
+# item type -> (unit price, unit cost)
+ITEM_TYPES = {
+    'Baby Food': (255.28, 159.42), 'Beverages': (47.45, 31.79), 'Cereal': (205.70, 117.11),
+    'Clothes': (109.28, 35.84), 'Cosmetics': (437.20, 263.33), 'Fruits': (9.33, 6.92),
+    'Household': (668.27, 502.54), 'Meat': (421.89, 364.69), 'Office Supplies': (651.21, 524.96),
+    'Personal Care': (81.73, 56.67), 'Snacks': (152.58, 97.44), 'Vegetables': (154.06, 90.93),
+}
+COLUMNS = ['Region', 'Country', 'Item Type', 'Sales Channel', 'Order Priority', 'Order Date', 'Order ID',
+           'Ship Date', 'Units Sold', 'Unit Price', 'Unit Cost', 'Total Revenue', 'Total Cost', 'Total Profit']
+
+
+def format_dates(dates):
+    """
+        Formatting dates like record.csv does (6/15/2021)
+    :param dates: DatetimeIndex
+    :return: array of strings
+    """
+    return (dates.month.astype(str) + '/' + dates.day.astype(str) + '/' + dates.year.astype(str)).to_numpy()
+
+
+def generate_chunk(rows, invalid_share, rng, first_order_id):
+    """
+        Generating rows of synthetic sales data with the record.csv schema
+    :param rows: number of rows
+    :param invalid_share: share of rows broken in a way validation rejects
+    :param rng: numpy random generator
+    :param first_order_id: Order ID of the first row
+    :return: DataFrame
+    """
+    countries = [(region, country) for region, names in REGIONS.items() for country in names]
+    country_index = rng.integers(0, len(countries), rows)
+    items = list(ITEM_TYPES)
+    item_index = rng.integers(0, len(items), rows)
+    prices = np.array([ITEM_TYPES[item][0] for item in items])[item_index]
+    costs = np.array([ITEM_TYPES[item][1] for item in items])[item_index]
+    units = rng.integers(1, 10000, rows)
+    order_dates = pd.Timestamp('2010-01-01') + pd.to_timedelta(rng.integers(0, 365 * 8, rows), unit='D')
+    ship_dates = order_dates + pd.to_timedelta(rng.integers(0, 50, rows), unit='D')
+    revenue = np.round(units * prices, 2)
+    cost = np.round(units * costs, 2)
+
+    chunk = pd.DataFrame({
+        'Region': np.array([region for region, _ in countries], dtype=object)[country_index],
+        'Country': np.array([country for _, country in countries], dtype=object)[country_index],
+        'Item Type': np.array(items, dtype=object)[item_index],
+        'Sales Channel': np.where(rng.random(rows) < 0.5, 'Online', 'Offline'),
+        'Order Priority': rng.choice(['L', 'M', 'H', 'C'], rows),
+        'Order Date': format_dates(order_dates),
+        'Order ID': np.arange(first_order_id, first_order_id + rows),
+        'Ship Date': format_dates(ship_dates),
+        'Units Sold': units,
+        'Unit Price': prices,
+        'Unit Cost': costs,
+        'Total Revenue': revenue,
+        'Total Cost': cost,
+        'Total Profit': np.round(revenue - cost, 2).astype(object),
+    }, columns=COLUMNS)
+
+    invalid = np.flatnonzero(rng.random(rows) < invalid_share)
+    kinds = rng.integers(0, 4, len(invalid))
+    chunk.loc[invalid[kinds == 0], 'Country'] = None
+    chunk.loc[invalid[kinds == 1], 'Total Profit'] = 'n/a'
+    chunk.loc[invalid[kinds == 2], 'Units Sold'] = 0
+    chunk.loc[invalid[kinds == 3], 'Order Date'] = '1/1/2999'
+    return chunk
+
+
+def generate_sales_csv(file_path, rows, invalid_share=0.01, seed=0, chunk_rows=500000):
+    """
+        Writing a synthetic sales csv in chunks, so 10M rows do not need 10M rows of memory
+    :param file_path: destination csv
+    :param rows: number of rows
+    :param invalid_share: share of invalid rows
+    :param seed: random seed
+    :param chunk_rows: rows generated at once
+    :return: file_path
+    """
+    rng = np.random.default_rng(seed)
+    with open(file_path, 'w', newline='', encoding='utf-8') as f:
+        if rows == 0:
+            pd.DataFrame(columns=COLUMNS).to_csv(f, index=False)
+        for start in range(0, rows, chunk_rows):
+            chunk = generate_chunk(min(chunk_rows, rows - start), invalid_share, rng, 100000000 + start)
+            chunk.to_csv(f, index=False, header=start == 0)
+    return file_path
+
+
+def time_call(func, repeat):
+    """
+        Best wall time of func over repeat runs, the output of func is discarded
+    :return: (seconds, result of the last run)
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            result = func()
+            best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+def operations(data, pool):
+    """
+        Operations to time, as name -> (callable, whether it runs in the pool), every mode times the same callable
+    :param data: validated DataFrame
+    :param pool: WorkerPool of the mode, its backend decides whether the operation runs serially or in parallel
+    """
+    return {
+        'validate_data': (lambda: DataProcessor.validate_data(data, pool=pool), True),
+        'calculate_avg_profit': (lambda: DataProcessor.calculate_avg_profit(data, pool=pool), True),
+        'calculate_profit_margin_data': (lambda: DataProcessor.calculate_profit_margin_data(data, pool=pool), True),
+        'analyze_trends': (lambda: DataProcessor.analyze_trends(data, None, pool=pool), True),
+        'compare_profits': (lambda: DataProcessor.compare_profits(data, 'Norway', 'Japan'), False),
+        'calculate_average_profit_by_country': (
+            lambda: DataProcessor.calculate_average_profit_by_country(data.copy()), False),
+        'analyze_profit_by_region': (lambda: DataProcessor.analyze_profit_by_region(data), False),
+        # the GroupKernel used by every aggregation against the pandas groupby it replaced
+        'group_kernel': (lambda: GroupKernel.aggregate(data, ['Country', 'Year', 'Item Type'], {
+            'Total Profit': ('Total Profit', 'sum'), 'Orders': (None, 'size')}), False),
+        'pandas_groupby': (lambda: data.groupby(['Country', 'Year', 'Item Type'], observed=True)['Total Profit'].agg(
+            ['sum', 'size']), False),
+    }
+
+
+def run_benchmarks(file_path, processes=4, repeat=3):
+    """
+        Timing FileLoader, every DataProcessor operation and copy_csv_parallel
+    :param file_path: csv with the record.csv schema
+    :param processes: workers of the parallel mode
+    :param repeat: runs per measurement, the best one is reported
+    :return: list of result dicts
+    """
+    results = []
+
+    def record(operation, mode, seconds, rows):
+        results.append({'operation': operation, 'mode': mode, 'seconds': round(seconds, 6), 'rows': rows})
+
+    for cache_path in FileLoader.cache_paths(file_path):
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+    seconds, data = time_call(lambda: FileLoader.load_file(file_path, use_cache=False), repeat)
+    # rows of the source file, the copies are measured against it
+    source_rows = len(data)
+    record('load_file', 'cold', seconds, source_rows)
+    time_call(lambda: FileLoader.load_file(file_path), 1)
+    seconds, _ = time_call(lambda: FileLoader.load_file(file_path), repeat)
+    record('load_file', 'warm', seconds, source_rows)
+
+    with WorkerPool(processes=processes, backend='serial') as pool:
+        with contextlib.redirect_stdout(io.StringIO()):
+            data = DataProcessor.validate_data(data, pool=pool)
+    # 'serial' runs in one process, 'parallel' is the process pool and 'thread' the thread pool of the same scheduler
+    for mode, backend in [('serial', 'serial'), ('thread', 'thread'), ('parallel', 'process')]:
+        with WorkerPool(processes=processes, backend=backend) as pool:
+            for operation, (func, pooled) in operations(data, pool).items():
+                if pooled or mode == 'serial':
+                    # the first call publishes the data to shared memory in a pool, that cost is paid once per dataset
+                    time_call(func, 1)
+                    record(operation, mode, time_call(func, repeat)[0], len(data))
+
+    dest_folder = tempfile.mkdtemp(prefix='benchmark_copy_')
+    try:
+        for mode, workers in [('serial', 1), ('parallel', processes)]:
+            seconds, _ = time_call(lambda: copy_csv_parallel(file_path, dest_folder, num_processes=workers), repeat)
+            record('copy_csv_parallel', mode, seconds, source_rows)
+    finally:
+        shutil.rmtree(dest_folder, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of main.py on synthetic sales data")
+    parser.add_argument('--rows', type=int, default=2000000, help="rows of synthetic data (100k to 10M)")
+    parser.add_argument('--invalid-share', type=float, default=0.01, help="share of invalid rows")
+    parser.add_argument('--processes', type=int, default=4, help="workers of the thread and parallel modes")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the generator")
+    parser.add_argument('--input', help="benchmark an existing csv instead of generating one")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file for the results")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        file_path = args.input
+        if file_path is None:
+            file_path = os.path.join(workdir, 'record.csv')
+            print(f"Generating {args.rows} rows...")
+            generate_sales_csv(file_path, args.rows, args.invalid_share, args.seed)
+        results = run_benchmarks(file_path, args.processes, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'cpu_count': os.cpu_count(),
+        'rows': args.rows if args.input is None else None,
+        'input': args.input,
+        'invalid_share': args.invalid_share,
+        'processes': args.processes,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    for result in results:
+        print(f"{result['operation']:<40} {result['mode']:<9} {result['seconds']:.4f} s")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
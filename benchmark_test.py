@@ -0,0 +1,57 @@
+import unittest
+import os
+import tempfile
+
+import pandas as pd
+
+from main import FileLoader, DataProcessor
+from metrics import ProfitLog
+from benchmark import generate_sales_csv, run_benchmarks, COLUMNS
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.log_folder = tempfile.TemporaryDirectory()
+        ProfitLog.configure(os.path.join(self.log_folder.name, 'profit.log'))
+
+    def tearDown(self):
+        ProfitLog.configure()
+        self.log_folder.cleanup()
+
+    def test_generate_sales_csv_has_record_schema_and_invalid_rows(self):
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = generate_sales_csv(os.path.join(folder, 'record.csv'), 5000, invalid_share=0.1,
+                                           chunk_rows=2000)
+            raw = pd.read_csv(file_path)
+            data = FileLoader.load_file(file_path, use_cache=False)
+
+        self.assertEqual(list(raw.columns), COLUMNS)
+        self.assertEqual(len(raw), 5000)
+        self.assertTrue(raw['Order ID'].is_unique)
+        cleaned, invalid_count = DataProcessor.validate_and_clean_data(data)
+        self.assertGreater(invalid_count, 300)
+        self.assertLess(invalid_count, 700)
+
+    def test_run_benchmarks_times_every_operation(self):
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = generate_sales_csv(os.path.join(folder, 'record.csv'), 2000)
+            results = run_benchmarks(file_path, processes=2, repeat=1)
+
+        measured = {(result['operation'], result['mode']) for result in results}
+        self.assertIn(('load_file', 'cold'), measured)
+        self.assertIn(('load_file', 'warm'), measured)
+        self.assertIn(('validate_data', 'parallel'), measured)
+        self.assertIn(('copy_csv_parallel', 'serial'), measured)
+        self.assertTrue(all(result['seconds'] >= 0 for result in results))
+        # the serial and parallel modes time the same operations
+        modes = {mode: {operation for operation, measured_mode in measured if measured_mode == mode}
+                 for mode in ('serial', 'parallel')}
+        self.assertLessEqual(modes['parallel'], modes['serial'])
+        self.assertIn('calculate_avg_profit', modes['parallel'])
+        # copies are reported with the rows of the source file, not the validated ones
+        self.assertEqual({result['rows'] for result in results if result['operation'] == 'copy_csv_parallel'}, {2000})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,499 +1,3215 @@
-import pandas as pd
-import multiprocessing as mp
-import time
-import os
-import csv
-from datetime import datetime
-
-
-class FileNotFoundError(Exception):
-    pass
-
-
-class MissingColumnError(Exception):
-    pass
-
-
-class FileLoader:
-    """
-        Method for loading the file
-    """
-    def load_file(file_path):
-        try:
-            if not os.path.isfile(file_path):
-                raise FileNotFoundError(f"Error: The file '{file_path}' does not exist.")
-            try:
-                data = pd.read_csv(file_path)
-            except Exception as e:
-                raise Exception(f"Error: Unable to read the file '{file_path}'. {e}")
-
-            required_columns = ['Country', 'Total Profit', 'Order Date']
-            missing_columns = [col for col in required_columns if col not in data.columns]
-            if missing_columns:
-                raise MissingColumnError(f"Error: Missing required columns: {', '.join(missing_columns)}.")
-
-            return data
-        except (FileNotFoundError, MissingColumnError, Exception) as e:
-            print(e)
-            return None
-
-
-class DataProcessor:
-    """
-        class for all the methods, modeling and
-    """
-    @staticmethod
-
-    def format_currency(amount):
-        """
-            formating currency
-        :return: currency in better format;
-        """
-        try:
-            return f"{amount:,.2f} USD"
-        except Exception as e:
-            print(f"Error in formatting currency: {e}")
-            raise
-    @staticmethod
-    def calculate_profit(chunk, country):
-        """
-            Calculating profit of a country
-        :param country: country name in colummn
-        :return: all countries profit
-        """
-        try:
-            if country not in chunk['Country'].values:
-                raise ValueError(f"Country '{country}' not found in the data chunk.")
-            return chunk[chunk['Country'] == country]['Total Profit'].sum()
-        except Exception as e:
-            print(f"Error in calculating profit: {e}")
-            raise
-
-    @staticmethod
-
-    def analyze_trends_by_year(chunk):
-        """
-            Method for analyzing trends about years
-        :return:
-        """
-        try:
-            chunk['Year'] = pd.to_datetime(chunk['Order Date'], errors='coerce').dt.year
-            chunk = chunk.dropna(subset=['Year'])
-            return chunk.groupby('Year')['Total Profit'].sum().to_dict()
-        except Exception as e:
-            print(f"Error in analyzing trends by year: {e}")
-            raise
-
-    @staticmethod
-    def validate_and_clean_data(chunk):
-        """
-            Method for validating and cleaning data from file
-        :param chunk:
-        :return:
-        """
-        try:
-            initial_count = len(chunk)
-            chunk = chunk.dropna(subset=['Country', 'Total Profit', 'Order Date'])
-            chunk['Total Profit'] = pd.to_numeric(chunk['Total Profit'], errors='coerce')
-            chunk = chunk.dropna(subset=['Total Profit'])
-            chunk['Order Date'] = pd.to_datetime(chunk['Order Date'], errors='coerce')
-            chunk = chunk.dropna(subset=['Order Date'])
-            chunk = chunk[chunk['Units Sold'] > 0]
-            chunk = chunk[chunk['Unit Price'] > 0]
-            chunk = chunk[chunk['Unit Cost'] > 0]
-            chunk = chunk[chunk['Total Revenue'] > 0]
-            current_date = pd.to_datetime('today')
-            chunk = chunk[chunk['Order Date'] <= current_date]
-            cleaned_count = len(chunk)
-            invalid_count = initial_count - cleaned_count
-            return chunk, invalid_count
-        except Exception as e:
-            print(f"Error in data cleaning: {e}")
-            raise
-    @staticmethod
-    def calculate_average_profit_per_order(chunk):
-        """
-            Calculating
-        :param chunk:
-        :return:
-        """
-        try:
-            if chunk.empty:
-                raise ValueError("Chunk is empty. Cannot calculate average profit.")
-
-            total_profit = chunk['Total Profit'].sum()
-            num_orders = chunk.shape[0]
-
-            min_profit = chunk['Total Profit'].min()
-            max_profit = chunk['Total Profit'].max()
-            avg_profit = total_profit / num_orders if num_orders > 0 else 0
-
-            print(f"Total profit: {total_profit}")
-            print(f"Number of orders: {num_orders}")
-            print(f"Min profit per order: {min_profit}")
-            print(f"Max profit per order: {max_profit}")
-            print(f"Average profit per order: {avg_profit}")
-
-            with open("profit_analysis_log.txt", "a") as log_file:
-                log_file.write(f"Avg Profit: {avg_profit}, Min Profit: {min_profit}, Max Profit: {max_profit}\n")
-
-            return avg_profit
-        except Exception as e:
-            print(f"Error in calculating average profit per order: {e}")
-            raise
-
-    @staticmethod
-    def calculate_profit_margin(chunk):
-        """
-            Calculating margin profit
-        :param chunk:
-        :return:
-        """
-        try:
-            if 'Total Profit' in chunk.columns and 'Total Revenue' in chunk.columns and 'Item Type' in chunk.columns:
-                chunk['Profit Margin'] = chunk['Total Profit'] / chunk['Total Revenue']
-                return chunk[['Item Type', 'Profit Margin']]
-            else:
-                raise MissingColumnError("Missing required columns: 'Total Profit', 'Total Revenue', or 'Item Type'")
-        except Exception as e:
-            print(f"Error in calculating profit margin: {e}")
-            raise
-
-    @staticmethod
-    def calculate_average_profit_by_country(chunk):
-        """
-            Method for calculating profit for each country
-        :param chunk:
-        :return:
-        """
-        try:
-            chunk['Country'] = chunk['Country'].str.strip()
-            avg_profit_by_country = chunk.groupby('Country')['Total Profit'].apply(
-                lambda x: x.sum() / x.count()).to_dict()
-            sorted_avg_profit_by_country = dict(sorted(avg_profit_by_country.items()))
-
-            for country, avg_profit in sorted_avg_profit_by_country.items():
-                print(f"Country: {country}, Average Profit: {DataProcessor.format_currency(avg_profit)}")
-
-            return sorted_avg_profit_by_country
-        except Exception as e:
-            print(f"Error in calculating average profit by country: {e}")
-            raise
-
-    @staticmethod
-    def analyze_profit_by_region(chunk):
-        """
-            Method for analyzing profit by region
-        :param chunk:
-        :return:
-        """
-        try:
-            if 'Region' not in chunk.columns:
-                raise MissingColumnError("Missing 'Region' column. Cannot analyze profit by region.")
-            profit_by_region = chunk.groupby('Region')['Total Profit'].sum().to_dict()
-            sorted_profit_by_region = dict(sorted(profit_by_region.items(), key=lambda item: item[1], reverse=True))
-
-            for index, (region, profit) in enumerate(sorted_profit_by_region.items(), start=1):
-                print(f"{index}. Region: {region}, Total Profit: {DataProcessor.format_currency(profit)}")
-
-            return sorted_profit_by_region
-        except Exception as e:
-            print(f"Error in analyzing profit by region: {e}")
-            raise
-
-    def compare_profits(data, country1, country2):
-        """
-            Method for comparing profits
-        :param country1: user input
-        :param country2: user input
-        :return:
-        """
-        try:
-            print("Processing data...")
-            start_processing_time = time.time()
-            chunk_size = len(data) // 4
-            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
-            with mp.Pool(processes=4) as pool:
-                results_country1 = pool.starmap(DataProcessor.calculate_profit, [(chunk, country1) for chunk in chunks])
-                results_country2 = pool.starmap(DataProcessor.calculate_profit, [(chunk, country2) for chunk in chunks])
-
-            total_profit_country1 = sum(results_country1)
-            total_profit_country2 = sum(results_country2)
-            end_processing_time = time.time()
-
-            if total_profit_country1 == 0:
-                print(f"Warning: '{country1}' does not exist in the dataset or was entered incorrectly.")
-            else:
-                print(f"Total profit for {country1}: {DataProcessor.format_currency(total_profit_country1)}")
-
-            if total_profit_country2 == 0:
-                print(f"Warning: '{country2}' does not exist in the dataset or was entered incorrectly.")
-            else:
-                print(f"Total profit for {country2}: {DataProcessor.format_currency(total_profit_country2)}")
-
-            # Adding comparison of profits
-            if total_profit_country1 > total_profit_country2:
-                profit_diff = total_profit_country1 - total_profit_country2
-                print(f"{country1} has a higher profit by {DataProcessor.format_currency(profit_diff)}.")
-            elif total_profit_country2 > total_profit_country1:
-                profit_diff = total_profit_country2 - total_profit_country1
-                print(f"{country2} has a higher profit by {DataProcessor.format_currency(profit_diff)}.")
-            else:
-                print(f"Both {country1} and {country2} have equal profits.")
-
-            print(f"Processing completed in {end_processing_time - start_processing_time:.2f} seconds\n")
-        except Exception as e:
-            print(f"Error in comparing profits: {e}")
-            raise
-
-    @staticmethod
-    def analyze_trends(data, country):
-        """
-            Method for predicting future trends
-        :param data:
-        :param country:
-        :return:
-        """
-        try:
-            print(f"Analyzing trends by year for {country}...")
-            start_time = time.time()
-            chunk_size = len(data) // 4
-            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
-
-            with mp.Pool(processes=4) as pool:
-                results = pool.starmap(analyze_trends_for_country, [(chunk, country) for chunk in chunks])
-
-            yearly_top_products = {}
-            for result in results:
-                for _, row in result.iterrows():
-                    year = row['Year']
-                    if year not in yearly_top_products:
-                        yearly_top_products[year] = []
-                    yearly_top_products[year].append(row['Item Type'])
-
-            for year, products in sorted(yearly_top_products.items()):
-                print(f"Year {year}: {', '.join(products)}")
-
-            print(f"Trend analysis completed in {time.time() - start_time:.2f} seconds\n")
-        except Exception as e:
-            print(f"Error in analyzing trends: {e}")
-            raise
-
-    @staticmethod
-    def validate_data(data):
-        """
-            Method for validating data in csv
-        :param data:
-        :return:
-        """
-        try:
-            print("Validating and cleaning data...")
-            start_time = time.time()
-            chunk_size = len(data) // 4
-            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
-            with mp.Pool(processes=4) as pool:
-                results = pool.map(DataProcessor.validate_and_clean_data, chunks)
-
-            cleaned_chunks, invalid_counts = zip(*results)
-            cleaned_data = pd.concat(cleaned_chunks, ignore_index=True)
-            total_invalid = sum(invalid_counts)
-            print(f"Data validation and cleaning completed in {time.time() - start_time:.2f} seconds")
-            print(f"Total invalid rows removed: {total_invalid}\n")
-            return cleaned_data
-        except Exception as e:
-            print(f"Error in validating data: {e}")
-            raise
-
-    @staticmethod
-    def calculate_avg_profit(data):
-        """
-            Method for calculating average profit
-        :param data:
-        :return:
-        """
-        try:
-            print("Calculating average profit per order...")
-            start_time = time.time()
-            chunk_size = len(data) // 4
-            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
-            with mp.Pool(processes=4) as pool:
-                results = pool.map(DataProcessor.calculate_average_profit_per_order, chunks)
-            avg_profit = sum(results) / len(results) if results else 0
-            print(f"Average profit per order: {DataProcessor.format_currency(avg_profit)}")
-            print(f"Calculation completed in {time.time() - start_time:.2f} seconds\n")
-        except Exception as e:
-            print(f"Error in calculating average profit: {e}")
-            raise
-
-    @staticmethod
-    def calculate_profit_margin_data(data):
-        """
-            Method for calculating the margin profit
-        :param data:
-        :return:
-        """
-        try:
-            print("Calculating profit margin...")
-            start_time = time.time()
-            chunk_size = len(data) // 4
-            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
-            with mp.Pool(processes=4) as pool:
-                results = pool.map(DataProcessor.calculate_profit_margin, chunks)
-            all_margins = pd.concat(results, ignore_index=True)
-            for index, margin in all_margins.head(10).iterrows():
-                print(f"Product Name: {margin['Item Type']}, Profit Margin: {margin['Profit Margin']:.2%}")
-            print(f"Profit margin calculation completed in {time.time() - start_time:.2f} seconds\n")
-        except Exception as e:
-            print(f"Error in calculating profit margin data: {e}")
-            raise
-
-def analyze_trends_for_country(chunk, country):
-    """
-        Method for analyzing countries profit and best profitable item
-    :param chunk:
-    :param country:
-    :return:
-    """
-    try:
-        chunk['Year'] = pd.to_datetime(chunk['Order Date'], errors='coerce').dt.year
-        chunk = chunk[chunk['Country'] == country]
-        top_products_by_year = chunk.groupby(['Year', 'Item Type']).agg({'Units Sold': 'sum'}).reset_index()
-        top_products_by_year = top_products_by_year.sort_values(['Year', 'Units Sold'], ascending=[True, False])
-        top_products_by_year = top_products_by_year.groupby('Year').head(3)
-        return top_products_by_year
-    except Exception as e:
-        print(f"Error in analyzing trends for country '{country}': {e}")
-        raise
-
-
-
-
-def process_chunk(chunk, dest_file):
-    with open(dest_file, mode='a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerows(chunk)
-
-
-def read_csv_in_chunks(src_file, chunk_size):
-    """
-        :parameterrthod for diversing the csv dile in chunks
-    :param src_file:
-    :param chunk_size:
-    :return:
-    """
-    with open(src_file, mode='r', newline='', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        chunk = []
-        for row in reader:
-            chunk.append(row)
-            if len(chunk) >= chunk_size:
-                yield chunk
-                chunk = []
-        if chunk:
-            yield chunk
-
-
-def copy_csv_parallel(src_file, dest_folder, num_processes=4, chunk_size=50000):
-    """
-        method forcopiing csv pararerlly
-
-    """
-    if not os.path.exists(dest_folder):
-        os.makedirs(dest_folder)
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    dest_file = os.path.join(dest_folder, f"copied_file_{timestamp}.csv")
-
-    pool = mp.Pool(processes=num_processes)
-    chunks = read_csv_in_chunks(src_file, chunk_size)
-
-    results = []
-    for chunk in chunks:
-        results.append(pool.apply_async(process_chunk, args=(chunk, dest_file)))
-
-    pool.close()
-    pool.join()
-
-    print(f"Soubor {src_file} byl úspěšně zkopírován do {dest_file}.")
-
-
-class MainApp:
-    """
-        main branch of the program
-    """
-    def __init__(self, file_path):
-        self.file_path = file_path
-        self.data = None
-
-    def load_data(self):
-        """
-            Loading data method
-        :return: loaded data
-        """
-        try:
-            print("Loading data...")
-            start_load_time = time.time()
-            self.data = FileLoader.load_file(self.file_path)
-            if self.data is None:
-                raise ValueError("Failed to load the file.")
-            print(f"File loaded successfully in {time.time() - start_load_time:.2f} seconds\n")
-        except Exception as e:
-            print(f"Error in loading data: {e}")
-            raise
-
-    def menu(self):
-        """
-            Menu with options
-        :return:
-        """
-        try:
-            while True:
-                print("Menu:")
-                print("1. Compare profits between two countries")
-                print("2. Analyze yearly trends")
-                print("3. Validate and clean data")
-                print("4. Calculate average profit per order")
-                print("5. Calculate profit margin")
-                print("6. Calculate average profit by country")
-                print("7. Analyze profit by region")
-                print("8. Copy file")
-                print("9. Exit")
-
-                choice = input("Enter your choice: ")
-
-                if choice == '1':
-                    country1 = input("Enter first country: ")
-                    country2 = input("Enter second country: ")
-                    DataProcessor.compare_profits(self.data, country1, country2)
-                elif choice == '2':
-                    country = input("Enter the country for trend analysis: ")
-                    DataProcessor.analyze_trends(self.data, country)
-                elif choice == '3':
-                    self.data = DataProcessor.validate_data(self.data)
-                elif choice == '4':
-                    DataProcessor.calculate_avg_profit(self.data)
-                elif choice == '5':
-                    DataProcessor.calculate_profit_margin_data(self.data)
-                elif choice == '6':
-                    avg_profit_by_country = DataProcessor.calculate_average_profit_by_country(self.data)
-                    for country, avg_profit in avg_profit_by_country.items():
-                        print(f"Average profit for {country}: {DataProcessor.format_currency(avg_profit)}")
-                elif choice == '7':
-                    profit_by_region = DataProcessor.analyze_profit_by_region(self.data)
-                    for region, profit in profit_by_region.items():
-                        print(f"Profit for {region}: {DataProcessor.format_currency(profit)}")
-                elif choice == '8':
-                    dest_folder = 'new_file'
-                    copy_csv_parallel("records.cvs", dest_folder)
-                elif choice == '9':
-                    break
-                else:
-                    print("Invalid choice. Please try again.")
-        except Exception as e:
-            print(f"Error in menu operation: {e}")
-            raise
-
-if __name__ == "__main__":
-    app = MainApp("record.csv")
-    app.load_data()
-    app.menu()
+import pandas as pd
+import numpy as np
+import multiprocessing as mp
+import os
+import csv
+import io
+import codecs
+import json
+import hashlib
+import shutil
+import argparse
+import asyncio
+import re
+import glob
+import math
+import sys
+from datetime import datetime
+
+from metrics import Metrics, ProfitLog
+from store import (ColumnStore, PartitionedDataset, encode_columns, decode_columns, CACHE_VERSION, PARQUET_AVAILABLE,
+                   PARTITION_MANIFEST)
+from scheduler import WorkerPool, SCHEDULER_BACKENDS, SCHEDULER_MEMORY_BUDGET
+from result_cache import ResultCache
+from server import AnalyticsServer, query_server, SOCKET_PATH
+
+
+class FileNotFoundError(Exception):
+    pass
+
+
+class MissingColumnError(Exception):
+    pass
+
+
+# Declared schema of the sales csv, columns outside of it are never parsed
+SALES_CATEGORY_COLUMNS = ['Region', 'Country', 'Item Type']
+SALES_NUMERIC_DTYPES = {
+    'Order ID': 'int64',
+    'Units Sold': 'int32',
+    'Unit Price': 'float32',
+    'Unit Cost': 'float32',
+    'Total Revenue': 'float64',
+    'Total Cost': 'float64',
+    'Total Profit': 'float64',
+}
+SALES_DATE_COLUMN = 'Order Date'
+SALES_COLUMNS = SALES_CATEGORY_COLUMNS + [SALES_DATE_COLUMN] + list(SALES_NUMERIC_DTYPES)
+# integer columns derived from Order Date once at load, so no operation parses dates again
+SALES_DATE_PARTS = {'Year': 'int16', 'Quarter': 'int8', 'Month': 'int8'}
+# files picked from a directory, pandas decompresses them by extension
+CSV_EXTENSIONS = ('.csv', '.csv.gz', '.csv.bz2', '.csv.xz', '.csv.zip')
+ISO_DATE_FORMAT = '%Y-%m-%d'
+SALES_DATE_FORMAT = '%m/%d/%Y'
+STREAM_CHUNK_SIZE = 200000
+# quantiles of ProfitSketch are within PROFIT_SKETCH_ACCURACY of the true value (relative error)
+PROFIT_SKETCH_ACCURACY = 0.01
+PROFIT_SKETCH_MAX_BUCKETS = 2048
+PROFIT_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+COPY_RANGE_SIZE = 64 * 1024 ** 2
+COPY_BLOCK_SIZE = 1024 ** 2
+VALIDATION_POSITIVE_COLUMNS = ['Units Sold', 'Unit Price', 'Unit Cost', 'Total Revenue']
+# key of --dedup-keys without columns, a valid row repeating the key of an earlier one is dropped as a duplicate
+DEDUP_KEYS = ['Order ID']
+
+
+class FileLoader:
+    """
+        Method for loading the file
+    """
+    @staticmethod
+    def load_file(file_path, use_cache=True, use_store=False, pool=None):
+        if PartitionedDataset.is_dataset(file_path):
+            return FileLoader.load_partitions(file_path)
+        if FileLoader.is_multi_file(file_path):
+            return FileLoader.load_files(file_path, use_cache, pool)
+        try:
+            if not os.path.isfile(file_path):
+                raise FileNotFoundError(f"Error: The file '{file_path}' does not exist.")
+
+            with Metrics.operation('load_file', bytes_moved=FileLoader.file_size(file_path)) as metrics:
+                data, source = FileLoader.read_source(file_path, use_cache, use_store)
+                metrics['rows'] = len(data)
+            print(f"Loaded '{file_path}' from {source} in {metrics['wall']:.2f} seconds "
+                  f"({'warm' if source in ('cache', 'store') else 'cold'})")
+            return data
+        except (FileNotFoundError, MissingColumnError, Exception) as e:
+            print(e)
+            return None
+
+    @staticmethod
+    def is_multi_file(path):
+        """
+            Whether path is a glob pattern or a directory of csv files rather than one file
+        """
+        return bool(re.search(r'[*?\[]', path)) or (os.path.isdir(path) and not PartitionedDataset.is_dataset(path))
+
+    @staticmethod
+    def source_files(path):
+        """
+            Csv files of a path: the matches of a glob pattern, the csv files of a directory or the file itself
+        :param path: file, directory or glob pattern like 'exports/2021-06-*.csv.gz'
+        :return: sorted list of paths
+        """
+        if re.search(r'[*?\[]', path):
+            matches = glob.glob(path, recursive=True)
+        elif os.path.isdir(path):
+            matches = [os.path.join(path, name) for name in os.listdir(path)]
+        else:
+            return [path]
+        # the cache sidecars next to the files are never inputs
+        files = [match for match in matches if match.lower().endswith(CSV_EXTENSIONS) and os.path.isfile(match)]
+        if not files:
+            raise FileNotFoundError(f"Error: No csv files match '{path}'.")
+        return sorted(files)
+
+    @staticmethod
+    def load_files(path, use_cache=True, pool=None):
+        """
+            Loading many csv files, compressed ones included, each parsed and schema-checked in its own worker
+        :param path: directory or glob pattern
+        :param use_cache: whether every file reads and writes its columnar sidecar
+        :param pool: persistent WorkerPool
+        :return: one DataFrame in file order, None when a file cannot be read
+        """
+        try:
+            files = FileLoader.source_files(path)
+            size = sum(FileLoader.file_size(f) or 0 for f in files)
+            with Metrics.operation('load_files', bytes_moved=size) as metrics:
+                if pool is None:
+                    with WorkerPool() as temporary_pool:
+                        results = temporary_pool.map_files(FileLoader.read_file, files, use_cache, bytes_moved=size)
+                else:
+                    results = pool.map_files(FileLoader.read_file, files, use_cache, bytes_moved=size)
+                with Metrics.stage('concat'):
+                    data = FileLoader.concat([frame for frame, _ in results])
+                metrics['rows'] = len(data)
+            cached = sum(source == 'cache' for _, source in results)
+            print(f"Loaded {len(files)} files matching '{path}' in {metrics['wall']:.2f} seconds "
+                  f"({cached} from cache, {len(files) - cached} parsed)")
+            return data
+        except (FileNotFoundError, MissingColumnError, Exception) as e:
+            print(e)
+            return None
+
+    @staticmethod
+    def concat(frames):
+        """
+            Concatenating frames read with the sales schema, text columns stay categorical
+        :param frames: list of DataFrames
+        :return: DataFrame with a new RangeIndex
+        """
+        if len(frames) == 1:
+            return frames[0]
+        data = pd.concat(frames, ignore_index=True)
+        for column in SALES_CATEGORY_COLUMNS:
+            if column not in data.columns or isinstance(data[column].dtype, pd.CategoricalDtype):
+                continue
+            parts = [frame[column] for frame in frames if column in frame.columns]
+            try:
+                if len(parts) != len(frames):
+                    raise TypeError(f"{column} is missing in some frames")
+                data[column] = pd.api.types.union_categoricals(parts, ignore_order=True)
+            except TypeError:
+                # not categorical everywhere, or categories of different dtypes
+                data[column] = data[column].astype('category')
+        return data
+
+    @staticmethod
+    def load_partitions(root, countries=None, regions=None):
+        """
+            Loading only the partitions of a partitioned dataset that hold the requested countries or regions
+        :param root: directory written by PartitionedDataset.write
+        :param countries: countries to load, None for all of them
+        :param regions: regions to load, None for all of them
+        :return: DataFrame, None when the dataset cannot be read
+        """
+        try:
+            manifest, entries = PartitionedDataset.partitions(root, countries, regions)
+            selected = sum(entry['bytes'] for entry in entries)
+            with Metrics.operation('load_partitions', bytes_moved=selected) as metrics:
+                data = PartitionedDataset.read(root, manifest, entries, FileLoader.concat)
+                metrics['rows'] = len(data)
+            total = sum(entry['bytes'] for entry in manifest['partitions'])
+            print(f"Loaded {len(entries)} of {len(manifest['partitions'])} partitions of '{root}' "
+                  f"({selected / 1024 ** 2:.1f} of {total / 1024 ** 2:.1f} MB) in {metrics['wall']:.2f} seconds")
+            return data
+        except Exception as e:
+            print(f"Error: Unable to read the partitioned dataset '{root}'. {e}")
+            return None
+
+    @staticmethod
+    def read_file(file_path, use_cache=True):
+        """
+            Reading one of many files in a worker, schema errors name the file
+        :param file_path: path to the csv file
+        :param use_cache: whether the columnar sidecar is used
+        :return: (DataFrame, 'cache' or 'csv')
+        """
+        try:
+            return FileLoader.read_source(file_path, use_cache)
+        except MissingColumnError as e:
+            raise MissingColumnError(f"{e} File: '{file_path}'.")
+
+    @staticmethod
+    def read_source(file_path, use_cache=True, use_store=False):
+        """
+            Reading the data from the cache when it is current, otherwise parsing the csv and writing the cache
+        :param file_path: path to the csv file
+        :param use_cache: whether the columnar sidecar is used
+        :param use_store: whether the data is mapped from the ColumnStore, which is written first when outdated
+        :return: (DataFrame, 'store', 'cache' or 'csv')
+        """
+        if use_store:
+            source_key = FileLoader.source_key(file_path)
+            with Metrics.stage('map store'):
+                data = ColumnStore.open(file_path, source_key)
+            if data is not None:
+                return data, 'store'
+            data, source = FileLoader.read_source(file_path, use_cache)
+            with Metrics.stage('write store', rows=len(data)):
+                ColumnStore.write(file_path, data, source_key)
+                stored = ColumnStore.open(file_path, FileLoader.source_key(file_path))
+            return (data if stored is None else stored), source
+
+        source_key = FileLoader.source_key(file_path) if use_cache else None
+        if source_key is not None:
+            with Metrics.stage('read cache'):
+                data = FileLoader.read_cache(file_path, source_key)
+            if data is not None:
+                return data, 'cache'
+
+        with Metrics.stage('parse csv', bytes_moved=FileLoader.file_size(file_path)) as record:
+            try:
+                data = pd.read_csv(
+                    file_path,
+                    usecols=lambda column: column in SALES_COLUMNS,
+                    dtype={column: 'category' for column in SALES_CATEGORY_COLUMNS},
+                )
+            except Exception as e:
+                raise Exception(f"Error: Unable to read the file '{file_path}'. {e}")
+            record['rows'] = len(data)
+
+        required_columns = ['Country', 'Total Profit', 'Order Date']
+        missing_columns = [col for col in required_columns if col not in data.columns]
+        if missing_columns:
+            raise MissingColumnError(f"Error: Missing required columns: {', '.join(missing_columns)}.")
+
+        with Metrics.stage('apply schema', rows=len(data)):
+            data = FileLoader.apply_schema(data)
+        if source_key is not None:
+            with Metrics.stage('write cache', rows=len(data)):
+                FileLoader.write_cache(file_path, source_key, data)
+        return data, 'csv'
+
+    @staticmethod
+    def iter_chunks(file_path, chunk_size=STREAM_CHUNK_SIZE):
+        """
+            Reading the csv, directory or glob in bounded chunks with the sales schema
+        :param file_path: path to the csv file, directory or glob pattern
+        :param chunk_size: rows per chunk
+        :return: generator of DataFrame chunks
+        """
+        if FileLoader.is_multi_file(file_path):
+            for source_file in FileLoader.source_files(file_path):
+                yield from FileLoader.iter_chunks(source_file, chunk_size)
+            return
+        if not os.path.isfile(file_path):
+            raise FileNotFoundError(f"Error: The file '{file_path}' does not exist.")
+        with pd.read_csv(
+            file_path,
+            usecols=lambda column: column in SALES_COLUMNS,
+            dtype={column: 'category' for column in SALES_CATEGORY_COLUMNS},
+            chunksize=chunk_size,
+        ) as reader:
+            for chunk in reader:
+                required_columns = ['Country', 'Total Profit', 'Order Date']
+                missing_columns = [col for col in required_columns if col not in chunk.columns]
+                if missing_columns:
+                    raise MissingColumnError(f"Error: Missing required columns: {', '.join(missing_columns)}.")
+                yield FileLoader.apply_schema(chunk)
+
+    @staticmethod
+    def apply_schema(data):
+        """
+            Converting parsed columns to the declared sales schema, bad values become NaN/NaT for validate_data
+        :param data: DataFrame read from the csv
+        :return: DataFrame with category, downcast numeric and datetime columns
+        """
+        for column in SALES_CATEGORY_COLUMNS:
+            if column in data.columns and not isinstance(data[column].dtype, pd.CategoricalDtype):
+                data[column] = data[column].astype('category')
+        for column, dtype in SALES_NUMERIC_DTYPES.items():
+            if column in data.columns:
+                data[column] = FileLoader.downcast(data[column], dtype)
+        if SALES_DATE_COLUMN in data.columns:
+            data[SALES_DATE_COLUMN] = FileLoader.parse_dates(data[SALES_DATE_COLUMN])
+            FileLoader.add_date_parts(data)
+        return data
+
+    @staticmethod
+    def add_date_parts(data):
+        """
+            Deriving the Year, Quarter and Month columns from the parsed Order Date
+        :param data: DataFrame with a datetime Order Date, changed in place
+        :return: data
+        """
+        dates = data[SALES_DATE_COLUMN].dt
+        for part, dtype in SALES_DATE_PARTS.items():
+            # rows with a missing date keep NaN (float) until validation drops them
+            data[part] = FileLoader.downcast(getattr(dates, part.lower()), dtype)
+        return data
+
+    @staticmethod
+    def date_part(data, part):
+        """
+            Year, Quarter or Month of every row, read from the derived column when the data was loaded with the schema
+        :param data:
+        :param part: one of SALES_DATE_PARTS
+        :return: Series
+        """
+        if part in data.columns:
+            return data[part]
+        return getattr(FileLoader.parse_dates(data[SALES_DATE_COLUMN]).dt, part.lower()).rename(part)
+
+    @staticmethod
+    def restore_valid_dtypes(data):
+        """
+            Restoring the declared dtypes of validated rows, columns that held invalid values were widened at load
+        :param data: validated DataFrame, changed in place
+        :return: data
+        """
+        if not pd.api.types.is_numeric_dtype(data['Total Profit'].dtype):
+            data['Total Profit'] = pd.to_numeric(data['Total Profit'], errors='coerce')
+        data[SALES_DATE_COLUMN] = FileLoader.parse_dates(data[SALES_DATE_COLUMN])
+        for part, dtype in SALES_DATE_PARTS.items():
+            if part in data.columns and data[part].dtype != dtype:
+                data[part] = FileLoader.downcast(data[part], dtype)
+        return data
+
+    @staticmethod
+    def downcast(column, dtype):
+        """
+            Casting a numeric column to the declared dtype when it is safe
+        :param column: parsed column
+        :param dtype: declared dtype
+        :return: column as dtype, or as float when it holds missing, fractional or out of range values
+        """
+        if not pd.api.types.is_numeric_dtype(column.dtype):
+            column = pd.to_numeric(column, errors='coerce')
+        target = np.dtype(dtype)
+        if target.kind == 'i':
+            limits = np.iinfo(target)
+            values = column.to_numpy(dtype='float64')
+            if (np.isnan(values).any() or (values % 1 != 0).any()
+                    or values.min(initial=0) < limits.min or values.max(initial=0) > limits.max):
+                return column.astype('float32' if target.itemsize <= 4 else 'float64')
+        return column.astype(target)
+
+    @staticmethod
+    def parse_dates(column):
+        """
+            Parsing dates with a fixed format picked from the first value, the values it misses are parsed again
+        :param column: column with date strings
+        :return: datetime column, unparsable values are NaT
+        """
+        if pd.api.types.is_datetime64_dtype(column.dtype):
+            return column
+        first = column.dropna().head(1)
+        date_format = SALES_DATE_FORMAT
+        if not first.empty and re.match(r'^\d{4}-\d{2}-\d{2}', str(first.iloc[0])):
+            date_format = ISO_DATE_FORMAT
+        dates = pd.to_datetime(column, format=date_format, errors='coerce')
+        # other formats, e.g. with a time part, are parsed per value like pd.to_datetime does without a format
+        failed = dates.isna() & column.notna()
+        if failed.any():
+            dates[failed] = pd.to_datetime(column[failed], format='mixed', errors='coerce')
+        return dates
+
+    @staticmethod
+    def file_size(file_path):
+        """
+            Size of the file in bytes, None when it cannot be stat-ed
+        """
+        try:
+            return os.path.getsize(file_path)
+        except OSError:
+            return None
+
+    @staticmethod
+    def source_key(file_path):
+        """
+            Key identifying the current version of the source file
+        :param file_path: path to the csv file
+        :return: dict with path, size and mtime, or None when the file cannot be stat-ed
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return {
+            'version': CACHE_VERSION,
+            'path': os.path.abspath(file_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }
+
+    @staticmethod
+    def fingerprint(path):
+        """
+            Fingerprint of the current version of the input files
+        :param path: input path
+        :return: hex digest, None when an input file cannot be stat-ed
+        """
+        try:
+            if PartitionedDataset.is_dataset(path):
+                files = [os.path.join(path, PARTITION_MANIFEST)]
+            else:
+                files = FileLoader.source_files(path)
+        except FileNotFoundError:
+            return None
+        keys = [FileLoader.source_key(file_path) for file_path in files]
+        if any(key is None for key in keys):
+            return None
+        return hashlib.sha1(json.dumps(keys, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def cache_paths(file_path):
+        """
+            Paths of the columnar sidecar belonging to the csv file
+        :param file_path: path to the csv file
+        :return: (meta path, parquet path, npz path)
+        """
+        base = f"{file_path}.cache"
+        return f"{base}.json", f"{base}.parquet", f"{base}.npz"
+
+    @staticmethod
+    def read_cache(file_path, source_key):
+        """
+            Reading the columnar sidecar if it still matches the source file
+        :param file_path: path to the csv file
+        :param source_key: current key of the source file
+        :return: cached DataFrame, or None when the cache is missing or stale
+        """
+        meta_path, parquet_path, npz_path = FileLoader.cache_paths(file_path)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('key') != source_key:
+                return None
+            if meta['format'] == 'parquet':
+                if not PARQUET_AVAILABLE:
+                    return None
+                return pd.read_parquet(parquet_path)
+            with np.load(npz_path, allow_pickle=False) as arrays:
+                return decode_columns(arrays, meta['columns'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def write_cache(file_path, source_key, data):
+        """
+            Writing the columnar sidecar, the meta file is written last so a partial write is never used
+        :param file_path: path to the csv file
+        :param source_key: key of the source file the data was parsed from
+        :param data: parsed DataFrame
+        """
+        meta_path, parquet_path, npz_path = FileLoader.cache_paths(file_path)
+        try:
+            meta = {'key': source_key}
+            if PARQUET_AVAILABLE:
+                meta['format'] = 'parquet'
+                data.to_parquet(parquet_path + '.tmp', index=False)
+                os.replace(parquet_path + '.tmp', parquet_path)
+            else:
+                meta['format'] = 'npz'
+                arrays, meta['columns'] = encode_columns(data)
+                with open(npz_path + '.tmp', 'wb') as f:
+                    np.savez(f, **arrays)
+                os.replace(npz_path + '.tmp', npz_path)
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.tmp', meta_path)
+        except Exception as e:
+            print(f"Warning: Unable to write cache for '{file_path}'. {e}")
+
+
+class AppendCursor:
+    """
+        Position up to which a csv growing by appended rows was processed, a refresh parses only the lines after it
+    """
+
+    def __init__(self, file_path, header, offset, rows):
+        self.file_path = file_path
+        self.header = header
+        self.offset = offset
+        self.rows = rows
+
+    @staticmethod
+    def at_end(file_path, rows):
+        """
+            Cursor after the last line of the file
+        :param file_path: path to the csv file
+        :param rows: data rows processed up to the end
+        :return: AppendCursor, None for compressed files, directories and files not ending with a complete line
+        """
+        if not os.path.isfile(file_path) or file_path.lower().endswith(CSV_EXTENSIONS[1:]):
+            return None
+        offset = os.path.getsize(file_path)
+        header = AppendCursor.read_header(file_path)
+        # a last line without a newline may still be written, where the next row starts is unknown
+        if header is None or AppendCursor.line_end(file_path, offset) != offset:
+            return None
+        return AppendCursor(file_path, header, offset, rows)
+
+    @staticmethod
+    def read_header(file_path):
+        """
+            Column names from the first line of the csv
+        :return: list of names, None for an empty file
+        """
+        with open(file_path, newline='', encoding='utf-8-sig') as f:
+            return next(csv.reader(f), None)
+
+    @staticmethod
+    def line_end(file_path, size):
+        """
+            Offset after the last newline before size, so a row being appended is left for the next refresh
+        :param file_path: path to the csv file
+        :param size: offset to search back from
+        :return: offset, 0 when there is no complete line
+        """
+        with open(file_path, 'rb') as f:
+            end = size
+            while end > 0:
+                start = max(0, end - COPY_BLOCK_SIZE)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    return start + newline + 1
+                end = start
+        return 0
+
+    @staticmethod
+    def parse_numbers(chunk):
+        """
+            Converting the numeric columns that hold only numbers with NumPy
+        :param chunk: DataFrame of strings, changed in place
+        """
+        for column, dtype in SALES_NUMERIC_DTYPES.items():
+            if column in chunk.columns:
+                try:
+                    values = chunk[column].to_numpy().astype('int64' if np.dtype(dtype).kind == 'i' else 'float64')
+                except (ValueError, TypeError, OverflowError):
+                    continue
+                chunk[column] = values
+
+    def is_appended(self):
+        """
+            Whether the file still holds the processed lines, i.e. it was appended to and not replaced or truncated
+        """
+        if not os.path.isfile(self.file_path) or os.path.getsize(self.file_path) < self.offset:
+            return False
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.offset - 1)
+            if f.read(1) != b'\n':
+                return False
+        return AppendCursor.read_header(self.file_path) == self.header
+
+    def read(self, chunk_size=STREAM_CHUNK_SIZE):
+        """
+            Parsing the complete lines appended after the cursor with the sales schema, the cursor moves past them
+        :param chunk_size: rows per chunk
+        :return: generator of DataFrame chunks
+        """
+        stop = AppendCursor.line_end(self.file_path, os.path.getsize(self.file_path))
+        columns = [column for column in self.header if column in SALES_COLUMNS]
+        missing_columns = [column for column in ['Country', 'Total Profit', 'Order Date'] if column not in columns]
+        if missing_columns:
+            raise MissingColumnError(f"Error: Missing required columns: {', '.join(missing_columns)}.")
+        positions = [self.header.index(column) for column in columns]
+        for rows in read_csv_in_chunks(self.file_path, chunk_size, self.offset, stop):
+            chunk = pd.DataFrame(rows, dtype=object).reindex(columns=positions)
+            chunk.columns = columns
+            # empty fields are missing like in pd.read_csv, numbers and dates are coerced by apply_schema anyway
+            for column in SALES_CATEGORY_COLUMNS:
+                if column in chunk.columns:
+                    chunk[column] = chunk[column].mask(chunk[column] == '')
+            AppendCursor.parse_numbers(chunk)
+            self.rows += len(chunk)
+            yield FileLoader.apply_schema(chunk)
+        self.offset = stop
+
+
+class GroupKernel:
+    """
+        Group aggregations on factorized keys with vectorized NumPy reductions
+    """
+    STATS = ('sum', 'count', 'mean', 'min', 'max', 'size')
+    # mixed-radix codes of several keys are compacted with bincount up to this many combinations, np.unique above
+    DENSE_GROUPS = 1 << 22
+
+    @staticmethod
+    def factorize_key(column, strip=False):
+        """
+            Codes and labels of one key column, missing values get code -1
+        :param column: Series
+        :param strip: whether labels differing only in surrounding spaces are one group
+        :return: (int64 codes, labels Index)
+        """
+        values = column.to_numpy() if column.dtype.kind in 'iu' else None
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = column.array.codes.astype(np.int64)
+            labels = column.cat.categories
+        elif values is not None and len(values) and int(values.max()) - int(values.min()) < GroupKernel.DENSE_GROUPS:
+            # small integer keys like Year are their own codes, unused values are dropped with the empty groups
+            low = int(values.min())
+            codes = values.astype(np.int64) - low
+            labels = pd.Index(np.arange(low, int(values.max()) + 1, dtype=values.dtype))
+        else:
+            codes, labels = pd.factorize(column.to_numpy())
+            codes = codes.astype(np.int64)
+            labels = pd.Index(labels)
+        if strip and (labels.dtype == object or pd.api.types.is_string_dtype(labels.dtype)):
+            # stripping the labels instead of the rows, the same country with and without spaces becomes one code
+            remap, labels = pd.factorize(labels.str.strip())
+            codes = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+            labels = pd.Index(labels)
+        return codes, labels.rename(column.name)
+
+    @staticmethod
+    def factorize(data, keys, strip=False):
+        """
+            One code per row for a key set, rows with a missing key get -1
+        :param data: DataFrame
+        :param keys: column names or Series aligned with data
+        :param strip: see factorize_key
+        :return: (int64 codes, Index or MultiIndex of the groups)
+        """
+        factorized = [GroupKernel.factorize_key(data[key] if isinstance(key, str) else key, strip) for key in keys]
+        if len(factorized) == 1:
+            return factorized[0]
+        sizes = [max(len(labels), 1) for _, labels in factorized]
+        combined = np.zeros(len(data), dtype=np.int64)
+        missing = None
+        for codes, size in zip((codes for codes, _ in factorized), sizes):
+            if len(codes) and codes.min() < 0:
+                missing = codes < 0 if missing is None else missing | (codes < 0)
+                codes = np.maximum(codes, 0)
+            combined *= size
+            combined += codes
+        valid = combined if missing is None else combined[~missing]
+        if math.prod(sizes) <= GroupKernel.DENSE_GROUPS:
+            used = np.flatnonzero(np.bincount(valid, minlength=math.prod(sizes)))
+            remap = np.full(math.prod(sizes), -1, dtype=np.int64)
+            remap[used] = np.arange(len(used))
+            codes = remap[combined]
+        else:
+            used, inverse = np.unique(valid, return_inverse=True)
+            codes = np.empty(len(data), dtype=np.int64)
+            codes[slice(None) if missing is None else ~missing] = inverse
+        if missing is not None:
+            codes[missing] = -1
+        levels = []
+        for (_, labels), size, stride in zip(factorized, sizes, GroupKernel.strides(sizes)):
+            levels.append(labels[(used // stride) % size] if len(labels) else labels)
+        return codes, pd.MultiIndex.from_arrays(levels, names=[labels.name for _, labels in factorized])
+
+    @staticmethod
+    def strides(sizes):
+        """
+            Place values of every key in the mixed-radix code
+        """
+        strides = []
+        stride = 1
+        for size in reversed(sizes):
+            strides.append(stride)
+            stride *= size
+        return strides[::-1]
+
+    @staticmethod
+    def reduce(codes, values, stat, groups, sizes):
+        """
+            One statistic of values per group code, NaN values are skipped like in pandas
+        :param codes: int64 codes without -1
+        :param values: array of the rows with a valid code
+        :param stat: one of STATS
+        :param groups: number of groups
+        :param sizes: rows per group
+        :return: array with one value per group
+        """
+        if stat == 'size':
+            return sizes
+        integer = values.dtype.kind in 'iub'
+        counts = sizes
+        if not integer:
+            missing = np.isnan(values)
+            if missing.any():
+                codes, values = codes[~missing], values[~missing]
+                counts = np.bincount(codes, minlength=groups)
+        if stat == 'count':
+            return counts
+        if stat in ('sum', 'mean'):
+            # float64 sums of integers are exact below 2**53
+            sums = np.bincount(codes, weights=values, minlength=groups)
+            if stat == 'sum':
+                return sums.astype(np.int64) if integer else sums
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return sums / counts
+        extremes = np.full(groups, np.inf if stat == 'min' else -np.inf)
+        (np.minimum if stat == 'min' else np.maximum).at(extremes, codes, values.astype(np.float64, copy=False))
+        extremes[counts == 0] = np.nan
+        return extremes
+
+    @staticmethod
+    def aggregate(data, keys, aggregations, strip=False, sort=True):
+        """
+            Named aggregations per group, like data.groupby(keys, observed=True).agg(**aggregations)
+        :param data: DataFrame
+        :param keys: column names or Series aligned with data
+        :param aggregations: dict output column -> (value column name or array, stat), the column is ignored for 'size'
+        :param strip: see factorize_key
+        :param sort: whether the groups are sorted by their labels
+        :return: DataFrame indexed by the groups that have rows
+        """
+        codes, labels = GroupKernel.factorize(data, keys, strip)
+        valid = slice(None)
+        if len(codes) and codes.min() < 0:
+            valid = codes >= 0
+            codes = codes[valid]
+        groups = len(labels)
+        sizes = np.bincount(codes, minlength=groups)
+        columns = {}
+        for name, (column, stat) in aggregations.items():
+            if stat not in GroupKernel.STATS:
+                raise ValueError(f"Unknown statistic '{stat}', choose from: {', '.join(GroupKernel.STATS)}")
+            values = None
+            if stat != 'size':
+                values = data[column] if isinstance(column, str) else column
+                values = np.asarray(values.to_numpy() if isinstance(values, pd.Series) else values)[valid]
+            columns[name] = GroupKernel.reduce(codes, values, stat, groups, sizes)
+        observed = sizes > 0
+        table = pd.DataFrame({name: values[observed] for name, values in columns.items()},
+                             index=labels[observed])
+        return table.sort_index() if sort else table
+
+    @staticmethod
+    def sum(data, keys, columns):
+        """
+            Sums of columns per group, sorted by the groups, used to merge partial tables
+        :param data: DataFrame
+        :param keys: column names
+        :param columns: value column names
+        :return: DataFrame indexed by the groups that have rows
+        """
+        return GroupKernel.aggregate(data, keys, {column: (column, 'sum') for column in columns})
+
+
+class ProfitSummary:
+    """
+        Mergeable sum, count, min and max of Total Profit
+    """
+    __slots__ = ('total', 'count', 'minimum', 'maximum')
+
+    def __init__(self, total=0.0, count=0, minimum=float('inf'), maximum=float('-inf')):
+        self.total = total
+        self.count = count
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @staticmethod
+    def from_chunk(chunk):
+        """
+            Summarizing the Total Profit of a chunk
+        :param chunk:
+        :return: ProfitSummary
+        """
+        profit = chunk['Total Profit'].to_numpy(dtype='float64')
+        profit = profit[~np.isnan(profit)]
+        if len(profit) == 0:
+            return ProfitSummary()
+        return ProfitSummary(float(profit.sum()), len(profit), float(profit.min()), float(profit.max()))
+
+    def merge(self, other):
+        """
+            Merging another summary into this one
+        :param other: ProfitSummary
+        :return: self
+        """
+        self.total += other.total
+        self.count += other.count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0
+
+    def stats(self):
+        """
+            Summary as a dict for the profit log
+        """
+        return {'orders': self.count, 'total_profit': self.total,
+                'min_profit': self.minimum if self.count else None,
+                'max_profit': self.maximum if self.count else None,
+                'average_profit': self.mean}
+
+    def __repr__(self):
+        return f"ProfitSummary(total={self.total}, count={self.count}, minimum={self.minimum}, maximum={self.maximum})"
+
+
+class ProfitSketch:
+    """
+        Mergeable quantile sketch of Total Profit with logarithmic buckets (DDSketch style)
+    """
+    __slots__ = ('positive', 'negative', 'zero', 'count')
+    GAMMA = (1 + PROFIT_SKETCH_ACCURACY) / (1 - PROFIT_SKETCH_ACCURACY)
+    LOG_GAMMA = math.log(GAMMA)
+
+    def __init__(self):
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+
+    @staticmethod
+    def bucket_indexes(values):
+        """
+            Bucket of every value, its sign and the index of its magnitude (0 for zero)
+        :param values: float array without NaN
+        :return: (signs, indexes)
+        """
+        signs = np.sign(values).astype(np.int8)
+        magnitudes = np.abs(values)
+        indexes = np.zeros(len(values), dtype=np.int64)
+        nonzero = magnitudes > 0
+        indexes[nonzero] = np.ceil(np.log(magnitudes[nonzero]) / ProfitSketch.LOG_GAMMA)
+        return signs, indexes
+
+    @staticmethod
+    def from_chunk(chunk):
+        """
+            Sketch of the Total Profit of a chunk
+        :param chunk:
+        :return: ProfitSketch
+        """
+        profit = chunk['Total Profit'].to_numpy(dtype='float64')
+        profit = profit[~np.isnan(profit)]
+        sketch = ProfitSketch()
+        signs, indexes = ProfitSketch.bucket_indexes(profit)
+        for sign, index, count in zip(*ProfitSketch.count_buckets(signs, indexes)):
+            sketch.add(sign, index, count)
+        return sketch
+
+    @staticmethod
+    def by_group(chunk, columns=('Country', 'Region')):
+        """
+            Sketches of the Total Profit per group, the buckets are computed once for all columns
+        :param chunk:
+        :param columns: grouping columns
+        :return: dict column -> {group: ProfitSketch}
+        """
+        profit = chunk['Total Profit'].to_numpy(dtype='float64')
+        valid = ~np.isnan(profit)
+        signs, indexes = ProfitSketch.bucket_indexes(profit[valid])
+        sketches = {}
+        for column in columns:
+            if column not in chunk.columns:
+                continue
+            codes, groups = GroupKernel.factorize_key(chunk[column])
+            codes = codes[valid]
+            table = sketches[column] = {}
+            # one count per (group, sign, bucket) instead of one update per row
+            for code, sign, index, count in zip(*ProfitSketch.count_buckets(signs, indexes, codes)):
+                if code >= 0:
+                    table.setdefault(groups[code], ProfitSketch()).add(sign, index, count)
+        return sketches
+
+    @staticmethod
+    def count_buckets(signs, indexes, codes=None):
+        """
+            Number of values per distinct (code, sign, index)
+        :return: tuple of arrays (codes, signs, indexes, counts), without codes when none are given
+        """
+        keys = [signs, indexes] if codes is None else [codes, signs, indexes]
+        if len(indexes) == 0:
+            return tuple([] for _ in range(len(keys) + 1))
+        unique, counts = np.unique(np.stack([np.asarray(key, dtype=np.int64) for key in keys]), axis=1,
+                                   return_counts=True)
+        return tuple(unique[row].tolist() for row in range(len(keys))) + (counts.tolist(),)
+
+    def add(self, sign, index, count):
+        """
+            Adding count values to a bucket
+        """
+        self.count += count
+        if sign == 0:
+            self.zero += count
+            return
+        buckets = self.positive if sign > 0 else self.negative
+        buckets[index] = buckets.get(index, 0) + count
+        if len(buckets) > PROFIT_SKETCH_MAX_BUCKETS:
+            ProfitSketch.collapse(buckets)
+
+    @staticmethod
+    def collapse(buckets):
+        """
+            Merging the buckets of the smallest magnitudes until PROFIT_SKETCH_MAX_BUCKETS are left
+        """
+        indexes = sorted(buckets)
+        excess = len(indexes) - PROFIT_SKETCH_MAX_BUCKETS
+        if excess <= 0:
+            return
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            buckets[target] += buckets.pop(index)
+
+    def merge(self, other):
+        """
+            Merging another sketch into this one
+        :param other: ProfitSketch
+        :return: self
+        """
+        self.zero += other.zero
+        self.count += other.count
+        for buckets, other_buckets in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_buckets.items():
+                buckets[index] = buckets.get(index, 0) + count
+            ProfitSketch.collapse(buckets)
+        return self
+
+    @staticmethod
+    def bucket_value(index):
+        """
+            Value reported for a bucket, within the relative accuracy of every value in it
+        """
+        return 2 * ProfitSketch.GAMMA ** index / (ProfitSketch.GAMMA + 1)
+
+    def quantile(self, q):
+        """
+            Approximate q-quantile, the value of rank floor(q * (count - 1)) in sorted order
+        :param q: between 0 and 1
+        :return: value, NaN for an empty sketch
+        """
+        if self.count == 0:
+            return float('nan')
+        rank = math.floor(q * (self.count - 1))
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -ProfitSketch.bucket_value(index)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return ProfitSketch.bucket_value(index)
+        return ProfitSketch.bucket_value(max(self.positive))
+
+    @staticmethod
+    def merge_groups(target, other):
+        """
+            Merging the grouped sketches of by_group into target
+        :return: target
+        """
+        for column, sketches in other.items():
+            merged = target.setdefault(column, {})
+            for key, sketch in sketches.items():
+                if key in merged:
+                    merged[key].merge(sketch)
+                else:
+                    merged[key] = sketch
+        return target
+
+    @staticmethod
+    def percentile_table(sketches, quantiles=PROFIT_QUANTILES):
+        """
+            Percentiles per group
+        :param sketches: dict group -> ProfitSketch
+        :param quantiles: quantiles to report
+        :return: DataFrame indexed by group with Orders and one pNN column per quantile, sorted by group
+        """
+        columns = [f"p{round(q * 100):02d}" for q in quantiles]
+        rows = {str(key): [sketch.count] + [sketch.quantile(q) for q in quantiles] for key, sketch in sketches.items()}
+        table = pd.DataFrame.from_dict(rows, orient='index', columns=['Orders'] + columns)
+        return table.sort_index()
+
+
+class PartialAggregate:
+    """
+        Mergeable state of one chunk, merging the states of all chunks gives the exact results of the whole file
+    """
+    GROUP_COLUMNS = ['Country', 'Region', 'Year']
+
+    def __init__(self):
+        self.rows = 0
+        self.invalid = 0
+        self.overall = ProfitSummary()
+        self.groups = {column: {} for column in PartialAggregate.GROUP_COLUMNS}
+
+    @staticmethod
+    def from_chunk(chunk, invalid=0):
+        """
+            Building the partial state of a (validated) chunk
+        :param chunk:
+        :param invalid: number of invalid rows already removed from the chunk
+        :return: PartialAggregate
+        """
+        partial = PartialAggregate()
+        partial.rows = len(chunk)
+        partial.invalid = invalid
+        partial.overall = ProfitSummary.from_chunk(chunk)
+        for column in PartialAggregate.GROUP_COLUMNS:
+            if column == 'Year':
+                keys = FileLoader.date_part(chunk, 'Year')
+            elif column in chunk.columns:
+                keys = chunk[column]
+            else:
+                continue
+            table = GroupKernel.aggregate(chunk, [keys], {stat: ('Total Profit', stat)
+                                                          for stat in ('sum', 'count', 'min', 'max')})
+            partial.groups[column] = {
+                key: ProfitSummary(float(total), int(count), float(minimum), float(maximum))
+                for key, total, count, minimum, maximum in table.itertuples()
+                if count > 0
+            }
+        return partial
+
+    def merge(self, other):
+        """
+            Merging another partial state into this one
+        :param other: PartialAggregate
+        :return: self
+        """
+        self.rows += other.rows
+        self.invalid += other.invalid
+        self.overall.merge(other.overall)
+        for column, groups in other.groups.items():
+            target = self.groups.setdefault(column, {})
+            for key, summary in groups.items():
+                if key in target:
+                    target[key].merge(summary)
+                else:
+                    target[key] = ProfitSummary(summary.total, summary.count, summary.minimum, summary.maximum)
+        return self
+
+    def profit_table(self, column, keys=None):
+        """
+            Profit per group in the format of DataProcessor.profit_by_country
+        :param column: grouping column
+        :param keys: groups to report, None for all of them
+        :return: DataFrame indexed by group with Total Profit and Orders, sorted by profit
+        """
+        groups = self.groups.get(column, {})
+        if keys is None:
+            keys = list(groups)
+        keys = list(dict.fromkeys(keys))
+        table = pd.DataFrame({
+            'Total Profit': [groups[key].total if key in groups else 0.0 for key in keys],
+            'Orders': [groups[key].count if key in groups else 0 for key in keys],
+        }, index=pd.Index(keys, dtype=object, name=column))
+        return table.sort_values('Total Profit', ascending=False)
+
+
+class TrendCube:
+    """
+        Units Sold and Total Profit pre-aggregated by Country, Year and Item Type, built once per dataset
+    """
+    KEYS = ['Country', 'Year', 'Item Type']
+    MEASURES = ['Units Sold', 'Total Profit']
+
+    def __init__(self, table):
+        self.table = table
+
+    @staticmethod
+    def partial(chunk):
+        """
+            Aggregating one chunk, partial cubes of all chunks are summed by from_partials
+        :param chunk:
+        :return: DataFrame with the key and measure columns
+        """
+        keys = ['Country', FileLoader.date_part(chunk, 'Year'), 'Item Type']
+        measures = [column for column in TrendCube.MEASURES if column in chunk.columns]
+        return GroupKernel.aggregate(chunk, keys, {column: (column, 'sum') for column in measures}).reset_index()
+
+    @staticmethod
+    def from_partials(partials):
+        """
+            Summing partial cubes into the exact cube
+        :param partials: list of DataFrames from partial
+        :return: TrendCube
+        """
+        # no partials for an empty file, the cube is empty but has every column
+        table = (pd.concat(partials, ignore_index=True) if partials
+                 else pd.DataFrame(columns=TrendCube.KEYS + TrendCube.MEASURES, dtype='float64'))
+        for column in ['Country', 'Item Type']:
+            table[column] = table[column].astype(object)
+        table['Year'] = table['Year'].astype('int64')
+        measures = [column for column in table.columns if column not in TrendCube.KEYS]
+        return TrendCube(GroupKernel.sum(table, TrendCube.KEYS, measures).reset_index())
+
+    @staticmethod
+    def build(data, pool=None):
+        """
+            Building the cube in the workers
+        :param data:
+        :param pool: persistent WorkerPool
+        :return: TrendCube
+        """
+        return TrendCube.from_partials(DataProcessor.map_chunks(pool, TrendCube.partial, data))
+
+    def top_products(self, country=None, k=3, by='Units Sold'):
+        """
+            Exact top k item types per year
+        :param country: country name, None for all countries together
+        :param k: number of item types per year
+        :param by: measure to rank by
+        :return: dict year -> list of (item type, value)
+        """
+        table = self.table
+        if country is not None:
+            table = table[table['Country'] == country]
+        totals = GroupKernel.sum(table, ['Year', 'Item Type'], [by]).reset_index()
+        totals = totals.sort_values(['Year', by, 'Item Type'], ascending=[True, False, True])
+        # rank of every item type within its year, the years are contiguous after sorting
+        years = totals['Year'].to_numpy()
+        starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]]) if len(years) else np.array([], dtype=np.int64)
+        ranks = np.arange(len(years)) - np.repeat(starts, np.diff(np.r_[starts, len(years)]))
+        top = totals[ranks < k]
+        result = {}
+        for year, item, value in top[['Year', 'Item Type', by]].itertuples(index=False):
+            result.setdefault(int(year), []).append((item, value))
+        return result
+
+
+class MonthlyRollup:
+    """
+        Profit, revenue, cost, units and orders pre-aggregated per month, Region, Country and Item Type
+    """
+    KEYS = ['Period', 'Region', 'Country', 'Item Type']
+    MEASURES = ['Total Profit', 'Total Revenue', 'Total Cost', 'Units Sold']
+
+    def __init__(self, table, data=None):
+        self.table = table
+        # Period is the month number year * 12 + month - 1, the table is sorted by it
+        self.periods = table['Period'].to_numpy()
+        self.data = data
+        self.dates = None
+        self.order = None
+        if data is not None:
+            dates = FileLoader.parse_dates(data[SALES_DATE_COLUMN]).to_numpy()
+            self.order = np.argsort(dates, kind='stable')
+            self.dates = dates[self.order]
+
+    @staticmethod
+    def partial(chunk):
+        """
+            Aggregating one chunk, partial rollups of all chunks are summed by from_partials
+        :param chunk:
+        :return: DataFrame with the key, measure and Orders columns
+        """
+        period = (FileLoader.date_part(chunk, 'Year').astype('float64') * 12
+                  + FileLoader.date_part(chunk, 'Month').astype('float64') - 1).rename('Period')
+        keys = [period] + [column for column in MonthlyRollup.KEYS[1:] if column in chunk.columns]
+        measures = [column for column in MonthlyRollup.MEASURES if column in chunk.columns]
+        aggregations = {column: (column, 'sum') for column in measures}
+        aggregations['Orders'] = (None, 'size')
+        return GroupKernel.aggregate(chunk, keys, aggregations).reset_index()
+
+    @staticmethod
+    def from_partials(partials, data=None):
+        """
+            Summing partial rollups into the exact rollup
+        :param partials: list of DataFrames from partial
+        :param data: rows the rollup was built from, needed for ranges that do not start or end on a month boundary
+        :return: MonthlyRollup
+        """
+        columns = MonthlyRollup.KEYS + MonthlyRollup.MEASURES + ['Orders']
+        table = pd.concat(partials, ignore_index=True) if partials else pd.DataFrame(columns=columns, dtype='float64')
+        keys = [column for column in MonthlyRollup.KEYS if column in table.columns]
+        for column in keys[1:]:
+            table[column] = table[column].astype(object)
+        table['Period'] = table['Period'].astype('int64')
+        measures = [column for column in table.columns if column not in keys]
+        return MonthlyRollup(GroupKernel.sum(table, keys, measures).reset_index(), data)
+
+    @staticmethod
+    def build(data, pool=None):
+        """
+            Building the rollup in the workers
+        :param data:
+        :param pool: persistent WorkerPool
+        :return: MonthlyRollup
+        """
+        return MonthlyRollup.from_partials(DataProcessor.map_chunks(pool, MonthlyRollup.partial, data), data)
+
+    @staticmethod
+    def parse_range(start=None, end=None):
+        """
+            Bounds of a date range, a month like '2021-06' covers the whole month
+        :param start: first day, 'YYYY-MM-DD' or 'YYYY-MM', None for the beginning of the data
+        :param end: last day (inclusive), None for the end of the data
+        :return: (start, end exclusive) as Timestamps or None
+        """
+        if start is not None:
+            start = pd.Timestamp(start).normalize()
+        if end is not None:
+            last_day = pd.Timestamp(end).normalize()
+            if isinstance(end, str) and re.fullmatch(r'\d{4}-\d{1,2}', end.strip()):
+                last_day += pd.offsets.MonthEnd(0)
+            end = last_day + pd.Timedelta(days=1)
+        if start is not None and end is not None and start >= end:
+            raise ValueError(f"The range starts after it ends: {start.date()} > {(end - pd.Timedelta(days=1)).date()}")
+        return start, end
+
+    @staticmethod
+    def period(timestamp):
+        return timestamp.year * 12 + timestamp.month - 1
+
+    @staticmethod
+    def month_start(period):
+        return pd.Timestamp(year=period // 12, month=period % 12 + 1, day=1)
+
+    def select(self, start=None, end=None):
+        """
+            Rollup rows of a date range, the partial months at its edges come from the raw rows
+        :param start: first day, see parse_range
+        :param end: last day (inclusive)
+        :return: DataFrame in the format of partial
+        """
+        start, end = MonthlyRollup.parse_range(start, end)
+        first = -np.inf if start is None else MonthlyRollup.period(start) + (start.day != 1)
+        last = np.inf if end is None else MonthlyRollup.period(end) - 1
+        parts = []
+        edges = []
+        if first > last:
+            edges.append((start, end))
+        else:
+            low = np.searchsorted(self.periods, first, side='left')
+            high = np.searchsorted(self.periods, last, side='right')
+            parts.append(self.table.iloc[low:high])
+            if start is not None and start.day != 1:
+                edges.append((start, MonthlyRollup.month_start(first)))
+            if end is not None and end.day != 1:
+                edges.append((MonthlyRollup.month_start(last + 1), end))
+        if edges:
+            if self.data is None:
+                raise ValueError("Ranges inside a month need the loaded rows, use whole months (YYYY-MM) instead")
+            positions = np.concatenate([self.order[np.searchsorted(self.dates, np.datetime64(lower), side='left'):
+                                                   np.searchsorted(self.dates, np.datetime64(upper), side='left')]
+                                        for lower, upper in edges])
+            rows = self.data.iloc[np.sort(positions)]
+            if len(rows):
+                parts.append(MonthlyRollup.partial(rows))
+        if not parts:
+            return self.table.iloc[:0]
+        return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+
+    def totals(self, by='Country', keys=None, start=None, end=None):
+        """
+            Measures per group in a date range
+        :param by: 'Region', 'Country' or 'Item Type'
+        :param keys: groups to report, None for all of them
+        :param start: first day, see parse_range
+        :param end: last day (inclusive)
+        :return: DataFrame indexed by group with the measures and Orders, sorted by profit
+        """
+        table = self.select(start, end)
+        columns = [column for column in MonthlyRollup.MEASURES + ['Orders'] if column in table.columns]
+        totals = GroupKernel.sum(table, [by], columns)
+        totals.index = totals.index.astype(object)
+        if keys is not None:
+            totals = totals.reindex(list(dict.fromkeys(keys)), fill_value=0)
+        return totals.sort_values('Total Profit', ascending=False)
+
+    def profit_table(self, column, keys=None, start=None, end=None):
+        """
+            Profit per group in a date range, in the format of DataProcessor.profit_by_country
+        :return: DataFrame indexed by group with Total Profit and Orders, sorted by profit
+        """
+        return self.totals(column, keys, start, end)[['Total Profit', 'Orders']]
+
+    def top_products(self, country=None, k=3, by='Units Sold', start=None, end=None):
+        """
+            Exact top k item types per year in a date range, see TrendCube.top_products
+        :return: dict year -> list of (item type, value)
+        """
+        table = self.select(start, end)
+        table = table.assign(Year=table['Period'] // 12)[TrendCube.KEYS + TrendCube.MEASURES]
+        return TrendCube(table).top_products(country, k, by)
+
+
+class DuplicateIndex:
+    """
+        Hash index of the order keys seen so far, a row whose key was seen before is a duplicate
+    """
+
+    def __init__(self, keys=DEDUP_KEYS):
+        self.keys = list(keys)
+        self.levels = []
+        self.dropped = 0
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    @staticmethod
+    def rule(keys):
+        """
+            Name of the rejection rule of the duplicates
+        """
+        return f"duplicate {', '.join(keys)}"
+
+    @staticmethod
+    def key_values(chunk, keys):
+        """
+            One key per row: the column itself for one key, a 64-bit hash of the key columns for a key set
+        :param chunk: DataFrame
+        :param keys: key columns
+        :return: numpy array, None when there are no keys or a key column is not in the chunk
+        """
+        if not keys or any(key not in chunk.columns for key in keys):
+            return None
+        if len(keys) == 1:
+            return chunk[keys[0]].to_numpy()
+        return pd.util.hash_pandas_object(chunk[list(keys)], index=False).to_numpy()
+
+    def applies(self, chunk):
+        """
+            Whether chunk has every key column
+        """
+        return bool(self.keys) and all(key in chunk.columns for key in self.keys)
+
+    def seen(self, values):
+        """
+            Mask of the values that are in the index
+        """
+        found = np.zeros(len(values), dtype=bool)
+        for level in self.levels:
+            found |= level.get_indexer(values) >= 0
+        return found
+
+    def add(self, values):
+        """
+            Indexing unique values that are not in the index yet
+        """
+        self.levels.append(pd.Index(values))
+        # a level is merged into the previous one once it is as large, every key is rehashed O(log n) times
+        while len(self.levels) > 1 and len(self.levels[-2]) <= len(self.levels[-1]):
+            last = self.levels.pop()
+            self.levels[-1] = self.levels[-1].append(last)
+
+    def filter_values(self, values):
+        """
+            Mask of the keys to keep: the first occurrence of keys not seen before, rows without a key are kept
+        :param values: keys in row order, from key_values
+        :return: boolean numpy array
+        """
+        keep = ~pd.Index(values).duplicated(keep='first')
+        missing = pd.isna(values)
+        keep |= missing
+        if self.levels:
+            keep &= ~self.seen(values)
+        self.add(values[keep & ~missing])
+        self.dropped += int(len(keep) - keep.sum())
+        return keep
+
+    def filter(self, chunk, rows=None):
+        """
+            Mask of the rows of chunk to keep, chunks are passed in row order so the first occurrence is kept
+        :param chunk: DataFrame
+        :param rows: boolean mask of the rows to check, e.g. the valid ones, default all
+        :return: boolean numpy array over the checked rows, all True when the chunk has no key columns
+        """
+        if not self.applies(chunk):
+            return np.ones(len(chunk) if rows is None else int(np.count_nonzero(rows)), dtype=bool)
+        values = DuplicateIndex.key_values(chunk, self.keys)
+        return self.filter_values(values if rows is None else values[rows])
+
+
+class DataProcessor:
+    """
+        class for all the methods, modeling and
+    """
+    @staticmethod
+
+    def format_currency(amount):
+        """
+            formating currency
+        :return: currency in better format;
+        """
+        try:
+            return f"{amount:,.2f} USD"
+        except Exception as e:
+            print(f"Error in formatting currency: {e}")
+            raise
+    @staticmethod
+    def memoize(cache, data, operation, params, compute):
+        """
+            Result of compute, from the ResultCache when one is given
+        """
+        if cache is None:
+            return compute()
+        return cache.memoize(data, operation, params, compute)
+
+    @staticmethod
+    def fold_result(operation, params, result, tail):
+        """
+            Result of a memoized operation on the data grown by tail, from its result on the data before
+        :param operation: operation name of the ResultCache entry
+        :param params: parameters of the entry
+        :param result: result on the data before, changed in place
+        :param tail: appended rows, validated like the data
+        :return: result on the grown data, None when it has to be computed again
+        """
+        if operation == 'calculate_avg_profit':
+            return result.merge(ProfitSummary.from_chunk(tail))
+        if operation == 'analyze_profit_by_region' and 'Region' in tail.columns:
+            table = GroupKernel.aggregate(tail, ['Region'], {'Total Profit': ('Total Profit', 'sum')})
+            for region, profit in table['Total Profit'].items():
+                result[region] = result.get(region, 0.0) + profit
+            return dict(sorted(result.items(), key=lambda item: item[1], reverse=True))
+        if operation == 'profit_by_country':
+            countries, start, end = params
+            table = DataProcessor.profit_in_range(tail, None if countries is None else list(countries), start, end)
+            merged = result.add(table, fill_value=0).astype(result.dtypes.to_dict())
+            merged.index.name = result.index.name
+            return merged.sort_values('Total Profit', ascending=False)
+        # averages per country cannot be merged without the counts
+        return None
+
+    @staticmethod
+    def map_chunks(pool, func, data, *args):
+        """
+            Running func on the chunks of data in the persistent pool, or in a temporary one when none is given
+        :param pool: WorkerPool or None
+        :return: list of results in row order
+        """
+        if pool is not None:
+            return pool.map(func, data, *args)
+        with WorkerPool() as temporary_pool:
+            return temporary_pool.map(func, data, *args)
+
+    @staticmethod
+    def calculate_profit(chunk, country):
+        """
+            Calculating profit of a country
+        :param country: country name in colummn
+        :return: all countries profit
+        """
+        try:
+            mask = (chunk['Country'] == country).to_numpy()
+            if not mask.any():
+                raise ValueError(f"Country '{country}' not found in the data chunk.")
+            return chunk['Total Profit'].to_numpy()[mask].sum()
+        except Exception as e:
+            print(f"Error in calculating profit: {e}")
+            raise
+
+    @staticmethod
+
+    def analyze_trends_by_year(chunk):
+        """
+            Method for analyzing trends about years
+        :return:
+        """
+        try:
+            # rows without a year get no group
+            table = GroupKernel.aggregate(chunk, [FileLoader.date_part(chunk, 'Year')],
+                                          {'Total Profit': ('Total Profit', 'sum')})
+            return table['Total Profit'].to_dict()
+        except Exception as e:
+            print(f"Error in analyzing trends by year: {e}")
+            raise
+
+    @staticmethod
+    def validate_and_clean_data(chunk, today=None, duplicates=None):
+        """
+            Method for validating and cleaning data from file
+        :param chunk:
+        :param today: dates after it are invalid, defaults to now
+        :param duplicates: DuplicateIndex shared by the chunks of one file, None keeps the duplicates
+        :return: (cleaned chunk, number of invalid and duplicate rows)
+        """
+        try:
+            cleaned, _ = DataProcessor.validate_chunk(chunk, today, duplicates)
+            return cleaned, len(chunk) - len(cleaned)
+        except Exception as e:
+            print(f"Error in data cleaning: {e}")
+            raise
+
+    @staticmethod
+    def validation_mask(chunk, today=None):
+        """
+            Evaluating all validation rules as one combined mask
+        :param chunk:
+        :param today: dates after it are invalid, defaults to now
+        :return: (valid rows mask, dict rule -> number of rows failing it, converted profit, converted dates)
+        """
+        if today is None:
+            today = pd.Timestamp.today()
+        missing = chunk[['Country', 'Total Profit', 'Order Date']].isna().any(axis=1).to_numpy()
+        profit = chunk['Total Profit']
+        if not pd.api.types.is_numeric_dtype(profit.dtype):
+            profit = pd.to_numeric(profit, errors='coerce')
+        dates = FileLoader.parse_dates(chunk['Order Date'])
+
+        rules = {
+            'missing fields': missing,
+            'bad Total Profit': profit.isna().to_numpy() & ~missing,
+            'bad Order Date': dates.isna().to_numpy() & ~missing,
+        }
+        for column in VALIDATION_POSITIVE_COLUMNS:
+            if column in chunk.columns:
+                values = chunk[column]
+                if not pd.api.types.is_numeric_dtype(values.dtype):
+                    values = pd.to_numeric(values, errors='coerce')
+                # NaN compares as False, so missing values fail the rule as well
+                rules[f'non-positive {column}'] = ~(values.to_numpy(dtype='float64') > 0)
+        rules['future Order Date'] = (dates > today).to_numpy()
+
+        invalid = np.zeros(len(chunk), dtype=bool)
+        for failed in rules.values():
+            invalid |= failed
+        rejections = {rule: int(failed.sum()) for rule, failed in rules.items()}
+        return ~invalid, rejections, profit, dates
+
+    @staticmethod
+    def validate_chunk(chunk, today=None, duplicates=None):
+        """
+            Validating a chunk in one pass, the cleaned chunk is materialized once
+        :param chunk:
+        :param today: dates after it are invalid, defaults to now
+        :param duplicates: DuplicateIndex shared by the chunks of one file, None keeps the duplicates
+        :return: (cleaned chunk, dict rule -> number of rows failing it)
+        """
+        valid, rejections, profit, dates = DataProcessor.validation_mask(chunk, today)
+        DataProcessor.drop_duplicates(chunk, valid, rejections, duplicates)
+        cleaned = chunk[valid]
+        if profit is not chunk['Total Profit'] or dates is not chunk['Order Date']:
+            cleaned = cleaned.assign(**{'Total Profit': profit[valid], 'Order Date': dates[valid]})
+        widened = [part for part, dtype in SALES_DATE_PARTS.items()
+                   if part in cleaned.columns and cleaned[part].dtype != dtype]
+        if widened:
+            cleaned = cleaned.assign(**{part: FileLoader.downcast(cleaned[part], SALES_DATE_PARTS[part])
+                                        for part in widened})
+        return cleaned, rejections
+
+    @staticmethod
+    def drop_duplicates(chunk, valid, rejections, duplicates=None):
+        """
+            Clearing the valid mask of rows whose key already occurred in a valid row, duplicates are counted as a rule
+        :param chunk:
+        :param valid: valid rows mask from validation_mask, updated in place
+        :param rejections: dict rule -> number of rows, updated in place
+        :param duplicates: DuplicateIndex, None keeps the duplicates
+        :return: keys of the rows left valid, None when nothing was checked
+        """
+        if duplicates is None or not duplicates.applies(chunk):
+            return None
+        dropped = duplicates.dropped
+        values = DuplicateIndex.key_values(chunk, duplicates.keys)[valid]
+        keep = duplicates.filter_values(values)
+        valid[np.flatnonzero(valid)[~keep]] = False
+        rejections[DuplicateIndex.rule(duplicates.keys)] = duplicates.dropped - dropped
+        return values[keep]
+
+    @staticmethod
+    def merge_duplicates(chunk_positions, chunk_keys):
+        """
+            Merge step of the deduplication, finding the rows that repeat a key of an earlier chunk
+        :param chunk_positions: positions of the rows kept by each chunk, in row order
+        :param chunk_keys: keys of those rows from each chunk, None when the chunks were not deduplicated
+        :return: (positions kept, positions dropped)
+        """
+        kept = np.concatenate(chunk_positions) if chunk_positions else np.array([], dtype=np.int64)
+        if not chunk_keys or any(values is None for values in chunk_keys):
+            return kept, np.array([], dtype=np.int64)
+        values = np.concatenate(chunk_keys)
+        # keys are unique within a chunk, so a repeated key repeats an earlier chunk and only its first row is kept
+        keep = ~pd.Index(values).duplicated(keep='first') | pd.isna(values)
+        return kept[keep], kept[~keep]
+
+    @staticmethod
+    def report_rejections(rejections):
+        """
+            Printing how many rows failed each validation rule
+        :param rejections: dict rule -> number of rows
+        """
+        for rule, count in rejections.items():
+            if count > 0:
+                print(f"  {rule}: {count}")
+
+    @staticmethod
+    def calculate_average_profit_per_order(chunk):
+        """
+            Calculating
+        :param chunk:
+        :return:
+        """
+        try:
+            if chunk.empty:
+                raise ValueError("Chunk is empty. Cannot calculate average profit.")
+
+            return DataProcessor.summarize_profit(chunk).mean
+        except Exception as e:
+            print(f"Error in calculating average profit per order: {e}")
+            raise
+
+    @staticmethod
+    def summarize_profit(chunk, operation='calculate_average_profit_per_order'):
+        """
+            Profit summary of a chunk, pushed to the profit log
+        :param chunk:
+        :param operation: operation name in the log
+        :return: ProfitSummary
+        """
+        summary = ProfitSummary.from_chunk(chunk)
+        ProfitLog.log(operation, ProfitLog.chunk_id(chunk), **summary.stats())
+        return summary
+
+    @staticmethod
+    def calculate_profit_margin(chunk):
+        """
+            Calculating margin profit
+        :param chunk:
+        :return:
+        """
+        try:
+            if 'Total Profit' in chunk.columns and 'Total Revenue' in chunk.columns and 'Item Type' in chunk.columns:
+                return pd.DataFrame({'Item Type': chunk['Item Type'],
+                                     'Profit Margin': chunk['Total Profit'] / chunk['Total Revenue']})
+            else:
+                raise MissingColumnError("Missing required columns: 'Total Profit', 'Total Revenue', or 'Item Type'")
+        except Exception as e:
+            print(f"Error in calculating profit margin: {e}")
+            raise
+
+    @staticmethod
+    def margin_partial(chunk, by=('Item Type',)):
+        """
+            Partial sums for profit margins, summing them over all chunks gives the exact margins
+        :param chunk:
+        :param by: grouping columns
+        :return: DataFrame indexed by the groups with Total Profit, Total Revenue, Margin Sum and Orders
+        """
+        margins = chunk['Total Profit'].to_numpy() / chunk['Total Revenue'].to_numpy()
+        return GroupKernel.aggregate(chunk, list(by), {
+            'Total Profit': ('Total Profit', 'sum'),
+            'Total Revenue': ('Total Revenue', 'sum'),
+            'Margin Sum': (margins, 'sum'),
+            'Orders': (None, 'size'),
+        })
+
+    @staticmethod
+    def merge_margin_partials(partials):
+        """
+            Summing partial margin tables
+        :param partials: list of DataFrames from margin_partial
+        :return: DataFrame with the summed partials
+        """
+        table = pd.concat(partials)
+        table.index = table.index.astype(object) if table.index.nlevels == 1 else table.index
+        return GroupKernel.sum(table.reset_index(), list(table.index.names), list(table.columns))
+
+    @staticmethod
+    def margin_table(partial, by=None):
+        """
+            Revenue-weighted and mean margin per group from summed margin partials
+        :param partial: DataFrame from margin_partial or merge_margin_partials
+        :param by: grouping columns to roll the partial up to, None keeps its groups
+        :return: DataFrame sorted by Weighted Margin, highest first
+        """
+        if by is not None and list(by) != list(partial.index.names):
+            partial = GroupKernel.sum(partial.reset_index(), list(by), list(partial.columns))
+        table = partial.assign(**{
+            'Weighted Margin': partial['Total Profit'] / partial['Total Revenue'],
+            'Mean Margin': partial['Margin Sum'] / partial['Orders'],
+        })
+        return table.sort_values('Weighted Margin', ascending=False, kind='stable')
+
+    @staticmethod
+    def margin_extremes(table, top=10, bottom=0):
+        """
+            Groups with the highest and the lowest weighted margins
+        :param table: DataFrame from margin_table
+        :param top: number of highest groups
+        :param bottom: number of lowest groups, lowest first
+        :return: (top DataFrame, bottom DataFrame)
+        """
+        return table.head(top), table.tail(bottom).iloc[::-1] if bottom else table.iloc[:0]
+
+    @staticmethod
+    def calculate_average_profit_by_country(chunk, cache=None):
+        """
+            Method for calculating profit for each country
+        :param chunk:
+        :param cache: ResultCache of the session
+        :return:
+        """
+        try:
+            def compute():
+                # the country labels are stripped, not the rows
+                table = GroupKernel.aggregate(chunk, ['Country'], {'Average Profit': ('Total Profit', 'mean')},
+                                              strip=True)
+                return dict(sorted(table['Average Profit'].to_dict().items()))
+
+            sorted_avg_profit_by_country = DataProcessor.memoize(cache, chunk, 'calculate_average_profit_by_country',
+                                                                 (), compute)
+
+            for country, avg_profit in sorted_avg_profit_by_country.items():
+                print(f"Country: {country}, Average Profit: {DataProcessor.format_currency(avg_profit)}")
+
+            return sorted_avg_profit_by_country
+        except Exception as e:
+            print(f"Error in calculating average profit by country: {e}")
+            raise
+
+    @staticmethod
+    def analyze_profit_by_region(chunk, cache=None):
+        """
+            Method for analyzing profit by region
+        :param chunk:
+        :param cache: ResultCache of the session
+        :return:
+        """
+        try:
+            if 'Region' not in chunk.columns:
+                raise MissingColumnError("Missing 'Region' column. Cannot analyze profit by region.")
+
+            def compute():
+                profit_by_region = GroupKernel.aggregate(chunk, ['Region'], {'Total Profit': ('Total Profit', 'sum')})[
+                    'Total Profit'].to_dict()
+                return dict(sorted(profit_by_region.items(), key=lambda item: item[1], reverse=True))
+
+            sorted_profit_by_region = DataProcessor.memoize(cache, chunk, 'analyze_profit_by_region', (), compute)
+
+            for index, (region, profit) in enumerate(sorted_profit_by_region.items(), start=1):
+                print(f"{index}. Region: {region}, Total Profit: {DataProcessor.format_currency(profit)}")
+
+            return sorted_profit_by_region
+        except Exception as e:
+            print(f"Error in analyzing profit by region: {e}")
+            raise
+
+    @staticmethod
+    def profit_by_country(data, countries=None):
+        """
+            Summing profit per country in one groupby pass, the cost is the same for any number of countries
+        :param data: DataFrame with Country and Total Profit
+        :param countries: list of countries to report, None for all of them
+        :return: DataFrame indexed by Country with Total Profit and Orders, sorted by profit
+        """
+        try:
+            table = GroupKernel.aggregate(data, ['Country'], {'Total Profit': ('Total Profit', 'sum'),
+                                                              'Orders': ('Total Profit', 'count')})
+            table.index = table.index.astype(object)
+            if countries is not None:
+                table = table.reindex(list(dict.fromkeys(countries)), fill_value=0)
+            return table.sort_values('Total Profit', ascending=False)
+        except Exception as e:
+            print(f"Error in calculating profit by country: {e}")
+            raise
+
+    @staticmethod
+    def compare_countries(data, countries=None, start=None, end=None, rollup=None, cache=None):
+        """
+            Method for comparing profits of any number of countries
+        :param countries: list of countries, None for all of them
+        :param start: first day of the date range, None for all history
+        :param end: last day of the date range
+        :param rollup: MonthlyRollup of data answering date ranges, built when not given
+        :param cache: ResultCache of the session
+        :return: result table from profit_by_country
+        """
+        try:
+            with Metrics.operation('compare_countries', rows=len(data)) as metrics:
+                table = DataProcessor.memoize(
+                    cache, data, 'profit_by_country', (None if countries is None else tuple(countries), start, end),
+                    lambda: DataProcessor.profit_in_range(data, countries, start, end, rollup))
+            DataProcessor.report_countries(table)
+            print(f"Comparison completed in {metrics['wall']:.2f} seconds\n")
+            return table
+        except Exception as e:
+            print(f"Error in comparing countries: {e}")
+            raise
+
+    @staticmethod
+    def report_countries(table):
+        """
+            Printing a profit table from profit_by_country
+        :param table:
+        """
+        for index, (country, row) in enumerate(table.iterrows(), start=1):
+            if row['Orders'] == 0:
+                print(f"Warning: '{country}' does not exist in the dataset or was entered incorrectly.")
+            else:
+                print(f"{index}. {country}: {DataProcessor.format_currency(row['Total Profit'])} "
+                      f"({int(row['Orders'])} orders)")
+
+    @staticmethod
+    def profit_percentiles(data, by='Country', quantiles=PROFIT_QUANTILES, pool=None):
+        """
+            Approximate percentiles of Total Profit per group, sketched per chunk in the workers and merged
+        :param data:
+        :param by: 'Country' or 'Region'
+        :param quantiles: quantiles to report
+        :param pool: persistent WorkerPool
+        :return: DataFrame from ProfitSketch.percentile_table
+        """
+        try:
+            print(f"Calculating profit percentiles by {by}...")
+            with Metrics.operation('profit_percentiles', rows=len(data)) as metrics:
+                results = DataProcessor.map_chunks(pool, ProfitSketch.by_group, data, (by,))
+                with Metrics.stage('merge'):
+                    sketches = {}
+                    for chunk_sketches in results:
+                        ProfitSketch.merge_groups(sketches, chunk_sketches)
+                    table = ProfitSketch.percentile_table(sketches.get(by, {}), quantiles)
+            DataProcessor.report_percentiles(table)
+            print(f"Percentiles calculated in {metrics['wall']:.2f} seconds\n")
+            return table
+        except Exception as e:
+            print(f"Error in calculating profit percentiles: {e}")
+            raise
+
+    @staticmethod
+    def report_percentiles(table):
+        """
+            Printing a percentile table from profit_percentiles
+        :param table:
+        """
+        print(f"Values are within {PROFIT_SKETCH_ACCURACY:.0%} of the exact percentiles.")
+        for group, row in table.iterrows():
+            values = ', '.join(f"{column}: {DataProcessor.format_currency(row[column])}"
+                               for column in table.columns if column != 'Orders')
+            print(f"{group} ({int(row['Orders'])} orders) {values}")
+
+    @staticmethod
+    def profit_in_range(data, countries=None, start=None, end=None, rollup=None):
+        """
+            Profit per country, from the monthly rollup when a date range is given
+        :return: result table from profit_by_country
+        """
+        if start is None and end is None:
+            return DataProcessor.profit_by_country(data, countries)
+        if rollup is None:
+            with Metrics.stage('build rollup'):
+                rollup = MonthlyRollup.build(data)
+        with Metrics.stage('query rollup'):
+            return rollup.profit_table('Country', countries, start, end)
+
+    @staticmethod
+    def compare_profits(data, country1, country2, start=None, end=None, rollup=None, cache=None):
+        """
+            Method for comparing profits
+        :param country1: user input
+        :param country2: user input
+        :param start: first day of the date range, None for all history
+        :param end: last day of the date range
+        :param rollup: MonthlyRollup of data answering date ranges, built when not given
+        :param cache: ResultCache of the session
+        :return: (profit of country1, profit of country2)
+        """
+        try:
+            print("Processing data...")
+            with Metrics.operation('compare_profits', rows=len(data)) as metrics:
+                table = DataProcessor.memoize(
+                    cache, data, 'profit_by_country', ((country1, country2), start, end),
+                    lambda: DataProcessor.profit_in_range(data, [country1, country2], start, end, rollup))
+            profits = DataProcessor.report_comparison(table, country1, country2)
+            print(f"Processing completed in {metrics['wall']:.2f} seconds\n")
+            return profits
+        except Exception as e:
+            print(f"Error in comparing profits: {e}")
+            raise
+
+    @staticmethod
+    def report_comparison(table, country1, country2):
+        """
+            Printing the comparison of two countries from a profit table
+        :param table: table from profit_by_country containing both countries
+        :return: (profit of country1, profit of country2)
+        """
+        try:
+            total_profit_country1 = table.at[country1, 'Total Profit']
+            total_profit_country2 = table.at[country2, 'Total Profit']
+
+            if table.at[country1, 'Orders'] == 0:
+                print(f"Warning: '{country1}' does not exist in the dataset or was entered incorrectly.")
+            else:
+                print(f"Total profit for {country1}: {DataProcessor.format_currency(total_profit_country1)}")
+
+            if table.at[country2, 'Orders'] == 0:
+                print(f"Warning: '{country2}' does not exist in the dataset or was entered incorrectly.")
+            else:
+                print(f"Total profit for {country2}: {DataProcessor.format_currency(total_profit_country2)}")
+
+            # Adding comparison of profits
+            if total_profit_country1 > total_profit_country2:
+                profit_diff = total_profit_country1 - total_profit_country2
+                print(f"{country1} has a higher profit by {DataProcessor.format_currency(profit_diff)}.")
+            elif total_profit_country2 > total_profit_country1:
+                profit_diff = total_profit_country2 - total_profit_country1
+                print(f"{country2} has a higher profit by {DataProcessor.format_currency(profit_diff)}.")
+            else:
+                print(f"Both {country1} and {country2} have equal profits.")
+
+            return total_profit_country1, total_profit_country2
+        except Exception as e:
+            print(f"Error in comparing profits: {e}")
+            raise
+
+    @staticmethod
+    def analyze_trends(data, country, pool=None, cube=None, k=3, start=None, end=None, rollup=None):
+        """
+            Method for predicting future trends
+        :param data:
+        :param country: country name, None for all countries
+        :param pool: persistent WorkerPool
+        :param cube: TrendCube of data, built when not given
+        :param k: number of top products per year
+        :param start: first day of the date range, None for all history
+        :param end: last day of the date range
+        :param rollup: MonthlyRollup of data answering date ranges, built when not given
+        :return: dict year -> list of (item type, units sold)
+        """
+        try:
+            print(f"Analyzing trends by year for {country or 'all countries'}...")
+            with Metrics.operation('analyze_trends', rows=len(data)) as metrics:
+                if start is None and end is None:
+                    if cube is None:
+                        with Metrics.stage('build cube'):
+                            cube = TrendCube.build(data, pool)
+                    with Metrics.stage('query cube'):
+                        yearly_top_products = cube.top_products(country, k)
+                else:
+                    if rollup is None:
+                        with Metrics.stage('build rollup'):
+                            rollup = MonthlyRollup.build(data, pool)
+                    with Metrics.stage('query rollup'):
+                        yearly_top_products = rollup.top_products(country, k, start=start, end=end)
+
+            for year, products in yearly_top_products.items():
+                print(f"Year {year}: {', '.join(item for item, _ in products)}")
+
+            print(f"Trend analysis completed in {metrics['wall']:.2f} seconds\n")
+            return yearly_top_products
+        except Exception as e:
+            print(f"Error in analyzing trends: {e}")
+            raise
+
+    @staticmethod
+    def validate_data(data, pool=None, keys=()):
+        """
+            Method for validating data in csv
+        :param data:
+        :param pool: persistent WorkerPool
+        :param keys: columns identifying an order, repeated orders are dropped, empty keeps them
+        :return:
+        """
+        try:
+            print("Validating and cleaning data...")
+            with Metrics.operation('validate_data', rows=len(data)) as metrics:
+                # workers only send back the positions of the valid rows, the rows are taken once here
+                results = DataProcessor.map_chunks(pool, valid_row_positions, data, pd.Timestamp.today(), keys)
+                with Metrics.stage('merge') as record:
+                    rejections = {}
+                    for _, chunk_rejections, _ in results:
+                        for rule, count in chunk_rejections.items():
+                            rejections[rule] = rejections.get(rule, 0) + count
+                    # workers drop the duplicates within their chunk and send back the keys they kept, the keys
+                    # are merged here so the ones across chunks are dropped without hashing the rows again
+                    positions, dropped = DataProcessor.merge_duplicates([result[0] for result in results],
+                                                                        [result[2] for result in results])
+                    if len(dropped):
+                        rule = DuplicateIndex.rule(keys)
+                        rejections[rule] = rejections.get(rule, 0) + len(dropped)
+                    cleaned_data = data.iloc[positions].reset_index(drop=True)
+                    FileLoader.restore_valid_dtypes(cleaned_data)
+                    cleaned_data.attrs['rejections'] = rejections
+                    record['rows'] = len(cleaned_data)
+            print(f"Data validation and cleaning completed in {metrics['wall']:.2f} seconds")
+            print(f"Total invalid rows removed: {len(data) - len(cleaned_data)}")
+            DataProcessor.report_rejections(rejections)
+            print()
+            return cleaned_data
+        except Exception as e:
+            print(f"Error in validating data: {e}")
+            raise
+
+    @staticmethod
+    def calculate_avg_profit(data, pool=None, cache=None):
+        """
+            Method for calculating average profit
+        :param data:
+        :param pool: persistent WorkerPool
+        :param cache: ResultCache of the session
+        :return:
+        """
+        try:
+            print("Calculating average profit per order...")
+            with Metrics.operation('calculate_avg_profit', rows=len(data)) as metrics:
+                summary = DataProcessor.memoize(cache, data, 'calculate_avg_profit', (),
+                                                lambda: DataProcessor.merge_profit_summaries(data, pool))
+            DataProcessor.report_profit_summary(summary)
+            print(f"Calculation completed in {metrics['wall']:.2f} seconds\n")
+            return summary.mean
+        except Exception as e:
+            print(f"Error in calculating average profit: {e}")
+            raise
+
+    @staticmethod
+    def merge_profit_summaries(data, pool=None):
+        """
+            Profit summary of data from the summaries of its chunks
+        :return: ProfitSummary
+        """
+        # averaging the chunk averages is wrong for unequal chunks, the partial sums and counts are merged
+        summary = ProfitSummary()
+        results = DataProcessor.map_chunks(pool, DataProcessor.summarize_profit, data, 'calculate_avg_profit')
+        with Metrics.stage('merge'):
+            for chunk_summary in results:
+                summary.merge(chunk_summary)
+        return summary
+
+    @staticmethod
+    def report_profit_summary(summary):
+        """
+            Printing the merged profit summary and writing it to the log
+        :param summary: ProfitSummary
+        """
+        print(f"Number of orders: {summary.count}")
+        if summary.count > 0:
+            print(f"Min profit per order: {DataProcessor.format_currency(summary.minimum)}")
+            print(f"Max profit per order: {DataProcessor.format_currency(summary.maximum)}")
+        print(f"Average profit per order: {DataProcessor.format_currency(summary.mean)}")
+        ProfitLog.log('profit summary', **summary.stats())
+
+    @staticmethod
+    def calculate_profit_margin_data(data, pool=None, by=('Item Type',), top=10, bottom=0):
+        """
+            Method for calculating the margin profit, workers send back partial sums per group instead of rows
+        :param data:
+        :param pool: persistent WorkerPool
+        :param by: grouping columns, e.g. ('Item Type',) or ('Country', 'Item Type')
+        :param top: number of groups with the highest margin to print
+        :param bottom: number of groups with the lowest margin to print
+        :return: DataFrame with Weighted Margin and Mean Margin per group, highest first
+        """
+        try:
+            print("Calculating profit margin...")
+            with Metrics.operation('calculate_profit_margin_data', rows=len(data)) as metrics:
+                results = DataProcessor.map_chunks(pool, DataProcessor.margin_partial, data, tuple(by))
+                with Metrics.stage('merge'):
+                    table = DataProcessor.margin_table(DataProcessor.merge_margin_partials(results))
+            highest, lowest = DataProcessor.margin_extremes(table, top, bottom)
+            for title, rows in [(f"Highest margins by {', '.join(by)}:", highest),
+                                (f"Lowest margins by {', '.join(by)}:", lowest)]:
+                if rows.empty:
+                    continue
+                print(title)
+                for group, margin in rows.iterrows():
+                    group = ' / '.join(map(str, group)) if isinstance(group, tuple) else group
+                    print(f"  {group}: {margin['Weighted Margin']:.2%} of revenue, "
+                          f"mean {margin['Mean Margin']:.2%} per order ({int(margin['Orders'])} orders)")
+            print(f"Profit margin calculation completed in {metrics['wall']:.2f} seconds\n")
+            return table
+        except Exception as e:
+            print(f"Error in calculating profit margin data: {e}")
+            raise
+
+
+def valid_row_positions(chunk, today, keys=()):
+    """
+        Method for validating a chunk in a worker, returns only what the parent needs to take the rows
+    :param chunk:
+    :param today: dates after it are invalid
+    :param keys: columns identifying an order, duplicates within the chunk are dropped
+    :return: (positions of the valid rows, dict rule -> number of rows failing it, keys of the valid rows or None)
+    """
+    valid, rejections, _, _ = DataProcessor.validation_mask(chunk, today)
+    values = DataProcessor.drop_duplicates(chunk, valid, rejections, DuplicateIndex(keys))
+    return chunk.index.to_numpy()[valid], rejections, values
+
+
+class StreamingProcessor:
+    """
+        Out-of-core mode, the csv is read in bounded chunks and only mergeable partial states are kept
+    """
+    @staticmethod
+    def aggregate(file_path, chunk_size=STREAM_CHUNK_SIZE, keys=(), duplicates=None):
+        """
+            Validating the csv chunk by chunk and merging the partial states
+        :param file_path: path to the csv file
+        :param chunk_size: rows per chunk, bounds the peak memory
+        :param keys: columns identifying an order, repeated orders are skipped, empty keeps them
+        :param duplicates: DuplicateIndex the caller keeps to fold appended rows later, default a new one on keys
+        :return: PartialAggregate of the whole file
+        """
+        try:
+            print(f"Streaming '{file_path}' in chunks of {chunk_size} rows...")
+            # only the keys outlive their chunk
+            if duplicates is None:
+                duplicates = DuplicateIndex(keys)
+            with Metrics.operation('stream', bytes_moved=FileLoader.file_size(file_path)) as metrics:
+                # the time outside of the chunk stages is spent parsing
+                aggregate = StreamingProcessor.fold(PartialAggregate(), FileLoader.iter_chunks(file_path, chunk_size),
+                                                    duplicates)
+                metrics['rows'] = aggregate.rows + aggregate.invalid
+            print(f"Streamed {aggregate.rows} valid rows ({aggregate.invalid} invalid rows skipped, "
+                  f"{duplicates.dropped} of them duplicates) in {metrics['wall']:.2f} seconds\n")
+            return aggregate
+        except Exception as e:
+            print(f"Error in streaming data: {e}")
+            raise
+
+    @staticmethod
+    def fold(aggregate, chunks, duplicates, today=None):
+        """
+            Validating chunks and merging them into a partial state, also for the rows appended to the csv
+        :param aggregate: PartialAggregate, changed in place
+        :param chunks: iterable of DataFrame chunks
+        :param duplicates: DuplicateIndex of the keys already merged
+        :param today: dates after it are invalid, defaults to now
+        :return: aggregate
+        """
+        if today is None:
+            today = pd.Timestamp.today()
+        for chunk in chunks:
+            with Metrics.stage('aggregate chunk', rows=len(chunk)):
+                cleaned, invalid_count = DataProcessor.validate_and_clean_data(chunk, today, duplicates)
+                aggregate.merge(PartialAggregate.from_chunk(cleaned, invalid_count))
+        return aggregate
+
+    @staticmethod
+    def compare_profits(aggregate, country1, country2):
+        """
+            Comparing two countries from the merged state
+        :return: (profit of country1, profit of country2)
+        """
+        table = aggregate.profit_table('Country', [country1, country2])
+        return DataProcessor.report_comparison(table, country1, country2)
+
+    @staticmethod
+    def compare_countries(aggregate, countries=None):
+        """
+            Comparing any number of countries from the merged state
+        :return: profit table
+        """
+        table = aggregate.profit_table('Country', countries)
+        DataProcessor.report_countries(table)
+        return table
+
+    @staticmethod
+    def profit_percentiles(file_path, by='Country', chunk_size=STREAM_CHUNK_SIZE, quantiles=PROFIT_QUANTILES,
+                           keys=()):
+        """
+            Approximate percentiles of Total Profit per group in one pass, memory is bounded by the sketches
+        :param file_path: path to the csv file
+        :param by: 'Country' or 'Region'
+        :param chunk_size: rows per chunk
+        :param quantiles: quantiles to report
+        :param keys: columns identifying an order, repeated orders are skipped
+        :return: DataFrame from ProfitSketch.percentile_table
+        """
+        with Metrics.operation('profit_percentiles', bytes_moved=FileLoader.file_size(file_path)) as metrics:
+            sketches = {}
+            today = pd.Timestamp.today()
+            duplicates = DuplicateIndex(keys)
+            for chunk in FileLoader.iter_chunks(file_path, chunk_size):
+                cleaned, _ = DataProcessor.validate_chunk(chunk, today, duplicates)
+                ProfitSketch.merge_groups(sketches, ProfitSketch.by_group(cleaned, (by,)))
+            table = ProfitSketch.percentile_table(sketches.get(by, {}), quantiles)
+        DataProcessor.report_percentiles(table)
+        print(f"Percentiles calculated in {metrics['wall']:.2f} seconds\n")
+        return table
+
+    @staticmethod
+    def calculate_avg_profit(aggregate):
+        """
+            Exact average profit per order from the merged sums and counts
+        :return: average profit
+        """
+        DataProcessor.report_profit_summary(aggregate.overall)
+        return aggregate.overall.mean
+
+    @staticmethod
+    def calculate_average_profit_by_country(aggregate):
+        """
+            Average profit per country from the merged state
+        :return: dict country -> average profit, sorted by country
+        """
+        merged = {}
+        for country, summary in aggregate.groups['Country'].items():
+            merged.setdefault(str(country).strip(), ProfitSummary()).merge(summary)
+        return {country: summary.mean for country, summary in sorted(merged.items())}
+
+    @staticmethod
+    def analyze_profit_by_region(aggregate):
+        """
+            Total profit per region from the merged state
+        :return: dict region -> profit, sorted by profit
+        """
+        profits = {region: summary.total for region, summary in aggregate.groups['Region'].items()}
+        return dict(sorted(profits.items(), key=lambda item: item[1], reverse=True))
+
+
+class BatchPlan:
+    """
+        Non-interactive analyses, all requested aggregates are computed in one fused scan of the data
+    """
+    # analysis -> aggregate it is answered from
+    ANALYSES = {
+        'compare': 'profit',
+        'countries': 'profit',
+        'region': 'profit',
+        'avg_country': 'profit',
+        'avg': 'profit',
+        'margins': 'margin',
+        'trends': 'cube',
+        'percentiles': 'sketch',
+        'range': 'rollup',
+    }
+
+    # margin sums are kept per Region, Country and Item Type, so any of them can be rolled up
+    MARGIN_GROUPS = ('Region', 'Country', 'Item Type')
+
+    def __init__(self, analyses, keys=()):
+        self.analyses = analyses
+        self.needs = sorted({BatchPlan.ANALYSES[name] for name, _ in analyses})
+        # columns identifying an order, repeated orders are dropped during the scan
+        self.keys = list(keys)
+
+    @staticmethod
+    def all_needs(keys=()):
+        """
+            Plan computing every aggregate, so any analysis can be answered without another scan
+        :param keys: columns identifying an order
+        :return: BatchPlan
+        """
+        return BatchPlan([(name, None) for name in BatchPlan.ANALYSES], keys)
+
+    @staticmethod
+    def parse(specs, keys=()):
+        """
+            Parsing analyses like 'compare=Norway,Japan', 'trends=Norway' or 'region'
+        :param specs: list of strings
+        :param keys: columns identifying an order
+        :return: BatchPlan
+        """
+        analyses = []
+        for spec in specs:
+            name, _, argument = spec.partition('=')
+            name = name.strip()
+            if name not in BatchPlan.ANALYSES:
+                raise ValueError(f"Unknown analysis '{name}', choose from: {', '.join(BatchPlan.ANALYSES)}")
+            analyses.append((name, argument.strip() or None))
+        return BatchPlan(analyses, keys)
+
+    @staticmethod
+    def fused_partial(chunk, needs, today, keys=(), duplicates=None, key_values=False):
+        """
+            Validating a chunk and computing every needed partial aggregate of it in one pass
+        :param chunk:
+        :param needs: aggregates to compute
+        :param today: dates after it are invalid
+        :param keys: columns identifying an order, duplicates within the chunk are dropped
+        :param duplicates: DuplicateIndex shared by the chunks of a sequential scan, replaces keys
+        :param key_values: whether the keys and positions of the kept rows are returned, so the merge finds
+            duplicates across chunks
+        :return: dict of partial aggregates
+        """
+        if duplicates is None:
+            duplicates = DuplicateIndex(keys)
+        cleaned, rejections = DataProcessor.validate_chunk(chunk, today, duplicates)
+        partial = {'rows': len(chunk), 'valid': len(cleaned), 'rejections': rejections}
+        if key_values and duplicates.applies(cleaned):
+            partial['keys'] = DuplicateIndex.key_values(cleaned, duplicates.keys)
+            partial['positions'] = cleaned.index.to_numpy()
+        return BatchPlan.aggregate(partial, cleaned, needs)
+
+    @staticmethod
+    def aggregate(partial, cleaned, needs):
+        """
+            Computing the needed partial aggregates of a validated chunk
+        :param partial: dict from fused_partial, updated in place
+        :param cleaned: validated rows of the chunk
+        :param needs: aggregates to compute
+        :return: partial
+        """
+        if 'profit' in needs:
+            partial['profit'] = PartialAggregate.from_chunk(cleaned, partial['rows'] - len(cleaned))
+        if 'cube' in needs:
+            partial['cube'] = TrendCube.partial(cleaned)
+        if 'margin' in needs:
+            partial['margin'] = DataProcessor.margin_partial(cleaned, BatchPlan.MARGIN_GROUPS)
+        if 'sketch' in needs:
+            partial['sketch'] = ProfitSketch.by_group(cleaned, ('Country', 'Region'))
+        if 'rollup' in needs:
+            partial['rollup'] = MonthlyRollup.partial(cleaned)
+        return partial
+
+    @staticmethod
+    def merge(merged, partial):
+        """
+            Merging a partial into the merged state
+        :param merged: merged state, None for the first partial
+        :param partial: dict from fused_partial
+        :return: merged state
+        """
+        if merged is None:
+            merged = {'rows': 0, 'valid': 0, 'rejections': {}}
+        merged['rows'] += partial['rows']
+        merged['valid'] += partial['valid']
+        for rule, count in partial['rejections'].items():
+            merged['rejections'][rule] = merged['rejections'].get(rule, 0) + count
+        if 'profit' in partial:
+            merged.setdefault('profit', PartialAggregate()).merge(partial['profit'])
+        if 'cube' in partial:
+            parts = [merged['cube'], partial['cube']] if 'cube' in merged else [partial['cube']]
+            merged['cube'] = TrendCube.from_partials(parts).table
+        if 'margin' in partial:
+            parts = [merged['margin'], partial['margin']] if 'margin' in merged else [partial['margin']]
+            merged['margin'] = DataProcessor.merge_margin_partials(parts)
+        if 'sketch' in partial:
+            ProfitSketch.merge_groups(merged.setdefault('sketch', {}), partial['sketch'])
+        if 'rollup' in partial:
+            parts = [merged['rollup'], partial['rollup']] if 'rollup' in merged else [partial['rollup']]
+            merged['rollup'] = MonthlyRollup.from_partials(parts).table
+        return merged
+
+    def collect(self, data, pool=None):
+        """
+            Scanning loaded data once in the workers
+        :param data: DataFrame
+        :param pool: persistent WorkerPool
+        :return: merged state
+        """
+        today = pd.Timestamp.today()
+        merged = None
+        duplicates = DuplicateIndex(self.keys)
+        for partial in DataProcessor.map_chunks(pool, BatchPlan.fused_partial, data, self.needs, today,
+                                                self.keys, None, True):
+            values = partial.pop('keys', None)
+            positions = partial.pop('positions', None)
+            if values is not None:
+                # chunks are resolved in row order, so a repeated order keeps its first valid row
+                keep = duplicates.filter_values(values)
+                if not keep.all():
+                    # merged aggregates cannot drop rows, so a chunk repeating orders of earlier chunks only drops
+                    # those rows from its already validated ones and computes its aggregates again
+                    cleaned, _ = DataProcessor.validate_chunk(data.iloc[positions[keep]], today)
+                    rule = DuplicateIndex.rule(self.keys)
+                    partial['rejections'][rule] = partial['rejections'].get(rule, 0) + int(len(keep) - keep.sum())
+                    partial['valid'] = len(cleaned)
+                    BatchPlan.aggregate(partial, cleaned, self.needs)
+            merged = BatchPlan.merge(merged, partial)
+        return merged
+
+    def countries(self):
+        """
+            Countries the plan reads, so a partitioned dataset is pruned to them
+        :return: list of countries, None when an analysis needs every country
+        """
+        countries = []
+        for name, argument in self.analyses:
+            if name in ('compare', 'countries') and argument:
+                countries.extend(country.strip() for country in argument.split(','))
+            elif name == 'trends' and argument:
+                countries.append(argument)
+            else:
+                return None
+        return countries
+
+    def collect_partitions(self, root, pool=None):
+        """
+            Scanning the partitions of a PartitionedDataset the plan needs, each one in its own worker task
+        :param root: dataset directory
+        :param pool: persistent WorkerPool
+        :return: merged state
+        """
+        if pool is None:
+            with WorkerPool() as temporary_pool:
+                return self.collect_partitions(root, temporary_pool)
+        _, entries = PartitionedDataset.partitions(root, self.countries())
+        merged = None
+        # copies of an order share its Region and Country, so they are found within its partition
+        for partial in pool.map_partitions(BatchPlan.fused_partial, root, entries, self.needs, pd.Timestamp.today(),
+                                           self.keys):
+            merged = BatchPlan.merge(merged, partial)
+        return merged
+
+    def collect_stream(self, file_path, chunk_size=STREAM_CHUNK_SIZE):
+        """
+            Scanning the csv once in bounded chunks
+        :param file_path: path to the csv file
+        :param chunk_size: rows per chunk
+        :return: merged state
+        """
+        merged = None
+        today = pd.Timestamp.today()
+        duplicates = DuplicateIndex(self.keys)
+        for chunk in FileLoader.iter_chunks(file_path, chunk_size):
+            merged = BatchPlan.merge(merged, BatchPlan.fused_partial(chunk, self.needs, today, duplicates=duplicates))
+        return merged
+
+    def run(self, data, pool=None):
+        """
+            Running the plan over loaded data
+        :param data: DataFrame
+        :param pool: persistent WorkerPool
+        :return: report dict
+        """
+        with Metrics.operation('batch', rows=len(data)):
+            return self.report(self.collect(data, pool))
+
+    def run_partitions(self, root, pool=None):
+        """
+            Running the plan over the partitions of a PartitionedDataset
+        :param root: dataset directory
+        :param pool: persistent WorkerPool
+        :return: report dict
+        """
+        with Metrics.operation('batch'):
+            return self.report(self.collect_partitions(root, pool))
+
+    def run_stream(self, file_path, chunk_size=STREAM_CHUNK_SIZE):
+        """
+            Running the plan over the csv in bounded chunks
+        :param file_path: path to the csv file
+        :param chunk_size: rows per chunk
+        :return: report dict
+        """
+        with Metrics.operation('batch', bytes_moved=FileLoader.file_size(file_path)):
+            return self.report(self.collect_stream(file_path, chunk_size))
+
+    def report(self, merged):
+        """
+            Answering every analysis from the merged aggregates
+        :param merged: merged state
+        :return: dict analysis -> list of records
+        """
+        if merged is None:
+            merged = BatchPlan.merge(None, BatchPlan.fused_partial(pd.DataFrame(columns=SALES_COLUMNS), self.needs,
+                                                                   pd.Timestamp.today()))
+        report = {'validation': [dict({'rows': merged['rows'], 'valid_rows': merged['valid']}, **merged['rejections'])]}
+        for name, argument in self.analyses:
+            key = name if argument is None else f"{name}={argument}"
+            if name in ('compare', 'countries'):
+                countries = [country.strip() for country in argument.split(',')] if argument else None
+                table = merged['profit'].profit_table('Country', countries)
+                report[key] = [{'country': country, 'total_profit': row['Total Profit'], 'orders': int(row['Orders'])}
+                               for country, row in table.iterrows()]
+            elif name == 'region':
+                table = merged['profit'].profit_table('Region')
+                report[key] = [{'region': region, 'total_profit': row['Total Profit'], 'orders': int(row['Orders'])}
+                               for region, row in table.iterrows()]
+            elif name == 'avg_country':
+                averages = StreamingProcessor.calculate_average_profit_by_country(merged['profit'])
+                report[key] = [{'country': country, 'average_profit': average} for country, average in averages.items()]
+            elif name == 'avg':
+                summary = merged['profit'].overall
+                report[key] = [summary.stats()]
+            elif name == 'margins':
+                by = [column.strip() for column in argument.split(',')] if argument else ['Item Type']
+                unknown = [column for column in by if column not in BatchPlan.MARGIN_GROUPS]
+                if unknown:
+                    raise ValueError(f"Margins can be grouped by {', '.join(BatchPlan.MARGIN_GROUPS)}, "
+                                     f"not {', '.join(unknown)}")
+                table = DataProcessor.margin_table(merged['margin'], by).reset_index()
+                report[key] = [dict({column.lower().replace(' ', '_'): row[column] for column in by},
+                                    weighted_margin=row['Weighted Margin'], mean_margin=row['Mean Margin'],
+                                    orders=int(row['Orders']))
+                               for _, row in table.iterrows()]
+            elif name == 'percentiles':
+                by = argument or 'Country'
+                if by not in ('Country', 'Region'):
+                    raise ValueError(f"Percentiles can be grouped by Country or Region, not {by}")
+                table = ProfitSketch.percentile_table(merged['sketch'].get(by, {}))
+                report[key] = [dict({by.lower(): group, 'orders': int(row['Orders'])},
+                                    **{column: row[column] for column in table.columns if column != 'Orders'})
+                               for group, row in table.iterrows()]
+            elif name == 'range':
+                # range=2020-01..2020-06[,Region], whole months only: the merged state keeps no rows
+                bounds, _, by = (argument or '..').partition(',')
+                start, _, end = bounds.partition('..')
+                by = by.strip() or 'Country'
+                if by not in MonthlyRollup.KEYS[1:]:
+                    raise ValueError(f"Ranges can be grouped by {', '.join(MonthlyRollup.KEYS[1:])}, not {by}")
+                table = MonthlyRollup(merged['rollup']).totals(by, None, start.strip() or None,
+                                                                end.strip() or None)
+                report[key] = [dict({by.lower().replace(' ', '_'): group},
+                                    **{column.lower().replace(' ', '_'): row[column] for column in table.columns})
+                               for group, row in table.iterrows()]
+            elif name == 'trends':
+                top_products = TrendCube(merged['cube']).top_products(argument)
+                report[key] = [{'year': year, 'rank': rank, 'item_type': item, 'units_sold': units}
+                               for year, products in top_products.items()
+                               for rank, (item, units) in enumerate(products, start=1)]
+        return report
+
+    @staticmethod
+    def write(report, output):
+        """
+            Writing the report as JSON, or as one CSV table with an 'analysis' column when output ends with .csv
+        :param report: dict analysis -> list of records
+        :param output: destination path
+        """
+        if output.lower().endswith('.csv'):
+            frames = [pd.DataFrame(records).assign(analysis=key) for key, records in report.items() if records]
+            table = pd.concat(frames, ignore_index=True)
+            table = table[['analysis'] + [column for column in table.columns if column != 'analysis']]
+            table.to_csv(output, index=False)
+        else:
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, default=Metrics.to_json)
+
+
+def read_csv_in_chunks(src_file, chunk_size, start=0, stop=None):
+    """
+        Method for reading the csv file in chunks of parsed rows
+    :param src_file:
+    :param chunk_size:
+    :param start: byte offset of the first line to read, e.g. where the previous read stopped
+    :param stop: byte offset to stop at, None for the end of the file
+    :return: generator of lists of rows
+    """
+    with open(src_file, mode='rb') as f:
+        f.seek(start)
+
+        def lines():
+            # blocks are split at their last newline, the rest of the line is read with the next block
+            remaining = None if stop is None else stop - start
+            pending = b''
+            while True:
+                size = COPY_BLOCK_SIZE if remaining is None else min(COPY_BLOCK_SIZE, remaining)
+                block = f.read(size) if size > 0 else b''
+                if not block:
+                    if pending:
+                        yield pending.decode('utf-8')
+                    return
+                if remaining is not None:
+                    remaining -= len(block)
+                block = pending + block
+                end = block.rfind(b'\n') + 1
+                pending = block[end:]
+                # lines split like open(newline=''), splitlines would also split on \x1c, \u2028 and others
+                yield from io.StringIO(block[:end].decode('utf-8'), newline='')
+
+        reader = csv.reader(lines())
+        chunk = []
+        for row in reader:
+            # blank lines are skipped like in pd.read_csv
+            if not row:
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def split_byte_ranges(src_file, parts):
+    """
+        Splitting the file into newline aligned byte ranges, quoted newlines are not supported
+    :param src_file: path to the file
+    :param parts: number of ranges to aim for
+    :return: list of (start, stop) byte offsets covering the whole file
+    """
+    size = os.path.getsize(src_file)
+    boundaries = [0]
+    with open(src_file, 'rb') as f:
+        for part in range(1, parts):
+            target = size * part // parts
+            if target <= boundaries[-1]:
+                continue
+            f.seek(target - 1)
+            f.readline()
+            if boundaries[-1] < f.tell() < size:
+                boundaries.append(f.tell())
+    boundaries.append(size)
+    return [(start, stop) for start, stop in zip(boundaries, boundaries[1:]) if start < stop]
+
+
+def copy_byte_range(src_file, dest_file, start, stop):
+    """
+        Copying bytes start:stop to the same offsets of dest_file without parsing them
+    :return: number of bytes copied
+    """
+    with open(src_file, 'rb') as src, open(dest_file, 'r+b') as dest:
+        offset = start
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while offset < stop:
+                    copied = os.copy_file_range(src.fileno(), dest.fileno(), stop - offset, offset, offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                pass
+        src.seek(offset)
+        dest.seek(offset)
+        while offset < stop:
+            block = src.read(min(COPY_BLOCK_SIZE, stop - offset))
+            if not block:
+                break
+            dest.write(block)
+            offset += len(block)
+    return offset - start
+
+
+def copy_parsed_range(src_file, part_file, start, stop, row_filter, encoding, dest_encoding, chunk_size):
+    """
+        Parsing the rows of bytes start:stop and writing the kept rows to a part file
+    :param row_filter: function(row) -> bool, the header row is always kept
+    :return: number of rows written
+    """
+    with open(src_file, 'rb') as src:
+        src.seek(start)
+        # csv.reader splits the rows like open(newline=''), splitlines would also split on \x1c, \u2028 and others
+        lines = io.StringIO(src.read(stop - start).decode(encoding), newline='')
+    written = 0
+    with open(part_file, mode='w', newline='', encoding=dest_encoding) as f:
+        writer = csv.writer(f)
+        batch = []
+        for index, row in enumerate(csv.reader(lines)):
+            if row_filter is None or (start == 0 and index == 0) or row_filter(row):
+                batch.append(row)
+            if len(batch) >= chunk_size:
+                writer.writerows(batch)
+                written += len(batch)
+                batch = []
+        writer.writerows(batch)
+        written += len(batch)
+    return written
+
+
+def without_bom(encoding):
+    """
+        Codec writing the same bytes as encoding without the byte order mark, for the parts after the first
+    :param encoding: encoding name
+    :return: encoding name
+    """
+    name = codecs.lookup(encoding).name
+    if name == 'utf-8-sig':
+        return 'utf-8'
+    if name in ('utf-16', 'utf-32'):
+        # these codecs write the native byte order after their mark
+        return f"{name}-{'le' if sys.byteorder == 'little' else 'be'}"
+    return encoding
+
+
+def copy_csv_parallel(src_file, dest_folder, num_processes=4, chunk_size=50000,
+                      row_filter=None, encoding='utf-8', dest_encoding=None):
+    """
+        Method for copying a csv in parallel, each worker copies one byte range of it
+    :param src_file: csv to copy
+    :param dest_folder: folder for the copy
+    :param num_processes: number of workers
+    :param chunk_size: rows written at once in parsing mode
+    :param row_filter: function(row) -> bool selecting the rows to keep, must be picklable
+    :param encoding: encoding of the source in parsing mode
+    :param dest_encoding: encoding of the copy, defaults to the source encoding
+    :return: path of the copy
+    """
+    try:
+        if not os.path.isfile(src_file):
+            raise FileNotFoundError(f"Error: The file '{src_file}' does not exist.")
+        if not os.path.exists(dest_folder):
+            os.makedirs(dest_folder)
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        dest_file = os.path.join(dest_folder, f"copied_file_{timestamp}.csv")
+        size = os.path.getsize(src_file)
+        with Metrics.operation('copy_csv_parallel', bytes_moved=size) as metrics:
+            with Metrics.stage('split'):
+                parts = max(num_processes, -(-size // COPY_RANGE_SIZE))
+                ranges = split_byte_ranges(src_file, parts)
+
+            if row_filter is None and dest_encoding in (None, encoding):
+                with Metrics.stage('copy', bytes_moved=size):
+                    with open(dest_file, 'wb') as f:
+                        f.truncate(size)
+                    with mp.Pool(processes=num_processes) as pool:
+                        pool.starmap(copy_byte_range, [(src_file, dest_file, start, stop) for start, stop in ranges])
+            else:
+                part_files = [f"{dest_file}.part{index}" for index in range(len(ranges))]
+                # the parts are concatenated, so only the first one starts with the byte order mark
+                part_encodings = [dest_encoding or encoding] + [without_bom(dest_encoding or encoding)] * len(ranges)
+                tasks = [(src_file, part_file, start, stop, row_filter, encoding, part_encoding, chunk_size)
+                         for part_file, part_encoding, (start, stop) in zip(part_files, part_encodings, ranges)]
+                with Metrics.stage('parse and write', bytes_moved=size) as record:
+                    with mp.Pool(processes=num_processes) as pool:
+                        rows = sum(pool.starmap(copy_parsed_range, tasks))
+                    record['rows'] = rows
+                with Metrics.stage('concatenate'):
+                    with open(dest_file, 'wb') as dest:
+                        for part_file in part_files:
+                            with open(part_file, 'rb') as part:
+                                shutil.copyfileobj(part, dest, COPY_BLOCK_SIZE)
+                            os.remove(part_file)
+                print(f"Rows written: {rows}")
+
+        elapsed = metrics['wall']
+        throughput = size / 1024 ** 2 / elapsed if elapsed > 0 else float('inf')
+        print(f"Soubor {src_file} byl úspěšně zkopírován do {dest_file}.")
+        print(f"Copied {size} bytes in {elapsed:.2f} seconds ({throughput:.1f} MB/s)\n")
+        return dest_file
+    except Exception as e:
+        print(f"Error in copying file: {e}")
+        raise
+
+
+class MainApp:
+    """
+        main branch of the program
+    """
+    def __init__(self, file_path, streaming=False, chunk_size=STREAM_CHUNK_SIZE, backend='auto', workers=None,
+                 memory_budget=SCHEDULER_MEMORY_BUDGET, store=False, result_cache=None, dedup_keys=()):
+        self.file_path = file_path
+        self.store = store
+        # columns identifying an order, validation drops the rows repeating one
+        self.dedup_keys = list(dedup_keys)
+        # a partitioned dataset is read per query, only the partitions of the requested countries
+        self.partitioned = PartitionedDataset.is_dataset(file_path)
+        self.data = None
+        # every DataProcessor operation of the menu runs through this scheduler
+        self.pool = WorkerPool(workers, backend, memory_budget)
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.aggregate = None
+        self.cube = None
+        self.rollup = None
+        # 'raw' or 'validated-<date>-<keys>', see fingerprint
+        self.state = 'raw'
+        # end of the processed lines and keys of the kept orders, a refresh reads only the rows appended after it
+        self.cursor = None
+        self.duplicates = None
+        # repeated questions about the same data are answered from here
+        self.results = ResultCache(path=result_cache, types=(ProfitSummary,))
+
+    def dataset(self, countries=None):
+        """
+            Rows an operation needs, for a partitioned dataset that was not loaded only the partitions of countries
+        :param countries: countries the operation reads, None for all of them
+        :return: DataFrame
+        """
+        if self.data is not None or not self.partitioned:
+            return self.data
+        if countries:
+            data = FileLoader.load_partitions(self.file_path, countries=countries)
+            if data is None:
+                raise ValueError("Failed to load the partitions.")
+            return data
+        self.partitioned = False
+        self.load_data()
+        return self.data
+
+    def export_partitions(self, root):
+        """
+            Writing the data as a partitioned dataset
+        :param root: destination directory
+        :return: manifest dict
+        """
+        try:
+            if self.data is None:
+                self.load_data()
+            with Metrics.operation('export_partitions', rows=len(self.data)) as metrics:
+                manifest = PartitionedDataset.write(self.data, root)
+            print(f"Wrote {len(manifest['partitions'])} partitions to '{root}' in {metrics['wall']:.2f} seconds")
+            return manifest
+        except Exception as e:
+            print(f"Error in exporting partitions: {e}")
+            raise
+
+    def trend_cube(self):
+        """
+            TrendCube of the current data, rebuilt only when the data was replaced
+        :return: TrendCube
+        """
+        if self.cube is None or self.cube[0] is not self.data:
+            self.cube = (self.data, TrendCube.build(self.data, self.pool))
+        return self.cube[1]
+
+    def monthly_rollup(self):
+        """
+            MonthlyRollup of the current data, rebuilt only when the data was replaced
+        :return: MonthlyRollup
+        """
+        if self.rollup is None or self.rollup.data is not self.data:
+            self.rollup = MonthlyRollup.build(self.data, self.pool)
+        return self.rollup
+
+    @staticmethod
+    def date_range():
+        """
+            Asking for an optional date range
+        :return: (start, end), None when left empty
+        """
+        start = input("Start date (YYYY-MM-DD or YYYY-MM, empty for all history): ").strip()
+        end = input("End date (YYYY-MM-DD or YYYY-MM, empty for all history): ").strip()
+        return start or None, end or None
+
+    def changed(self):
+        """
+            Pointing the result cache and the workers at the data in memory after a load, validation or append
+        """
+        self.pool.changed()
+        self.results.use(self.fingerprint(self.state), self.data)
+
+    def fingerprint(self, state):
+        """
+            Fingerprint of the data in memory
+        :param state: 'raw' or 'validated-<date>-<keys>'
+        :return: string, None when the input cannot be fingerprinted
+        """
+        source = FileLoader.fingerprint(self.file_path)
+        return None if source is None else f"{source}/{state}"
+
+    def report_cache(self):
+        """
+            Printing the hit and miss statistics of the result cache
+        """
+        stats = self.results.stats()
+        print(f"Result cache: {stats['entries']} of {stats['max_entries']} entries, {stats['hits']} hits, "
+              f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), {stats['evictions']} evictions\n")
+
+    def close(self):
+        """
+            Stopping the worker pool, releasing the shared memory, writing the queued log records and the result cache
+        """
+        self.pool.close()
+        ProfitLog.close()
+        self.results.save()
+
+    def load_data(self):
+        """
+            Loading data method
+        :return: loaded data
+        """
+        try:
+            source_key = FileLoader.source_key(self.file_path)
+            if self.streaming:
+                self.duplicates = DuplicateIndex(self.dedup_keys)
+                self.aggregate = StreamingProcessor.aggregate(self.file_path, self.chunk_size,
+                                                              duplicates=self.duplicates)
+                self.cursor = self.follow(source_key, self.aggregate.rows + self.aggregate.invalid)
+                return
+            self.state = 'raw'
+            self.duplicates = None
+            # partitions are read per query, their frames are not cached
+            self.results.use(self.fingerprint(self.state))
+            if self.partitioned:
+                manifest, _ = PartitionedDataset.partitions(self.file_path)
+                print(f"Partitioned dataset with {manifest['rows']} rows in {len(manifest['partitions'])} partitions, "
+                      f"read per query\n")
+                return
+            print("Loading data...")
+            with Metrics.operation('load_data') as metrics:
+                self.data = FileLoader.load_file(self.file_path, use_store=self.store, pool=self.pool)
+                if self.data is None:
+                    raise ValueError("Failed to load the file.")
+                metrics['rows'] = len(self.data)
+            self.cursor = self.follow(source_key, len(self.data))
+            self.changed()
+            memory_mb = self.data.memory_usage(deep=True).sum() / 1024 ** 2
+            print(f"File loaded successfully in {metrics['wall']:.2f} seconds "
+                  f"({len(self.data)} rows, {memory_mb:.1f} MB in memory)\n")
+        except Exception as e:
+            print(f"Error in loading data: {e}")
+            raise
+
+    def follow(self, source_key, rows):
+        """
+            Cursor at the end of the csv, when the file did not change while it was read
+        :param source_key: FileLoader.source_key taken before reading
+        :param rows: rows read
+        :return: AppendCursor or None
+        """
+        if source_key is None or FileLoader.source_key(self.file_path) != source_key:
+            return None
+        return AppendCursor.at_end(self.file_path, rows)
+
+    def validate(self):
+        """
+            Replacing the data with its validated rows
+        """
+        self.data = DataProcessor.validate_data(self.dataset(), pool=self.pool, keys=self.dedup_keys)
+        self.state = f"validated-{pd.Timestamp.today().date()}"
+        if self.dedup_keys:
+            self.state += f"-{'+'.join(self.dedup_keys)}"
+        # keys of the kept orders are indexed on the first refresh
+        self.duplicates = None
+        # results of the raw rows do not apply to the validated ones
+        self.changed()
+
+    def refresh(self):
+        """
+            Folding the rows appended to the csv since the last load or refresh into the data
+        """
+        try:
+            if self.cursor is None or not self.cursor.is_appended():
+                print("The file was replaced, is compressed or is not one csv file, reloading it...")
+                self.reload()
+                return
+            rows = self.cursor.rows
+            with Metrics.operation('refresh') as metrics:
+                if self.streaming:
+                    StreamingProcessor.fold(self.aggregate, self.cursor.read(self.chunk_size), self.duplicates)
+                else:
+                    self.append(list(self.cursor.read(self.chunk_size)))
+                metrics['rows'] = self.cursor.rows - rows
+            print(f"Refreshed {metrics['rows']} appended rows in {metrics['wall']:.2f} seconds "
+                  f"({self.cursor.rows} rows read in total)\n")
+        except Exception as e:
+            # the state may hold a part of the new rows, the next refresh reloads the file
+            self.cursor = None
+            print(f"Error in refreshing data: {e}")
+            raise
+
+    def reload(self):
+        """
+            Reading the whole input again, validated again when the data was validated
+        """
+        validated = self.state != 'raw'
+        self.data = None
+        self.cube = None
+        self.rollup = None
+        self.load_data()
+        if validated and self.data is not None:
+            self.validate()
+
+    def append(self, chunks):
+        """
+            Appending parsed rows to the data in memory and folding them into the trend cube and cached results
+        :param chunks: list of DataFrame chunks from AppendCursor.read
+        """
+        if not chunks:
+            return
+        tail = FileLoader.concat(chunks)
+        attrs = dict(self.data.attrs)
+        if self.state != 'raw':
+            if self.duplicates is None:
+                self.duplicates = DuplicateIndex(self.dedup_keys)
+                self.duplicates.filter(self.data)
+            rows = len(tail)
+            tail, rejections = DataProcessor.validate_chunk(tail, duplicates=self.duplicates)
+            FileLoader.restore_valid_dtypes(tail)
+            print(f"Invalid appended rows removed: {rows - len(tail)}")
+            DataProcessor.report_rejections(rejections)
+            attrs['rejections'] = {rule: attrs.get('rejections', {}).get(rule, 0) + rejections.get(rule, 0)
+                                   for rule in {**attrs.get('rejections', {}), **rejections}}
+        cube = self.cube[1] if self.cube is not None and self.cube[0] is self.data else None
+        self.data = FileLoader.concat([self.data, tail])
+        self.data.attrs = attrs
+        if cube is not None:
+            self.cube = (self.data, TrendCube.from_partials([cube.table, TrendCube.partial(tail)]))
+        # the rollup keeps the rows sorted by date, it is rebuilt by the next date range query
+        self.rollup = None
+        # the workers need the new rows, the cached results only need the tail folded in
+        self.pool.changed()
+        self.results.fold(self.fingerprint(self.state), self.data,
+                          lambda operation, params, result: DataProcessor.fold_result(operation, params, result, tail))
+
+    def menu(self):
+        """
+            Menu with options
+        :return:
+        """
+        try:
+            while True:
+                print("Menu:")
+                print("1. Compare profits between two countries")
+                print("2. Analyze yearly trends")
+                print("3. Validate and clean data")
+                print("4. Calculate average profit per order")
+                print("5. Calculate profit margin")
+                print("6. Calculate average profit by country")
+                print("7. Analyze profit by region")
+                print("8. Copy file")
+                print("9. Compare profits across countries")
+                print("10. Profit percentiles by country or region")
+                print("11. Result cache statistics")
+                print("12. Refresh rows appended to the file")
+                print("13. Exit")
+
+                choice = input("Enter your choice: ")
+
+                if self.streaming and choice != '13':
+                    self.streaming_choice(choice)
+                elif choice == '1':
+                    country1 = input("Enter first country: ")
+                    country2 = input("Enter second country: ")
+                    start, end = self.date_range()
+                    data = self.dataset([country1, country2])
+                    rollup = self.monthly_rollup() if (start or end) and data is self.data else None
+                    DataProcessor.compare_profits(data, country1, country2, start, end, rollup, self.results)
+                elif choice == '2':
+                    country = input("Enter the country for trend analysis (empty for all countries): ").strip()
+                    start, end = self.date_range()
+                    data = self.dataset([country] if country else None)
+                    if data is not self.data:
+                        DataProcessor.analyze_trends(data, country, pool=self.pool, start=start, end=end)
+                    elif start or end:
+                        DataProcessor.analyze_trends(data, country or None, start=start, end=end,
+                                                     rollup=self.monthly_rollup())
+                    else:
+                        DataProcessor.analyze_trends(data, country or None, cube=self.trend_cube())
+                elif choice == '3':
+                    self.validate()
+                elif choice == '4':
+                    DataProcessor.calculate_avg_profit(self.dataset(), pool=self.pool, cache=self.results)
+                elif choice == '5':
+                    DataProcessor.calculate_profit_margin_data(self.dataset(), pool=self.pool)
+                elif choice == '6':
+                    avg_profit_by_country = DataProcessor.calculate_average_profit_by_country(self.dataset(),
+                                                                                             self.results)
+                    for country, avg_profit in avg_profit_by_country.items():
+                        print(f"Average profit for {country}: {DataProcessor.format_currency(avg_profit)}")
+                elif choice == '7':
+                    profit_by_region = DataProcessor.analyze_profit_by_region(self.dataset(), self.results)
+                    for region, profit in profit_by_region.items():
+                        print(f"Profit for {region}: {DataProcessor.format_currency(profit)}")
+                elif choice == '8':
+                    if not os.path.isfile(self.file_path) or self.file_path.lower().endswith(CSV_EXTENSIONS[1:]):
+                        print("Copying is available for one uncompressed csv file only.")
+                        continue
+                    dest_folder = 'new_file'
+                    copy_csv_parallel(self.file_path, dest_folder)
+                elif choice == '9':
+                    countries = input("Enter countries separated by commas (empty for all): ")
+                    countries = [country.strip() for country in countries.split(',') if country.strip()]
+                    start, end = self.date_range()
+                    data = self.dataset(countries or None)
+                    rollup = self.monthly_rollup() if (start or end) and data is self.data else None
+                    DataProcessor.compare_countries(data, countries or None, start, end, rollup, self.results)
+                elif choice == '10':
+                    DataProcessor.profit_percentiles(self.dataset(), self.percentile_group(), pool=self.pool)
+                elif choice == '11':
+                    self.report_cache()
+                elif choice == '12':
+                    self.refresh()
+                elif choice == '13':
+                    break
+                else:
+                    print("Invalid choice. Please try again.")
+        except Exception as e:
+            print(f"Error in menu operation: {e}")
+            raise
+
+    def run_batch(self, specs, output):
+        """
+            Running the analyses without the menu and writing the report
+        :param specs: list of analyses, e.g. ['compare=Norway,Japan', 'region', 'trends=Norway']
+        :param output: .json or .csv path
+        :return: report dict
+        """
+        try:
+            plan = BatchPlan.parse(specs, self.dedup_keys)
+            if self.streaming:
+                report = plan.run_stream(self.file_path, self.chunk_size)
+            elif self.partitioned and self.data is None:
+                report = plan.run_partitions(self.file_path, self.pool)
+            else:
+                if self.data is None:
+                    self.load_data()
+                report = plan.run(self.data, self.pool)
+            BatchPlan.write(report, output)
+            print(f"Report with {len(specs)} analyses written to {output}")
+            return report
+        except Exception as e:
+            print(f"Error in batch mode: {e}")
+            raise
+
+    def serve(self, socket_path=SOCKET_PATH):
+        """
+            Scanning the data once and answering queries over a Unix socket until interrupted
+        :param socket_path: path of the server socket
+        """
+        try:
+            plan = BatchPlan.all_needs(self.dedup_keys)
+            if self.streaming:
+                merged = plan.collect_stream(self.file_path, self.chunk_size)
+            elif self.partitioned and self.data is None:
+                merged = plan.collect_partitions(self.file_path, self.pool)
+            else:
+                if self.data is None:
+                    self.load_data()
+                merged = plan.collect(self.data, self.pool)
+                # the aggregates answer every query, the rows are not needed any more
+                self.pool.release()
+                self.data = None
+            asyncio.run(AnalyticsServer(merged, BatchPlan.parse, socket_path).serve())
+        except KeyboardInterrupt:
+            print("Server stopped.")
+        except Exception as e:
+            print(f"Error in server mode: {e}")
+            raise
+
+    @staticmethod
+    def percentile_group():
+        """
+            Asking whether percentiles are grouped by country or by region
+        :return: 'Country' or 'Region'
+        """
+        group = input("Group by (1) country or (2) region [1]: ").strip().lower()
+        return 'Region' if group in ('2', 'region') else 'Country'
+
+    def streaming_choice(self, choice):
+        """
+            Menu options answered from the merged partial state in streaming mode
+        :param choice: menu choice
+        """
+        if choice == '1':
+            country1 = input("Enter first country: ")
+            country2 = input("Enter second country: ")
+            StreamingProcessor.compare_profits(self.aggregate, country1, country2)
+        elif choice == '4':
+            StreamingProcessor.calculate_avg_profit(self.aggregate)
+        elif choice == '6':
+            avg_profit_by_country = StreamingProcessor.calculate_average_profit_by_country(self.aggregate)
+            for country, avg_profit in avg_profit_by_country.items():
+                print(f"Average profit for {country}: {DataProcessor.format_currency(avg_profit)}")
+        elif choice == '7':
+            profit_by_region = StreamingProcessor.analyze_profit_by_region(self.aggregate)
+            for region, profit in profit_by_region.items():
+                print(f"Profit for {region}: {DataProcessor.format_currency(profit)}")
+        elif choice == '9':
+            countries = input("Enter countries separated by commas (empty for all): ")
+            countries = [country.strip() for country in countries.split(',') if country.strip()]
+            StreamingProcessor.compare_countries(self.aggregate, countries or None)
+        elif choice == '10':
+            StreamingProcessor.profit_percentiles(self.file_path, self.percentile_group(), self.chunk_size,
+                                                  keys=self.dedup_keys)
+        elif choice == '8':
+            if not os.path.isfile(self.file_path) or self.file_path.lower().endswith(CSV_EXTENSIONS[1:]):
+                print("Copying is available for one uncompressed csv file only.")
+            else:
+                copy_csv_parallel(self.file_path, 'new_file')
+        elif choice == '11':
+            self.report_cache()
+        elif choice == '12':
+            self.refresh()
+        elif choice in ('2', '3', '5'):
+            print("This option needs the whole dataset in memory and is not available in streaming mode.")
+        else:
+            print("Invalid choice. Please try again.")
+
+
+def parse_args(argv=None):
+    """
+        Command line arguments
+    :param argv: list of arguments, None for sys.argv
+    :return: parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Sales CSV analysis")
+    parser.add_argument('file_path', nargs='?', default='record.csv',
+                        help="csv file (.gz, .bz2, .xz and .zip too), directory or quoted glob of csv files, "
+                             "or partitioned dataset directory to analyze")
+    parser.add_argument('--stream', action='store_true', help="read the file in bounded chunks instead of loading it")
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE, help="rows per chunk in streaming mode")
+    parser.add_argument('--store', action='store_true',
+                        help="map the data from a binary column store next to the csv, written on first use")
+    parser.add_argument('--backend', choices=SCHEDULER_BACKENDS, default='auto',
+                        help="how operations run: serial, thread or process pool, auto picks by data size")
+    parser.add_argument('--workers', type=int, default=None, help="threads or processes, default all cores")
+    parser.add_argument('--memory-budget', type=int, default=SCHEDULER_MEMORY_BUDGET // 1024 ** 2,
+                        help="MB of rows processed at the same time, larger inputs are split into more chunks")
+    parser.add_argument('--batch', nargs='+', metavar='ANALYSIS',
+                        help="run analyses without the menu in one scan: " + ", ".join(BatchPlan.ANALYSES)
+                             + " (e.g. compare=Norway,Japan trends=Norway)")
+    parser.add_argument('--output', default='report.json', help="report of the batch mode, .json or .csv")
+    parser.add_argument('--serve', action='store_true',
+                        help="keep the aggregates in memory and answer queries over a Unix socket")
+    parser.add_argument('--query', nargs='+', metavar='ANALYSIS',
+                        help="ask a running server, the analyses are the same as --batch")
+    parser.add_argument('--export-partitions', metavar='DIR',
+                        help="write the data partitioned by Region and Country into DIR and exit")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="socket path of --serve and --query")
+    parser.add_argument('--result-cache', metavar='FILE',
+                        help="keep the results of repeated queries in FILE between sessions")
+    parser.add_argument('--dedup-keys', type=lambda value: [key.strip() for key in value.split(',') if key.strip()],
+                        nargs='?', const=DEDUP_KEYS, default=[], metavar='COLUMNS',
+                        help="drop repeated orders during validation, identified by these comma separated columns "
+                             "(Order ID when no columns are given)")
+    parser.add_argument('--metrics', help="append per-stage timings to this JSON lines file")
+    parser.add_argument('--profile', metavar='OPERATION',
+                        help="capture cProfile and tracemalloc for one operation, e.g. validate_data")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    Metrics.configure(args.metrics, args.profile)
+    if args.query:
+        print(json.dumps(query_server({'analyses': args.query}, args.socket), indent=2))
+        sys.exit(0)
+    app = MainApp(args.file_path, streaming=args.stream, chunk_size=args.chunk_size, backend=args.backend,
+                  workers=args.workers, memory_budget=args.memory_budget * 1024 ** 2, store=args.store,
+                  result_cache=args.result_cache, dedup_keys=args.dedup_keys)
+    try:
+        if args.export_partitions:
+            app.export_partitions(args.export_partitions)
+        elif args.serve:
+            app.serve(args.socket)
+        elif args.batch:
+            app.run_batch(args.batch, args.output)
+        else:
+            app.load_data()
+            app.menu()
+    finally:
+        app.close()
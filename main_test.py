@@ -1,164 +1,1119 @@
-import unittest
-import pandas as pd
-from unittest.mock import patch, MagicMock
-from io import StringIO
-import os
-import time
-
-
-class TestFileLoader(unittest.TestCase):
-
-    @patch('os.path.isfile')
-    @patch('pandas.read_csv')
-    def test_load_file_success(self, mock_read_csv, mock_isfile):
-        # Setup mocks
-        mock_isfile.return_value = True
-        mock_read_csv.return_value = pd.DataFrame({
-            'Country': ['USA', 'Canada'],
-            'Total Profit': [1000, 1500],
-            'Order Date': ['2021-06-15', '2021-06-16']
-        })
-
-        loader = FileLoader()
-        data = loader.load_file('test.csv')
-
-        # Test results
-        self.assertIsNotNone(data)
-        self.assertEqual(data.shape[0], 2)  # Two rows in test data
-        self.assertIn('Country', data.columns)
-        self.assertIn('Total Profit', data.columns)
-
-    @patch('os.path.isfile')
-    def test_load_file_file_not_found(self, mock_isfile):
-        # Mock the file check to simulate file not found
-        mock_isfile.return_value = False
-        loader = FileLoader()
-        result = loader.load_file('non_existent_file.csv')
-
-        # Test if None is returned on error
-        self.assertIsNone(result)
-
-    @patch('os.path.isfile')
-    @patch('pandas.read_csv')
-    def test_load_file_missing_column(self, mock_read_csv, mock_isfile):
-        # Setup mocks
-        mock_isfile.return_value = True
-        mock_read_csv.return_value = pd.DataFrame({
-            'Country': ['USA'],
-            'Order Date': ['2021-06-15']
-        })
-
-        loader = FileLoader()
-        result = loader.load_file('test.csv')
-
-        # Test if MissingColumnError is raised
-        self.assertIsNone(result)
-
-
-class TestDataProcessor(unittest.TestCase):
-
-    def test_format_currency_valid(self):
-        processor = DataProcessor()
-        result = processor.format_currency(1000)
-        self.assertEqual(result, "1,000.00 USD")
-
-    def test_format_currency_invalid(self):
-        processor = DataProcessor()
-        with self.assertRaises(Exception):
-            processor.format_currency("invalid")
-
-    def test_calculate_profit(self):
-        data = pd.DataFrame({
-            'Country': ['USA', 'USA', 'Canada'],
-            'Total Profit': [1000, 2000, 1500],
-            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16']
-        })
-        processor = DataProcessor()
-        result = processor.calculate_profit(data, 'USA')
-        self.assertEqual(result, 3000)
-
-    def test_calculate_profit_no_data(self):
-        data = pd.DataFrame({
-            'Country': ['Canada'],
-            'Total Profit': [1500],
-            'Order Date': ['2021-06-16']
-        })
-        processor = DataProcessor()
-        with self.assertRaises(ValueError):
-            processor.calculate_profit(data, 'USA')
-
-    def test_analyze_trends_by_year(self):
-        data = pd.DataFrame({
-            'Country': ['USA', 'USA', 'Canada'],
-            'Total Profit': [1000, 2000, 1500],
-            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16']
-        })
-        processor = DataProcessor()
-        trends = processor.analyze_trends_by_year(data)
-        self.assertEqual(trends, {2021: 4500})
-
-    def test_validate_and_clean_data(self):
-        data = pd.DataFrame({
-            'Country': ['USA', None, 'Canada'],
-            'Total Profit': [1000, 2000, None],
-            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16'],
-            'Units Sold': [1, 2, 0],
-            'Unit Price': [100, 200, 150],
-            'Unit Cost': [50, 100, 120],
-            'Total Revenue': [500, 400, 300]
-        })
-        processor = DataProcessor()
-        cleaned_data, invalid_count = processor.validate_and_clean_data(data)
-
-        # Test if the invalid rows were removed
-        self.assertEqual(invalid_count, 1)  # One row with missing data
-        self.assertEqual(cleaned_data.shape[0], 2)
-
-    def test_calculate_average_profit_per_order(self):
-        data = pd.DataFrame({
-            'Country': ['USA', 'USA', 'Canada'],
-            'Total Profit': [1000, 2000, 1500],
-            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16']
-        })
-        processor = DataProcessor()
-        avg_profit = processor.calculate_average_profit_per_order(data)
-        self.assertEqual(avg_profit, 1500)
-
-    @patch('multiprocessing.Pool.starmap')
-    def test_compare_profits(self, mock_starmap):
-        data = pd.DataFrame({
-            'Country': ['USA', 'Canada'],
-            'Total Profit': [1000, 1500],
-            'Order Date': ['2021-06-15', '2021-06-16']
-        })
-        processor = DataProcessor()
-
-        # Mock the result of starmap
-        mock_starmap.return_value = [1000, 2000]
-
-        with patch('builtins.print') as mocked_print:
-            processor.compare_profits(data, 'USA', 'Canada')
-            mocked_print.assert_any_call("Total profit for USA: 1,000.00 USD")
-            mocked_print.assert_any_call("Total profit for Canada: 2,000.00 USD")
-            mocked_print.assert_any_call("Canada has a higher profit by 1,000.00 USD.")
-
-    @patch('multiprocessing.Pool.starmap')
-    def test_analyze_trends(self, mock_starmap):
-        data = pd.DataFrame({
-            'Country': ['USA', 'USA', 'Canada'],
-            'Total Profit': [1000, 2000, 1500],
-            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16'],
-            'Item Type': ['A', 'B', 'A']
-        })
-        processor = DataProcessor()
-
-        # Mock the result of starmap
-        mock_starmap.return_value = [data]
-
-        with patch('builtins.print') as mocked_print:
-            processor.analyze_trends(data, 'USA')
-            mocked_print.assert_any_call("Analyzing trends by year for USA...")
-
-
-if __name__ == '__main__':
-    unittest.main()
+import unittest
+import numpy as np
+import pandas as pd
+from unittest.mock import patch, MagicMock
+from io import StringIO
+import os
+import time
+import tempfile
+import json
+import csv
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from main import (AppendCursor, MainApp, FileLoader, DataProcessor, GroupKernel, DuplicateIndex,
+                  ProfitSummary, ProfitSketch, MonthlyRollup, StreamingProcessor, TrendCube, BatchPlan,
+                  copy_csv_parallel, split_byte_ranges, read_csv_in_chunks, DEDUP_KEYS, PROFIT_SKETCH_ACCURACY)
+from metrics import Metrics, ProfitLog
+from shared_frame import SharedFrame, attach_frame, detach_frame
+from store import ColumnStore, PartitionedDataset, encode_columns, decode_columns
+from scheduler import WorkerPool
+from result_cache import ResultCache
+from server import AnalyticsServer, query_server
+
+LOG_FOLDER = tempfile.TemporaryDirectory()
+
+
+def use_temporary_log():
+    # analyses log their profit summaries, the tests write them to a temporary file
+    ProfitLog.configure(os.path.join(LOG_FOLDER.name, 'profit.log'))
+
+
+def setUpModule():
+    use_temporary_log()
+
+
+def tearDownModule():
+    ProfitLog.configure()
+    LOG_FOLDER.cleanup()
+
+
+def keep_norway(row):
+    return row[1] == 'Norway'
+
+
+def write_csv(file_path, *lines, mode='w'):
+    with open(file_path, mode, newline='', encoding='utf-8') as f:
+        f.write(''.join(lines))
+    return file_path
+
+
+class CsvTestCase(unittest.TestCase):
+    # every test writes its csv files to its own temporary folder
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def write_csv(self, *lines, name='record.csv'):
+        return write_csv(os.path.join(self.folder.name, name), *lines)
+
+
+SALES_ROWS = [
+    "Region,Country,Item Type,Order Date,Units Sold,Unit Price,Unit Cost,Total Revenue,Total Profit\n",
+    "Europe,Norway,Fruits,6/15/2020,1,10,5,10,5.0\n",
+    "Asia,Japan,Meat,6/16/2021,2,10,5,20,10.0\n",
+    "Europe,Norway,Meat,6/17/2021,0,10,5,0,0.0\n",
+    "Europe,Norway,Fruits,6/18/2021,3,10,5,30,15.0\n",
+    "Asia,Japan,Fruits,6/19/2021,4,10,5,40,10.0\n",
+]
+
+
+class TestFileLoader(CsvTestCase):
+
+    @patch('os.path.isfile')
+    @patch('pandas.read_csv')
+    def test_load_file_success(self, mock_read_csv, mock_isfile):
+        # Setup mocks
+        mock_isfile.return_value = True
+        mock_read_csv.return_value = pd.DataFrame({
+            'Country': ['USA', 'Canada'],
+            'Total Profit': [1000, 1500],
+            'Order Date': ['2021-06-15', '2021-06-16']
+        })
+
+        loader = FileLoader()
+        data = loader.load_file('test.csv')
+
+        # Test results
+        self.assertIsNotNone(data)
+        self.assertEqual(data.shape[0], 2)  # Two rows in test data
+        self.assertIn('Country', data.columns)
+        self.assertIn('Total Profit', data.columns)
+
+    @patch('os.path.isfile')
+    def test_load_file_file_not_found(self, mock_isfile):
+        # Mock the file check to simulate file not found
+        mock_isfile.return_value = False
+        loader = FileLoader()
+        result = loader.load_file('non_existent_file.csv')
+
+        # Test if None is returned on error
+        self.assertIsNone(result)
+
+    @patch('os.path.isfile')
+    @patch('pandas.read_csv')
+    def test_load_file_missing_column(self, mock_read_csv, mock_isfile):
+        # Setup mocks
+        mock_isfile.return_value = True
+        mock_read_csv.return_value = pd.DataFrame({
+            'Country': ['USA'],
+            'Order Date': ['2021-06-15']
+        })
+
+        loader = FileLoader()
+        result = loader.load_file('test.csv')
+
+        # Test if MissingColumnError is raised
+        self.assertIsNone(result)
+
+    def test_load_file_uses_cache_until_source_changes(self):
+        file_path = self.write_csv("Region,Country,Total Profit,Order Date\n",
+                                   "Europe,Norway,100.5,6/15/2021\n",
+                                   "Asia,,200.0,6/16/2021\n")
+
+        cold = FileLoader.load_file(file_path)
+        self.assertTrue(os.path.isfile(file_path + '.cache.json'))
+
+        with patch('pandas.read_csv') as mock_read_csv:
+            warm = FileLoader.load_file(file_path)
+            mock_read_csv.assert_not_called()
+        pd.testing.assert_frame_equal(cold, warm, check_dtype=False)
+
+        write_csv(file_path, "Europe,Norway,300.0,6/17/2021\n", mode='a')
+        refreshed = FileLoader.load_file(file_path)
+        self.assertEqual(refreshed.shape[0], 3)
+
+    def test_load_file_applies_sales_schema(self):
+        file_path = self.write_csv("Region,Country,Item Type,Sales Channel,Order Date,Units Sold,Unit Price,"
+                                   "Total Profit\n",
+                                   "Europe,Norway,Cereal,Online,6/15/2021,10,2.5,100.5\n",
+                                   "Asia,Japan,Fruits,Offline,13/45/2021,abc,3.0,200.0\n")
+
+        data = FileLoader.load_file(file_path, use_cache=False)
+
+        self.assertNotIn('Sales Channel', data.columns)
+        self.assertIsInstance(data['Country'].dtype, pd.CategoricalDtype)
+        self.assertEqual(data['Unit Price'].dtype, 'float32')
+        self.assertEqual(data['Units Sold'].dtype, 'float32')  # 'abc' is kept as NaN
+        self.assertEqual(data['Order Date'].iloc[0], pd.Timestamp('2021-06-15'))
+        self.assertTrue(pd.isna(data['Order Date'].iloc[1]))
+
+    def test_date_parts_are_derived_once_and_restored_after_validation(self):
+        file_path = self.write_csv("Country,Order Date,Units Sold,Total Profit\n",
+                                   "Norway,11/15/2021,10,100.5\n",
+                                   "Japan,not a date,5,200.0\n")
+
+        data = FileLoader.load_file(file_path, use_cache=False)
+
+        self.assertEqual(data[['Year', 'Quarter', 'Month']].iloc[0].tolist(), [2021, 4, 11])
+        self.assertTrue(pd.isna(data['Year'].iloc[1]))
+        cleaned, _ = DataProcessor.validate_chunk(data)
+        self.assertEqual(len(cleaned), 1)
+        self.assertEqual((cleaned['Year'].dtype, cleaned['Month'].dtype), ('int16', 'int8'))
+
+    def test_dates_outside_the_fixed_format_are_parsed(self):
+        file_path = self.write_csv("Country,Order Date,Units Sold,Total Profit\n",
+                                   "Norway,2021-06-15 10:30:00,10,100.5\n",
+                                   "Japan,2021-11-02,5,200.0\n",
+                                   "Norway,2021/06/15,10,100.5\n",
+                                   "Japan,6/15/2021 10:30,5,200.0\n",
+                                   "Norway,15.06.2021,10,100.5\n",
+                                   "Japan,not a date,5,200.0\n")
+
+        data = FileLoader.load_file(file_path, use_cache=False)
+
+        self.assertEqual(data['Order Date'].tolist()[:5], [
+            pd.Timestamp('2021-06-15 10:30'), pd.Timestamp('2021-11-02'), pd.Timestamp('2021-06-15'),
+            pd.Timestamp('2021-06-15 10:30'), pd.Timestamp('2021-06-15')])
+        self.assertTrue(pd.isna(data['Order Date'].iloc[5]))
+        self.assertEqual(data['Quarter'].tolist()[:5], [2, 4, 2, 2, 2])
+        with patch('builtins.print'):
+            self.assertEqual(len(DataProcessor.validate_data(data)), 5)
+
+    def test_column_store_is_mapped_by_the_workers(self):
+        file_path = self.write_csv("Region,Country,Order Date,Units Sold,Total Profit\n",
+                                   "Europe,Norway,6/15/2021,10,100.0\n",
+                                   "Asia,Japan,6/16/2021,5,300.0\n")
+        loaded = FileLoader.load_file(file_path, use_cache=False)
+        data = FileLoader.load_file(file_path, use_store=True)
+
+        self.assertTrue(os.path.isfile(os.path.join(ColumnStore.path(file_path), 'store.json')))
+        pd.testing.assert_frame_equal(data, loaded)
+        self.assertIsNotNone(ColumnStore.of(data))
+        self.assertIsNone(ColumnStore.of(data.iloc[:1]))
+        Metrics.records.clear()
+        with WorkerPool(processes=2, backend='process') as pool, patch('builtins.print'):
+            self.assertEqual(DataProcessor.calculate_avg_profit(data, pool=pool), 200.0)
+        publish = [record for record in Metrics.records if record['stage'] == 'publish']
+        self.assertEqual(publish[0]['bytes'], 0)
+
+        write_csv(file_path, "Asia,Japan,6/17/2021,5,500.0\n", mode='a')
+        self.assertIsNone(ColumnStore.open(file_path, FileLoader.source_key(file_path)))
+        self.assertEqual(len(FileLoader.load_file(file_path, use_store=True)), 3)
+
+    def test_partitioned_dataset_reads_only_the_requested_partitions(self):
+        file_path = self.write_csv("Region,Country,Item Type,Order Date,Units Sold,Total Profit\n",
+                                   "Europe,Norway,Fruits,6/15/2021,10,100.0\n",
+                                   "Asia,Japan,Meat,6/16/2021,5,300.0\n",
+                                   "Europe,Czech Republic,Meat,6/17/2021,1,50.0\n",
+                                   "Europe,,Fruits,6/18/2021,2,20.0\n",
+                                   "Asia,Japan,Fruits,6/19/2021,5,500.0\n")
+        loaded = FileLoader.load_file(file_path, use_cache=False)
+        root = os.path.join(self.folder.name, 'sales')
+        manifest = PartitionedDataset.write(loaded, root)
+
+        self.assertEqual(len(manifest['partitions']), 4)
+        self.assertTrue(os.path.isfile(os.path.join(root, 'Region=Europe', 'Country=Czech Republic',
+                                                    'part-0.npz')))
+        self.assertTrue(os.path.isdir(os.path.join(root, 'Region=Europe', 'Country=__HIVE_DEFAULT_PARTITION__')))
+        japan = FileLoader.load_partitions(root, countries=['Japan'])
+        self.assertEqual(list(japan['Total Profit']), [300.0, 500.0])
+        self.assertEqual(list(japan.columns), list(loaded.columns))
+        everything = FileLoader.load_file(root)
+        self.assertEqual(len(everything), 5)
+        self.assertEqual(everything['Country'].isna().sum(), 1)
+        self.assertEqual(dict(everything.dtypes), dict(loaded.dtypes))
+
+        Metrics.records.clear()
+        with WorkerPool(processes=2, backend='process') as pool:
+            report = BatchPlan.parse(['compare=Japan,Norway']).run_partitions(root, pool)
+        self.assertEqual(report['validation'][0]['rows'], 3)
+        self.assertEqual([(r['country'], r['total_profit']) for r in report['compare=Japan,Norway']],
+                         [('Japan', 800.0), ('Norway', 100.0)])
+        compute = [record for record in Metrics.records if record['stage'] == 'worker compute']
+        self.assertEqual((compute[0]['backend'], compute[0]['chunks']), ('process', 2))
+        with self.assertRaises(ValueError):
+            PartitionedDataset.write(loaded, self.folder.name)
+
+    def test_directory_and_glob_of_compressed_files_load_as_one_dataset(self):
+        folder = self.folder.name
+        header = "Region,Country,Item Type,Order Date,Units Sold,Total Profit\n"
+        days = {'day1.csv': "Europe,Norway,Fruits,6/1/2021,10,100.0\n",
+                'day2.csv.gz': "Asia,Japan,Meat,6/2/2021,5,300.0\n",
+                'day3.csv.bz2': "Asia,Japan,Fruits,6/3/2021,5,500.0\nEurope,Norway,Meat,6/3/2021,1,50.0\n"}
+        for name, rows in days.items():
+            pd.read_csv(StringIO(header + rows)).to_csv(os.path.join(folder, name), index=False)
+        with WorkerPool(processes=2, backend='process') as pool, patch('builtins.print'):
+            data = FileLoader.load_file(folder, pool=pool)
+            cached = FileLoader.load_file(os.path.join(folder, 'day*.csv*'), pool=pool)
+
+        self.assertEqual(list(data['Total Profit']), [100.0, 300.0, 500.0, 50.0])
+        self.assertIsInstance(data['Country'].dtype, pd.CategoricalDtype)
+        self.assertEqual(str(data['Order Date'].dtype), str(cached['Order Date'].dtype))
+        pd.testing.assert_frame_equal(cached, data)
+        self.assertEqual(sum(len(chunk) for chunk in FileLoader.iter_chunks(folder, chunk_size=1)), 4)
+
+        self.write_csv("Region,Country,Units Sold\nAsia,Japan,1\n", name='day4.csv')
+        with patch('builtins.print') as mocked_print:
+            self.assertIsNone(FileLoader.load_file(folder, use_cache=False))
+        self.assertIn('day4.csv', str(mocked_print.call_args))
+
+    def test_downcast_keeps_clean_integers(self):
+        column = FileLoader.downcast(pd.Series([1, 2, 3]), 'int32')
+        self.assertEqual(column.dtype, 'int32')
+
+    def test_encode_decode_columns_roundtrip(self):
+        data = pd.DataFrame({
+            'Country': ['USA', None, 'Canada'],
+            'Region': pd.Categorical(['A', 'B', 'A']),
+            'Total Profit': [1000.0, 2000.0, 1500.0],
+            'Order Date': pd.to_datetime(['2021-06-15', '2021-06-16', None])
+        })
+        arrays, columns = encode_columns(data)
+        decoded = decode_columns(arrays, columns)
+        pd.testing.assert_frame_equal(data, decoded, check_dtype=False)
+
+
+class TestDataProcessor(unittest.TestCase):
+
+    def test_format_currency_valid(self):
+        processor = DataProcessor()
+        result = processor.format_currency(1000)
+        self.assertEqual(result, "1,000.00 USD")
+
+    def test_format_currency_invalid(self):
+        processor = DataProcessor()
+        with self.assertRaises(Exception):
+            processor.format_currency("invalid")
+
+    def test_calculate_profit(self):
+        data = pd.DataFrame({
+            'Country': ['USA', 'USA', 'Canada'],
+            'Total Profit': [1000, 2000, 1500],
+            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16']
+        })
+        processor = DataProcessor()
+        result = processor.calculate_profit(data, 'USA')
+        self.assertEqual(result, 3000)
+
+    def test_calculate_profit_no_data(self):
+        data = pd.DataFrame({
+            'Country': ['Canada'],
+            'Total Profit': [1500],
+            'Order Date': ['2021-06-16']
+        })
+        processor = DataProcessor()
+        with self.assertRaises(ValueError):
+            processor.calculate_profit(data, 'USA')
+
+    def test_analyze_trends_by_year(self):
+        data = pd.DataFrame({
+            'Country': ['USA', 'USA', 'Canada'],
+            'Total Profit': [1000, 2000, 1500],
+            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16']
+        })
+        processor = DataProcessor()
+        trends = processor.analyze_trends_by_year(data)
+        self.assertEqual(trends, {2021: 4500})
+
+    def test_validate_and_clean_data(self):
+        data = pd.DataFrame({
+            'Country': ['USA', None, 'Canada'],
+            'Total Profit': [1000, 2000, None],
+            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16'],
+            'Units Sold': [1, 2, 0],
+            'Unit Price': [100, 200, 150],
+            'Unit Cost': [50, 100, 120],
+            'Total Revenue': [500, 400, 300]
+        })
+        processor = DataProcessor()
+        cleaned_data, invalid_count = processor.validate_and_clean_data(data)
+
+        # Test if the invalid rows were removed
+        self.assertEqual(invalid_count, 2)  # Missing Country, missing Total Profit and zero Units Sold
+        self.assertEqual(cleaned_data.shape[0], 1)
+
+    def test_validate_chunk_counts_rejections_per_rule(self):
+        data = pd.DataFrame({
+            'Country': ['USA', None, 'Canada', 'Peru', 'Chad'],
+            'Total Profit': ['1000', '2000', 'abc', '300', '400'],
+            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16', '2999-01-01', 'not a date'],
+            'Units Sold': [1, 2, 0, 1, 1],
+            'Unit Price': [100, 200, 150, 10, 10],
+            'Unit Cost': [50, 100, 120, 5, 5],
+            'Total Revenue': [500, 400, 300, 10, 10]
+        })
+        cleaned, rejections = DataProcessor.validate_chunk(data, today=pd.Timestamp('2024-12-16'))
+
+        self.assertEqual(list(cleaned['Country']), ['USA'])
+        self.assertEqual(cleaned['Total Profit'].iloc[0], 1000)
+        self.assertEqual(rejections['missing fields'], 1)
+        self.assertEqual(rejections['bad Total Profit'], 1)
+        self.assertEqual(rejections['non-positive Units Sold'], 1)
+        self.assertEqual(rejections['future Order Date'], 1)
+        self.assertEqual(len(cleaned), 1)
+
+    def test_calculate_average_profit_per_order(self):
+        data = pd.DataFrame({
+            'Country': ['USA', 'USA', 'Canada'],
+            'Total Profit': [1000, 2000, 1500],
+            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16']
+        })
+        processor = DataProcessor()
+        avg_profit = processor.calculate_average_profit_per_order(data)
+        self.assertEqual(avg_profit, 1500)
+
+    def test_compare_profits(self):
+        data = pd.DataFrame({
+            'Country': ['USA', 'Canada', 'Canada'],
+            'Total Profit': [1000, 1500, 500],
+            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-17']
+        })
+        processor = DataProcessor()
+
+        with patch('builtins.print') as mocked_print:
+            processor.compare_profits(data, 'USA', 'Canada')
+            mocked_print.assert_any_call("Total profit for USA: 1,000.00 USD")
+            mocked_print.assert_any_call("Total profit for Canada: 2,000.00 USD")
+            mocked_print.assert_any_call("Canada has a higher profit by 1,000.00 USD.")
+
+    def test_profit_by_country(self):
+        data = pd.DataFrame({
+            'Country': pd.Categorical(['USA', 'Canada', 'Canada', 'Mexico']),
+            'Total Profit': [1000.0, 1500.0, 500.0, 700.0]
+        })
+        table = DataProcessor.profit_by_country(data, ['Canada', 'USA', 'Peru'])
+        self.assertEqual(list(table.index), ['Canada', 'USA', 'Peru'])
+        self.assertEqual(table.at['Canada', 'Total Profit'], 2000.0)
+        self.assertEqual(table.at['Canada', 'Orders'], 2)
+        self.assertEqual(table.at['Peru', 'Orders'], 0)
+
+        all_countries = DataProcessor.profit_by_country(data)
+        self.assertEqual(len(all_countries), 3)
+
+    def test_analyze_trends(self):
+        data = pd.DataFrame({
+            'Country': ['USA', 'USA', 'Canada', 'USA'],
+            'Total Profit': [1000, 2000, 1500, 500],
+            'Order Date': ['2021-06-15', '2021-06-16', '2021-06-16', '2022-01-01'],
+            'Item Type': ['A', 'B', 'A', 'C'],
+            'Units Sold': [5, 10, 50, 1]
+        })
+        processor = DataProcessor()
+
+        with patch('builtins.print') as mocked_print:
+            trends = processor.analyze_trends(data, 'USA')
+            mocked_print.assert_any_call("Analyzing trends by year for USA...")
+            mocked_print.assert_any_call("Year 2021: B, A")
+        self.assertEqual(trends, {2021: [('B', 10), ('A', 5)], 2022: [('C', 1)]})
+
+    def test_trend_cube_top_products_are_exact_across_chunks(self):
+        data = pd.DataFrame({
+            'Country': ['USA'] * 8,
+            'Order Date': pd.to_datetime(['2021-01-01'] * 8),
+            'Item Type': ['A', 'B', 'C', 'D', 'A', 'B', 'C', 'D'],
+            'Units Sold': [10, 9, 8, 1, 1, 2, 3, 20],
+            'Total Profit': [1.0] * 8
+        })
+        cube = TrendCube.from_partials([TrendCube.partial(data.iloc[:4]), TrendCube.partial(data.iloc[4:])])
+
+        self.assertEqual(cube.top_products('USA'), {2021: [('D', 21), ('A', 11), ('B', 11)]})
+        self.assertEqual(cube.top_products(None, k=1, by='Total Profit'), {2021: [('A', 2.0)]})
+        self.assertEqual(cube.top_products('Peru'), {})
+        # an empty file gives empty cubes and rollups, not missing columns
+        self.assertEqual(TrendCube.from_partials([]).top_products(by='Units Sold'), {})
+        self.assertEqual(MonthlyRollup.from_partials([]).top_products(), {})
+        self.assertEqual(MonthlyRollup.from_partials([]).profit_table('Country', ['USA']).loc['USA', 'Orders'], 0)
+
+    def test_margin_report_is_aggregated_per_group(self):
+        data = pd.DataFrame({
+            'Country': ['USA', 'USA', 'Canada', 'Canada'],
+            'Item Type': ['A', 'B', 'A', 'B'],
+            'Total Profit': [10.0, 0.5, 30.0, 4.0],
+            'Total Revenue': [100.0, 10.0, 100.0, 40.0]
+        })
+        with WorkerPool(processes=2) as pool, patch('builtins.print') as mocked_print:
+            table = DataProcessor.calculate_profit_margin_data(data, pool=pool, top=1, bottom=1)
+            mocked_print.assert_any_call("  A: 20.00% of revenue, mean 20.00% per order (2 orders)")
+            by_country = DataProcessor.calculate_profit_margin_data(data, pool=pool, by=('Country', 'Item Type'))
+
+        self.assertEqual(list(table.index), ['A', 'B'])
+        self.assertAlmostEqual(table.at['B', 'Weighted Margin'], 4.5 / 50.0)
+        self.assertAlmostEqual(table.at['B', 'Mean Margin'], 0.075)
+        self.assertEqual(by_country.index[0], ('Canada', 'A'))
+        highest, lowest = DataProcessor.margin_extremes(by_country, top=2, bottom=2)
+        self.assertEqual(list(lowest.index), [('USA', 'B'), ('USA', 'A')])
+        self.assertNotIn('Profit Margin', data.columns)
+        DataProcessor.calculate_profit_margin(data)
+        self.assertNotIn('Profit Margin', data.columns)
+
+    def test_monthly_rollup_answers_date_ranges_with_partial_months(self):
+        dates = pd.date_range('2021-01-01', '2021-12-31', freq='D')
+        data = pd.DataFrame({
+            'Region': 'North America',
+            'Country': np.where(np.arange(len(dates)) % 3 == 0, 'USA', 'Canada'),
+            'Item Type': np.where(np.arange(len(dates)) % 2 == 0, 'A', 'B'),
+            'Order Date': dates,
+            'Units Sold': np.arange(len(dates)) + 1,
+            'Total Profit': np.arange(len(dates), dtype=float),
+        })
+        rollup = MonthlyRollup.build(data, WorkerPool(backend='serial'))
+        self.assertEqual(len(rollup.table), 12 * 4)
+        for start, end in [('2021-03-15', '2021-07-09'), ('2021-05-03', '2021-05-20'), ('2021-02', '2021-04'),
+                           (None, '2021-02-10'), ('2021-11-30', None)]:
+            first = pd.Timestamp(start or '2021-01-01')
+            last = pd.Timestamp(end or '2021-12-31') + (pd.offsets.MonthEnd(0) if len(end or '') == 7 else
+                                                        pd.Timedelta(0))
+            window = data[(data['Order Date'] >= first) & (data['Order Date'] <= last)]
+            expected = window.groupby('Country')['Total Profit'].agg(['sum', 'count'])
+            table = rollup.profit_table('Country', ['USA', 'Canada'], start, end)
+            self.assertEqual(table.at['USA', 'Total Profit'], expected.at['USA', 'sum'])
+            self.assertEqual(table.at['Canada', 'Orders'], expected.at['Canada', 'count'])
+
+        with patch('builtins.print'):
+            profits = DataProcessor.compare_profits(data, 'USA', 'Canada', '2021-03-15', '2021-03-17', rollup)
+            trends = DataProcessor.analyze_trends(data, 'USA', k=1, start='2021-03-01', end='2021-03-31')
+        self.assertEqual(profits, (75.0, 147.0))
+        self.assertEqual(trends, {2021: [('B', 380)]})
+        with self.assertRaises(ValueError):
+            MonthlyRollup(rollup.table).totals('Country', start='2021-03-15')
+        with self.assertRaises(ValueError):
+            rollup.totals('Country', start='2021-04-01', end='2021-03-01')
+
+    def test_group_kernel_matches_pandas_groupby(self):
+        data = pd.DataFrame({
+            'Region': pd.Categorical(['Asia', 'Europe', 'Asia', None, 'Europe', 'Asia']),
+            'Country': [' Japan', 'Norway', 'Japan', 'Chad', 'Norway ', 'India'],
+            'Year': np.array([2021, 2020, 2021, 2020, 2022, 2021], dtype='int16'),
+            'Units Sold': [1, 2, 3, 4, 5, 6],
+            'Total Profit': [10.0, np.nan, 30.0, 40.0, -5.0, 60.0],
+        })
+        stats = {stat: ('Total Profit', stat) for stat in ('sum', 'count', 'mean', 'min', 'max')}
+        table = GroupKernel.aggregate(data, ['Region', 'Year'], dict(stats, units=('Units Sold', 'sum'),
+                                                                     rows=(None, 'size')))
+        expected = data.groupby(['Region', 'Year'], observed=True).agg(
+            sum=('Total Profit', 'sum'), count=('Total Profit', 'count'), mean=('Total Profit', 'mean'),
+            min=('Total Profit', 'min'), max=('Total Profit', 'max'), units=('Units Sold', 'sum'),
+            rows=('Total Profit', 'size'))
+        self.assertEqual(list(table.index), list(expected.index))
+        pd.testing.assert_frame_equal(table.reset_index(drop=True), expected.reset_index(drop=True),
+                                      check_dtype=False)
+        self.assertEqual(table['units'].dtype, np.int64)
+
+        stripped = GroupKernel.aggregate(data, ['Country'], {'orders': (None, 'size')}, strip=True)
+        self.assertEqual(stripped['orders'].to_dict(), {'Chad': 1, 'India': 1, 'Japan': 2, 'Norway': 2})
+        with patch('builtins.print'):
+            averages = DataProcessor.calculate_average_profit_by_country(data)
+        self.assertEqual(averages, {'Chad': 40.0, 'India': 60.0, 'Japan': 20.0, 'Norway': -5.0})
+        self.assertEqual(data['Country'].iloc[0], ' Japan')
+        self.assertEqual(len(GroupKernel.aggregate(data.iloc[:0], ['Region', 'Country'], stats)), 0)
+
+    def test_profit_sketch_quantiles_are_within_accuracy_and_mergeable(self):
+        rng = np.random.default_rng(0)
+        profit = np.concatenate([rng.lognormal(8, 2, 20000), -rng.lognormal(5, 1, 2000), np.zeros(50)])
+        data = pd.DataFrame({'Total Profit': profit, 'Country': rng.choice(['USA', 'Canada'], len(profit)),
+                             'Region': 'North America'})
+        sketch = ProfitSketch.from_chunk(data)
+        for q in (0.0, 0.01, 0.5, 0.9, 0.99, 1.0):
+            exact = np.quantile(profit, q, method='lower')
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), PROFIT_SKETCH_ACCURACY * abs(exact))
+
+        merged = ProfitSketch.from_chunk(data.iloc[:7000]).merge(ProfitSketch.from_chunk(data.iloc[7000:]))
+        self.assertEqual((merged.positive, merged.negative, merged.zero, merged.count),
+                         (sketch.positive, sketch.negative, sketch.zero, sketch.count))
+        with WorkerPool(processes=2) as pool, patch('builtins.print'):
+            table = DataProcessor.profit_percentiles(data, 'Country', pool=pool)
+        usa = profit[data['Country'] == 'USA']
+        self.assertEqual(list(table.index), ['Canada', 'USA'])
+        self.assertEqual(table.at['USA', 'Orders'], len(usa))
+        exact = np.quantile(usa, 0.9, method='lower')
+        self.assertLessEqual(abs(table.at['USA', 'p90'] - exact), PROFIT_SKETCH_ACCURACY * exact)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_attach_frame_reads_published_rows(self):
+        data = pd.DataFrame({
+            'Country': pd.Categorical(['USA', 'Canada', 'USA']),
+            'Item Type': ['A', None, 'B'],
+            'Total Profit': [1000.0, 1500.0, 500.0],
+            'Order Date': pd.to_datetime(['2021-06-15', '2021-06-16', '2021-06-17'])
+        })
+        frame = SharedFrame(data)
+        other = SharedFrame(data.iloc[:1])
+        try:
+            chunk = attach_frame(frame.handle, 1, 3)
+            self.assertEqual(list(chunk.index), [1, 2])
+            pd.testing.assert_frame_equal(chunk, data.iloc[1:3], check_dtype=False)
+            with self.assertRaises(ValueError):
+                chunk['Total Profit'].to_numpy()[0] = 0
+            # every handle keeps its own attachment, attaching another frame leaves chunk readable
+            self.assertEqual(len(attach_frame(other.handle, 0, 1)), 1)
+            detach_frame(other.handle['token'])
+            self.assertEqual(chunk['Total Profit'].sum(), 2000.0)
+            del chunk
+            detach_frame(frame.handle['token'])
+        finally:
+            frame.close()
+            other.close()
+
+    def test_validate_data_keeps_pool_between_calls(self):
+        data = pd.DataFrame({
+            'Country': ['USA', 'Canada', None, 'USA', 'Peru'],
+            'Total Profit': [1000.0, 1500.0, 700.0, 500.0, 200.0],
+            'Order Date': pd.to_datetime(['2021-06-15', '2021-06-16', '2021-06-16', '2021-06-17', '2021-06-18']),
+            'Units Sold': [1, 2, 3, 0, 1],
+            'Unit Price': [100, 200, 150, 10, 5],
+            'Unit Cost': [50, 100, 120, 5, 2],
+            'Total Revenue': [500, 400, 300, 100, 50]
+        })
+        with WorkerPool(processes=2, backend='process') as pool:
+            cleaned = DataProcessor.validate_data(data, pool=pool)
+            workers = pool.pool
+            DataProcessor.calculate_avg_profit(cleaned, pool=pool)
+            self.assertIs(pool.pool, workers)
+            self.assertIs(pool.data, cleaned)
+        self.assertEqual(list(cleaned['Country']), ['USA', 'Canada', 'Peru'])
+        self.assertIsNone(pool.frame)
+
+    def test_changed_data_is_published_again(self):
+        data = pd.DataFrame({'Total Profit': [1.0, 2.0, 3.0, 4.0]})
+        with WorkerPool(processes=2, backend='process') as pool, patch('builtins.print'):
+            self.assertEqual(DataProcessor.calculate_avg_profit(data, pool=pool), 2.5)
+            frame = pool.frame
+            DataProcessor.calculate_avg_profit(data, pool=pool)
+            self.assertIs(pool.frame, frame)
+            # a change of the same frame is only known through its version
+            data['Total Profit'] = [5.0, 6.0, 7.0, 8.0]
+            pool.changed()
+            self.assertEqual(DataProcessor.calculate_avg_profit(data, pool=pool), 6.5)
+            self.assertIsNot(pool.frame, frame)
+
+    def test_scheduler_picks_backend_and_chunks_by_size_and_budget(self):
+        data = pd.DataFrame({'Total Profit': [1.0] * 10})
+        with WorkerPool(processes=4) as pool:
+            self.assertEqual(pool.plan(data), ('serial', [(0, 10)]))
+            self.assertEqual(pool.plan(data.iloc[:2]), ('serial', [(0, 2)]))
+        with WorkerPool(processes=4, memory_budget=24) as pool:
+            # 8 bytes per row, 3 rows fit in the budget
+            self.assertEqual(pool.plan(data), ('serial', [(0, 3), (3, 6), (6, 9), (9, 10)]))
+        with WorkerPool(processes=4, backend='thread') as pool:
+            self.assertEqual(pool.plan(data)[1], [(0, 3), (3, 6), (6, 9), (9, 10)])
+            self.assertEqual(pool.plan(data.iloc[:2])[1], [(0, 1), (1, 2)])
+            summaries = pool.map(ProfitSummary.from_chunk, data.iloc[::-1].reset_index(drop=True))
+            self.assertEqual(sum(summary.count for summary in summaries), 10)
+        with self.assertRaises(ValueError):
+            WorkerPool(backend='gpu')
+
+    def test_backends_give_the_same_results(self):
+        data = pd.DataFrame({
+            'Country': ['USA', 'Canada', None, 'USA', 'Peru'],
+            'Total Profit': [1000.0, 1500.0, 700.0, 500.0, 200.0],
+            'Order Date': pd.to_datetime(['2021-06-15', '2021-06-16', '2021-06-16', '2021-06-17', '2021-06-18']),
+            'Units Sold': [1, 2, 3, 0, 1],
+        }, index=[10, 11, 12, 13, 14])
+        results = []
+        for backend in ['serial', 'thread', 'process']:
+            with WorkerPool(processes=2, backend=backend) as pool, patch('builtins.print'):
+                cleaned = DataProcessor.validate_data(data, pool=pool)
+                results.append((list(cleaned['Country']), DataProcessor.calculate_avg_profit(cleaned, pool=pool)))
+        self.assertEqual(results[0], (['USA', 'Canada', 'Peru'], 900.0))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+
+
+class TestDuplicateIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.data = pd.DataFrame({
+            'Country': ['USA', 'Canada', 'USA', 'Peru', 'Canada', 'Chad', 'Peru', 'USA'],
+            'Total Profit': [100.0, 200.0, 100.0, 300.0, 200.0, 400.0, 300.0, 50.0],
+            'Order Date': pd.to_datetime(['2021-06-15'] * 8),
+            # order 4 is invalid first, so its valid copy is kept
+            'Units Sold': [1, 1, 1, 1, 1, 0, 1, 1],
+            'Order ID': [1, 2, 1, 3, 2, 4, 3, 4],
+        })
+
+    def test_duplicate_orders_are_dropped_within_and_across_chunks(self):
+        for backend in ['serial', 'thread', 'process']:
+            with WorkerPool(processes=3, backend=backend) as pool, patch('builtins.print'):
+                cleaned = DataProcessor.validate_data(self.data, pool=pool, keys=DEDUP_KEYS)
+                report = BatchPlan.parse(['avg'], DEDUP_KEYS).run(self.data, pool)
+                # without keys every row is kept
+                kept = DataProcessor.validate_data(self.data, pool=pool)
+            self.assertEqual(list(cleaned['Country']), ['USA', 'Canada', 'Peru', 'USA'])
+            self.assertEqual(list(cleaned['Order ID']), [1, 2, 3, 4])
+            self.assertEqual(cleaned.attrs['rejections']['duplicate Order ID'], 3)
+            self.assertEqual(report['avg'][0]['orders'], 4)
+            self.assertEqual(report['validation'][0]['duplicate Order ID'], 3)
+            self.assertEqual(len(kept), 7)
+
+    def test_fused_scan_validates_every_chunk_once(self):
+        # only a chunk repeating orders of earlier chunks is computed again
+        unique = self.data.assign(**{'Order ID': range(8)})
+        with WorkerPool(processes=3, backend='thread') as pool, patch('builtins.print'):
+            chunks = len(pool.plan(unique)[1])
+            with patch('main.DataProcessor.validation_mask', wraps=DataProcessor.validation_mask) as validation:
+                self.assertEqual(BatchPlan.parse(['avg'], DEDUP_KEYS).run(unique, pool)['avg'][0]['orders'], 7)
+            self.assertEqual(validation.call_count, chunks)
+        self.assertGreater(chunks, 1)
+
+    def test_parent_merges_the_chunk_keys_without_scanning_the_rows_again(self):
+        with WorkerPool(processes=3, backend='thread') as pool, patch('builtins.print'):
+            chunks = pool.plan(self.data)[1]
+            with patch('main.DuplicateIndex.key_values', wraps=DuplicateIndex.key_values) as key_values:
+                DataProcessor.validate_data(self.data, pool=pool, keys=DEDUP_KEYS)
+            # every chunk is hashed once in its worker, the parent only merges the keys they send back
+            self.assertEqual(sorted(len(call.args[0]) for call in key_values.call_args_list),
+                             sorted(stop - start for start, stop in chunks))
+            with patch('main.DataProcessor.validation_mask', wraps=DataProcessor.validation_mask) as validation:
+                BatchPlan.parse(['avg'], DEDUP_KEYS).run(self.data, pool)
+        # the two chunks repeating an earlier order only take their one remaining row again
+        self.assertEqual(sorted(len(call.args[0]) for call in validation.call_args_list), [1, 1, 2, 3, 3])
+
+    def test_shared_index_carries_keys_between_chunks(self):
+        duplicates = DuplicateIndex()
+        kept = [len(DataProcessor.validate_chunk(self.data.iloc[start:start + 3], duplicates=duplicates)[0])
+                for start in range(0, 8, 3)]
+        self.assertEqual(kept, [2, 1, 1])
+        self.assertEqual((duplicates.dropped, len(duplicates)), (3, 4))
+        # an empty key set or no index keeps every row
+        cleaned, rejections = DataProcessor.validate_chunk(self.data, duplicates=DuplicateIndex(()))
+        self.assertEqual(len(cleaned), 7)
+        self.assertNotIn('duplicate Order ID', rejections)
+        self.assertEqual(len(DataProcessor.validate_chunk(self.data)[0]), 7)
+        cleaned, rejections = DataProcessor.validate_chunk(self.data,
+                                                           duplicates=DuplicateIndex(['Country', 'Order ID']))
+        self.assertEqual(rejections['duplicate Country, Order ID'], 3)
+
+
+class TestStreaming(CsvTestCase):
+
+    def test_profit_summary_merge_is_exact_for_unequal_chunks(self):
+        data = pd.DataFrame({'Total Profit': [10.0, 20.0, 30.0, 100.0]})
+        summary = ProfitSummary.from_chunk(data.iloc[:3]).merge(ProfitSummary.from_chunk(data.iloc[3:]))
+        self.assertEqual(summary.count, 4)
+        self.assertEqual(summary.mean, 40.0)  # the mean of the chunk means would be 60
+        self.assertEqual((summary.minimum, summary.maximum), (10.0, 100.0))
+
+    def test_stream_aggregate_matches_in_memory_results(self):
+        file_path = self.write_csv("Region,Country,Order Date,Units Sold,Unit Price,Unit Cost,Total Revenue,"
+                                   "Total Profit\n",
+                                   "Europe,Norway,6/15/2020,1,10,5,10,5.0\n",
+                                   "Asia,Japan,6/16/2021,2,10,5,20,10.0\n",
+                                   "Europe,Norway,6/17/2021,0,10,5,0,0.0\n",
+                                   "Europe,Norway,6/18/2021,3,10,5,30,15.0\n",
+                                   "Asia,Japan,6/19/2021,4,10,5,40,20.0\n")
+
+        aggregate = StreamingProcessor.aggregate(file_path, chunk_size=2)
+
+        self.assertEqual((aggregate.rows, aggregate.invalid), (4, 1))
+        self.assertEqual(aggregate.overall.mean, 12.5)
+        self.assertEqual(StreamingProcessor.analyze_profit_by_region(aggregate), {'Asia': 30.0, 'Europe': 20.0})
+        self.assertEqual(StreamingProcessor.calculate_average_profit_by_country(aggregate),
+                         {'Japan': 15.0, 'Norway': 10.0})
+        self.assertEqual(aggregate.groups['Year'][2021].total, 45.0)
+        table = aggregate.profit_table('Country', ['Norway', 'Peru'])
+        self.assertEqual(table.at['Norway', 'Orders'], 2)
+        self.assertEqual(table.at['Peru', 'Orders'], 0)
+
+    def test_read_csv_in_chunks_splits_rows_on_newlines_only(self):
+        file_path = self.write_csv('Order ID,Country\r\n1,Norway\r\n',
+                                   '2,Caf\u2028e\r\n3,"Nor\r\nway"\r\n4,Nor\x1cway\r\n')
+        rows = [row for chunk in read_csv_in_chunks(file_path, 2, start=len('Order ID,Country\r\n1,Norway\r\n'))
+                for row in chunk]
+        self.assertEqual(rows, [['2', 'Caf\u2028e'], ['3', 'Nor\r\nway'], ['4', 'Nor\x1cway']])
+
+
+class TestRefresh(CsvTestCase):
+    HEADER = "Region,Country,Item Type,Order Date,Order ID,Units Sold,Unit Price,Unit Cost,Total Revenue,Total Profit\n"
+    ROWS = ["Europe,Norway,Snacks,6/15/2020,1,1,10,5,10,5.0\n",
+            "Asia,Japan,Meat,6/16/2021,2,2,10,5,20,10.0\n",
+            "Europe,Norway,Snacks,6/17/2021,3,0,10,5,0,0.0\n"]
+
+    def test_refresh_folds_only_the_appended_rows(self):
+        appended = ["Asia,Japan,Meat,6/18/2021,4,3,10,5,30,15.0\n",
+                    "Asia,Japan,Meat,6/16/2021,2,2,10,5,20,10.0\n",
+                    "Asia,,Meat,6/19/2021,5,4,10,5,40,20.0\n"]
+        results = []
+        for streaming in (True, False):
+            file_path = self.write_csv(self.HEADER, *self.ROWS)
+            with patch('builtins.print'):
+                app = MainApp(file_path, streaming=streaming, chunk_size=2, backend='serial', dedup_keys=DEDUP_KEYS)
+                app.load_data()
+                if not streaming:
+                    app.validate()
+                    app.trend_cube()
+                offset = app.cursor.offset
+                # the last row is still being written, it is left for the next refresh
+                write_csv(file_path, *appended, "Europe,Norway,Snacks,6/20", mode='a')
+                with patch('main.FileLoader.iter_chunks', side_effect=AssertionError("full read")):
+                    app.refresh()
+            self.assertEqual(app.cursor.offset, offset + len(''.join(appended)))
+            self.assertEqual(app.cursor.rows, 6)
+            if streaming:
+                results.append((app.aggregate.overall.total, app.aggregate.rows, app.aggregate.invalid))
+            else:
+                self.assertEqual(list(app.data['Order ID']), [1, 2, 4])
+                self.assertEqual(app.data.attrs['rejections']['duplicate Order ID'], 1)
+                with patch('builtins.print'):
+                    top = app.trend_cube().top_products('Japan', by='Total Profit')
+                self.assertEqual(top[2021], [('Meat', 25.0)])
+                results.append((app.data['Total Profit'].sum(), len(app.data), 6 - len(app.data)))
+            app.close()
+        self.assertEqual(results[0], (30.0, 3, 3))
+        self.assertEqual(results[0], results[1])
+
+    def test_refresh_folds_the_appended_rows_into_cached_results(self):
+        file_path = self.write_csv(self.HEADER, *self.ROWS)
+
+        def analyses(data, cache):
+            with patch('builtins.print'):
+                return [DataProcessor.calculate_avg_profit(data, cache=cache),
+                        DataProcessor.analyze_profit_by_region(data, cache),
+                        DataProcessor.compare_countries(data, cache=cache),
+                        DataProcessor.compare_profits(data, 'Norway', 'Peru', pd.Timestamp('2021-01-01'),
+                                                      pd.Timestamp('2022-01-01'), cache=cache)]
+
+        with patch('builtins.print'):
+            app = MainApp(file_path, backend='serial')
+            app.load_data()
+            app.validate()
+        analyses(app.data, app.results)
+        write_csv(file_path, "Asia,Japan,Meat,6/18/2021,4,3,10,5,30,15.0\n",
+                  "America,Peru,Meat,6/19/2021,5,4,10,5,40,20.0\n", "America,Peru,Meat,6/19/2021,6,0,10,5,0,0.0\n",
+                  mode='a')
+        with patch('builtins.print'):
+            app.refresh()
+        self.assertEqual(len(app.results.entries), 4)
+
+        hits = app.results.hits
+        with patch.object(DataProcessor, 'profit_in_range', side_effect=AssertionError("recomputed")):
+            folded = analyses(app.data, app.results)
+        self.assertEqual(app.results.hits, hits + 4)
+        fresh = analyses(app.data, None)
+        self.assertEqual(folded[0], fresh[0])
+        self.assertEqual(folded[1], fresh[1])
+        pd.testing.assert_frame_equal(folded[2], fresh[2])
+        self.assertEqual(folded[3], fresh[3])
+        app.close()
+
+    def test_blank_appended_lines_are_skipped_like_on_reload(self):
+        file_path = self.write_csv(self.HEADER, *self.ROWS)
+        with patch('builtins.print'):
+            app = MainApp(file_path, backend='serial')
+            app.load_data()
+            write_csv(file_path, "\n", self.ROWS[1], "\r\n\n", self.ROWS[2], "\n", mode='a')
+            app.refresh()
+            reloaded = FileLoader.load_file(file_path, use_cache=False)
+        self.assertEqual(app.cursor.rows, 5)
+        self.assertEqual(len(app.data), len(reloaded))
+        self.assertEqual(app.data['Year'].dtype, reloaded['Year'].dtype)
+        app.close()
+
+    def test_replaced_file_is_read_again(self):
+        file_path = self.write_csv(self.HEADER, self.ROWS[1])
+        with patch('builtins.print'):
+            app = MainApp(file_path, streaming=True, backend='serial')
+            app.load_data()
+            # a replaced file cannot be followed
+            self.write_csv(self.HEADER, self.ROWS[0], self.ROWS[1])
+            self.assertFalse(app.cursor.is_appended())
+            app.refresh()
+        self.assertEqual((app.aggregate.rows, app.cursor.rows), (2, 2))
+        app.close()
+        self.assertIsNone(AppendCursor.at_end(file_path + '.gz', 0))
+
+
+class TestBatchPlan(CsvTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file_path = self.write_csv(*SALES_ROWS)
+
+    def test_unknown_analysis_is_rejected(self):
+        with self.assertRaises(ValueError):
+            BatchPlan.parse(['region', 'forecast'])
+
+    def test_stream_and_pool_reports_match(self):
+        plan = BatchPlan.parse(['compare=Norway,Japan', 'region', 'avg', 'margins', 'trends=Norway',
+                                'percentiles=Region', 'range=2021-06..2021-06,Region'])
+        self.assertEqual(plan.needs, ['cube', 'margin', 'profit', 'rollup', 'sketch'])
+        streamed = plan.run_stream(self.file_path, chunk_size=2)
+        with WorkerPool(processes=2) as pool:
+            pooled = plan.run(FileLoader.load_file(self.file_path, use_cache=False), pool)
+
+        self.assertEqual(streamed, pooled)
+        self.assertEqual(streamed['validation'][0]['valid_rows'], 4)
+        self.assertEqual(streamed['validation'][0]['non-positive Units Sold'], 1)
+        self.assertEqual([(r['country'], r['total_profit']) for r in streamed['compare=Norway,Japan']],
+                         [('Norway', 20.0), ('Japan', 20.0)])
+        self.assertEqual(streamed['avg'][0]['average_profit'], 10.0)
+        self.assertEqual(streamed['margins'][0], {'item_type': 'Meat', 'weighted_margin': 0.5,
+                                                  'mean_margin': 0.5, 'orders': 1})
+        self.assertEqual([(r['region'], r['orders']) for r in streamed['percentiles=Region']],
+                         [('Asia', 2), ('Europe', 2)])
+        self.assertAlmostEqual(streamed['percentiles=Region'][1]['p50'], 5.0, delta=5.0 * PROFIT_SKETCH_ACCURACY)
+        self.assertEqual([(r['region'], r['total_profit'], r['orders'])
+                          for r in streamed['range=2021-06..2021-06,Region']],
+                         [('Asia', 20.0, 2), ('Europe', 15.0, 1)])
+        self.assertEqual(streamed['trends=Norway'][-1], {'year': 2021, 'rank': 1, 'item_type': 'Fruits',
+                                                         'units_sold': 3})
+
+    def test_write_csv_report(self):
+        report = BatchPlan.parse(['region', 'avg']).run_stream(self.file_path)
+        output = os.path.join(self.folder.name, 'report.csv')
+        BatchPlan.write(report, output)
+        table = pd.read_csv(output)
+        self.assertEqual(table.columns[0], 'analysis')
+        self.assertEqual(list(table['analysis']), ['validation', 'region', 'region', 'avg'])
+
+
+class TestAnalyticsServer(CsvTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file_path = self.write_csv(*SALES_ROWS)
+
+    def test_server_answers_concurrent_clients(self):
+        merged = BatchPlan.all_needs().collect_stream(self.file_path)
+        server = AnalyticsServer(merged, BatchPlan.parse, os.path.join(self.folder.name, 'beta.sock'))
+        thread = threading.Thread(target=asyncio.run, args=(server.serve(),))
+        thread.start()
+        try:
+            for _ in range(100):
+                if os.path.exists(server.socket_path):
+                    break
+                time.sleep(0.05)
+            request = {'analyses': ['compare=Norway,Japan', 'trends=Norway']}
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                responses = list(executor.map(lambda _: query_server(request, server.socket_path), range(16)))
+            error = query_server({'analyses': ['forecast']}, server.socket_path)
+            ping = query_server({'command': 'ping'}, server.socket_path)
+        finally:
+            server.stop()
+            thread.join(timeout=5)
+
+        expected = BatchPlan.parse(request['analyses']).run_stream(self.file_path)
+        self.assertTrue(all(response == {'ok': True, 'report': expected} for response in responses))
+        self.assertFalse(error['ok'])
+        self.assertEqual((ping['queries'], ping['rows']), (16, 5))
+        self.assertFalse(os.path.exists(server.socket_path))
+
+
+class TestResultCache(CsvTestCase):
+
+    def test_repeat_queries_are_answered_from_the_cache(self):
+        data = pd.DataFrame({
+            'Region': ['Europe', 'Asia', 'Asia'],
+            'Country': ['Norway', 'Japan', 'Japan'],
+            'Total Profit': [100.0, 300.0, 500.0]
+        })
+        cache = ResultCache(max_entries=2)
+        cache.use('dataset/raw', data)
+        with patch('builtins.print'):
+            first = DataProcessor.analyze_profit_by_region(data, cache)
+            first['Asia'] = 0.0
+            with patch.object(data, 'groupby', side_effect=AssertionError("recomputed")):
+                self.assertEqual(DataProcessor.analyze_profit_by_region(data, cache), {'Asia': 800.0, 'Europe': 100.0})
+            DataProcessor.compare_profits(data, 'Norway', 'Japan', cache=cache)
+            DataProcessor.compare_profits(data, 'Japan', 'Norway', cache=cache)
+        self.assertEqual(cache.stats(), {'entries': 2, 'max_entries': 2, 'hits': 1, 'misses': 3, 'evictions': 1,
+                                         'hit_rate': 0.25})
+        self.assertNotIn(('dataset/raw', 'analyze_profit_by_region', ()), cache.entries)
+
+        # another frame, e.g. a copy or the partitions of one query, is not answered from the entries of data
+        with patch('builtins.print'):
+            self.assertEqual(DataProcessor.analyze_profit_by_region(data.head(1), cache), {'Europe': 100.0})
+        self.assertEqual(cache.stats()['misses'], 3)
+
+        cache.use('dataset/validated', data)
+        self.assertEqual(len(cache.entries), 0)
+        cache.use(None, data)
+        self.assertEqual(cache.memoize(data, 'operation', (), lambda: 1), 1)
+        self.assertEqual(cache.stats()['misses'], 3)
+
+    def test_cache_is_persisted_between_sessions(self):
+        path = os.path.join(self.folder.name, 'results.json')
+        data = pd.DataFrame({'Country': ['Norway', 'Japan'], 'Total Profit': [4.0, 6.0],
+                             'Order Date': pd.to_datetime(['2021-06-15', '2021-06-16'])})
+        table = DataProcessor.profit_in_range(data, ['Norway', 'Japan'], None, None)
+        cache = ResultCache(path=path, types=(ProfitSummary,))
+        cache.use('dataset/raw', data)
+        cache.memoize(data, 'calculate_avg_profit', (), lambda: ProfitSummary(10.0, 2, 4.0, 6.0))
+        cache.memoize(data, 'profit_by_country', (('Norway', 'Japan'), None, None), lambda: table)
+        cache.memoize(data, 'analyze_profit_by_region', (), lambda: {'Europe': 4.0})
+        cache.save()
+
+        restored = ResultCache(path=path, types=(ProfitSummary,))
+        restored.use('dataset/raw', data)
+        summary = restored.memoize(data, 'calculate_avg_profit', (), lambda: self.fail("recomputed"))
+        self.assertEqual((summary.mean, summary.count, restored.hits), (5.0, 2, 1))
+        pd.testing.assert_frame_equal(
+            restored.memoize(data, 'profit_by_country', (('Norway', 'Japan'), None, None),
+                             lambda: self.fail("recomputed")), table)
+        self.assertEqual(restored.memoize(data, 'analyze_profit_by_region', (), lambda: self.fail("recomputed")),
+                         {'Europe': 4.0})
+
+        # a corrupt or foreign file is not read, the cache starts empty
+        for content in ['{"entries": [', '{"format": 0, "entries": []}', '[1, 2]']:
+            write_csv(path, content)
+            with patch('builtins.print'):
+                self.assertEqual(len(ResultCache(path=path).entries), 0)
+        # a missing file is the first session, not a warning
+        with patch('builtins.print') as printed:
+            self.assertEqual(len(ResultCache(path=os.path.join(self.folder.name, 'missing.json')).entries), 0)
+        printed.assert_not_called()
+
+
+class TestCopyCsvParallel(CsvTestCase):
+
+    def write_source(self):
+        return self.write_csv("Region,Country,Total Profit\r\n",
+                              *(f"Europe,{'Norway' if index % 3 == 0 else 'Sweden'},{index}.5\r\n"
+                                for index in range(200)))
+
+    def test_split_byte_ranges_are_newline_aligned(self):
+        src_file = self.write_source()
+        ranges = split_byte_ranges(src_file, 7)
+        with open(src_file, 'rb') as f:
+            content = f.read()
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(content))
+        for (_, stop), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(stop, start)
+            self.assertEqual(content[start - 1:start], b'\n')
+
+    def test_copy_is_byte_identical(self):
+        src_file = self.write_source()
+        dest_file = copy_csv_parallel(src_file, os.path.join(self.folder.name, 'copy'), num_processes=3)
+        with open(src_file, 'rb') as src, open(dest_file, 'rb') as dest:
+            self.assertEqual(src.read(), dest.read())
+
+    def test_filtered_copy_keeps_header_and_order(self):
+        src_file = self.write_source()
+        dest_file = copy_csv_parallel(src_file, os.path.join(self.folder.name, 'copy'), num_processes=3,
+                                      chunk_size=10, row_filter=keep_norway)
+        copied = pd.read_csv(dest_file)
+        self.assertEqual(list(copied.columns), ['Region', 'Country', 'Total Profit'])
+        self.assertEqual(list(copied['Total Profit']), [index + 0.5 for index in range(0, 200, 3)])
+
+    def test_parsed_copy_splits_rows_on_newlines_only(self):
+        src_file = self.write_csv("Region,Country,Item Type\r\n",
+                                  "Europe,Norway,Caf\u2028e\r\nEurope,Nor\x1cway,Snacks\r\n")
+        dest_file = copy_csv_parallel(src_file, os.path.join(self.folder.name, 'copy'), num_processes=1,
+                                      dest_encoding='utf-8')
+        with open(dest_file, newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[1:], [['Europe', 'Norway', 'Caf\u2028e'], ['Europe', 'Nor\x1cway', 'Snacks']])
+
+    def test_reencoded_copy_has_one_byte_order_mark(self):
+        src_file = self.write_source()
+        for dest_encoding in ['utf-16', 'utf-8-sig']:
+            dest_file = copy_csv_parallel(src_file, os.path.join(self.folder.name, dest_encoding), num_processes=4,
+                                          dest_encoding=dest_encoding)
+            with open(src_file, encoding='utf-8', newline='') as src, \
+                    open(dest_file, encoding=dest_encoding, newline='') as dest:
+                self.assertEqual(list(csv.reader(dest)), list(csv.reader(src)))
+            with open(dest_file, 'rb') as dest:
+                self.assertEqual(dest.read().decode(dest_encoding).count('\ufeff'), 0)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def tearDown(self):
+        Metrics.configure()
+
+    def test_stages_are_written_as_json_lines(self):
+        with tempfile.TemporaryDirectory() as folder:
+            sink = os.path.join(folder, 'metrics.jsonl')
+            Metrics.configure(sink)
+            with Metrics.operation('example', rows=10) as metrics:
+                with Metrics.stage('merge', bytes_moved=64) as record:
+                    record['rows'] = 5
+            with open(sink) as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual([(r['operation'], r['stage']) for r in records], [('example', 'merge'), ('example', 'total')])
+        self.assertEqual((records[0]['rows'], records[0]['bytes']), (5, 64))
+        self.assertGreaterEqual(records[1]['wall'], records[0]['wall'])
+        self.assertIn('cpu', records[1])
+        self.assertIn('peak_memory', records[1])
+        self.assertEqual(metrics['rows'], 10)
+
+    def test_pool_records_publish_dispatch_and_worker_compute(self):
+        data = pd.DataFrame({'Total Profit': [1.0, 2.0, 3.0, 4.0]})
+        Metrics.records.clear()
+        with WorkerPool(processes=2, backend='process') as pool:
+            with patch('builtins.print'):
+                DataProcessor.calculate_avg_profit(data, pool=pool)
+
+        stages = {record['stage']: record for record in Metrics.records
+                  if record['operation'] == 'calculate_avg_profit'}
+        self.assertEqual(stages['publish']['bytes'], 32)
+        self.assertEqual(stages['worker compute']['workers'], 2)
+        self.assertIn('dispatch', stages)
+        self.assertIn('merge', stages)
+        self.assertIn('total', stages)
+
+    def test_profile_target_writes_profile(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cwd = os.getcwd()
+            os.chdir(folder)
+            try:
+                Metrics.configure(profile_target='example')
+                with patch('builtins.print'):
+                    with Metrics.operation('example'):
+                        sum(range(1000))
+                profiles = [name for name in os.listdir(folder) if name.endswith('.prof')]
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(Metrics.records[-1]['operation'], 'example')
+
+
+class TestProfitLog(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'profit.log')
+
+    def tearDown(self):
+        use_temporary_log()
+        self.folder.cleanup()
+
+    def read_records(self, path):
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_worker_records_are_written_by_one_writer(self):
+        ProfitLog.configure(self.path)
+        data = pd.DataFrame({'Total Profit': [1.0, 2.0, 3.0, 4.0]})
+        with WorkerPool(processes=2, backend='process') as pool, patch('builtins.print'):
+            DataProcessor.calculate_avg_profit(data, pool=pool)
+        ProfitLog.close()
+
+        records = self.read_records(self.path)
+        chunks = sorted(record['chunk'] for record in records if record['operation'] == 'calculate_avg_profit')
+        self.assertEqual(chunks, [0, 2])
+        summary = [record for record in records if record['operation'] == 'profit summary']
+        self.assertEqual((summary[0]['orders'], summary[0]['average_profit']), (4, 2.5))
+
+    def test_log_is_rotated_by_size(self):
+        ProfitLog.configure(self.path, max_bytes=1000, backups=2)
+        for index in range(10):
+            ProfitLog.log('example', index, value=index)
+            ProfitLog.close()  # one batch per record, so the size is checked before every write
+
+        self.assertTrue(os.path.getsize(self.path) <= 1000)
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        values = [record['value'] for path in [self.path + '.2', self.path + '.1', self.path]
+                  if os.path.exists(path) for record in self.read_records(path)]
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertEqual(values, list(range(10 - len(values), 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,291 @@
+import numpy as np
+import multiprocessing as mp
+import time
+import os
+import json
+import atexit
+import queue
+import threading
+import sys
+import collections
+import contextlib
+import cProfile
+import pstats
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFIT_LOG_FILE = 'profit_analysis_log.jsonl'
+PROFIT_LOG_MAX_BYTES = 5 * 1024 * 1024
+PROFIT_LOG_BACKUPS = 3
+PROFIT_LOG_BATCH_SIZE = 1000
+
+
+class Metrics:
+    """
+        Structured timings, every stage of an operation is one record written as a JSON line to the sink
+    """
+    sink = None
+    profile_target = None
+    current = None
+    records = collections.deque(maxlen=10000)
+
+    @staticmethod
+    def configure(sink=None, profile_target=None):
+        """
+            Setting the JSON lines file and the operation to capture with cProfile and tracemalloc
+        :param sink: path of the JSON lines file, None keeps the records in memory only
+        :param profile_target: operation name, e.g. 'validate_data'
+        """
+        Metrics.sink = sink
+        Metrics.profile_target = profile_target
+
+    @staticmethod
+    @contextlib.contextmanager
+    def operation(name, rows=None, bytes_moved=None):
+        """
+            Timing a whole operation, stages started inside it are labeled with its name
+        :param name: operation name
+        :return: record of the 'total' stage, wall and cpu are filled in when the block ends
+        """
+        previous = Metrics.current
+        Metrics.current = name
+        profiler = Metrics.start_profile() if Metrics.profile_target == name else None
+        try:
+            with Metrics.stage('total', rows, bytes_moved) as record:
+                yield record
+        finally:
+            if profiler is not None:
+                Metrics.stop_profile(name, profiler)
+            Metrics.current = previous
+
+    @staticmethod
+    @contextlib.contextmanager
+    def stage(stage, rows=None, bytes_moved=None):
+        """
+            Timing one stage of the current operation
+        :param stage: stage name
+        :return: record, rows and bytes can be set inside the block
+        """
+        record = {'operation': Metrics.current, 'stage': stage, 'rows': rows, 'bytes': bytes_moved}
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['wall'] = time.perf_counter() - start_wall
+            record['cpu'] = time.process_time() - start_cpu
+            Metrics.emit(record)
+
+    @staticmethod
+    def record(stage, wall, cpu, rows=None, bytes_moved=None, **extra):
+        """
+            Recording a stage measured elsewhere, e.g. in the workers
+        """
+        Metrics.emit(dict({'operation': Metrics.current, 'stage': stage, 'rows': rows, 'bytes': bytes_moved,
+                           'wall': wall, 'cpu': cpu}, **extra))
+
+    @staticmethod
+    def emit(record):
+        """
+            Adding the timestamp and peak memory and writing the record
+        :param record: dict
+        """
+        record['timestamp'] = datetime.now().isoformat(timespec='milliseconds')
+        record['peak_memory'] = Metrics.peak_memory()
+        Metrics.records.append(record)
+        if Metrics.sink is not None:
+            with open(Metrics.sink, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, default=Metrics.to_json) + '\n')
+
+    @staticmethod
+    def to_json(value):
+        if isinstance(value, np.generic):
+            return value.item()
+        return str(value)
+
+    @staticmethod
+    def peak_memory():
+        """
+            Peak resident memory of this process in bytes, None where it is not available
+        """
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    @staticmethod
+    def start_profile():
+        """
+            Starting cProfile and tracemalloc for the profiled operation
+        :return: profiler
+        """
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    @staticmethod
+    def stop_profile(name, profiler):
+        """
+            Writing the profile and printing the hottest functions and allocations, workers are not profiled
+        :param name: operation name
+        :param profiler: profiler from start_profile
+        """
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        path = f"profile_{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof"
+        profiler.dump_stats(path)
+        print(f"Profile of {name} written to {path}, peak traced memory: {traced_peak / 1024 ** 2:.1f} MB")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(10)
+        for statistic in snapshot.statistics('lineno')[:5]:
+            print(statistic)
+        Metrics.record('profile', None, None, profile=path, traced_peak=traced_peak)
+
+
+class ProfitLog:
+    """
+        Profit records written as JSON lines by one writer thread, workers push them to its queue
+    """
+    path = PROFIT_LOG_FILE
+    max_bytes = PROFIT_LOG_MAX_BYTES
+    backups = PROFIT_LOG_BACKUPS
+    queue = None
+    owner = None
+    writer = None
+    lock = threading.Lock()
+
+    @staticmethod
+    def configure(path=PROFIT_LOG_FILE, max_bytes=PROFIT_LOG_MAX_BYTES, backups=PROFIT_LOG_BACKUPS):
+        """
+            Setting the log file and its rotation, records already queued go to the previous file
+        :param path: log file
+        :param max_bytes: size after which the file is rotated to path.1, path.2, ...
+        :param backups: number of rotated files kept
+        """
+        ProfitLog.close()
+        ProfitLog.path = path
+        ProfitLog.max_bytes = max_bytes
+        ProfitLog.backups = backups
+
+    @staticmethod
+    def start():
+        """
+            Starting the writer thread when it is not running
+        :return: queue the records are pushed to, passed to the workers of a WorkerPool
+        """
+        with ProfitLog.lock:
+            if ProfitLog.queue is None:
+                ProfitLog.queue = mp.Queue()
+                ProfitLog.owner = os.getpid()
+                atexit.register(ProfitLog.close)
+            # only the process that created the queue writes, workers just push to it
+            if ProfitLog.owner == os.getpid() and not ProfitLog.running():
+                ProfitLog.writer = threading.Thread(target=ProfitLog.write_loop, daemon=True,
+                                                    args=(ProfitLog.queue, ProfitLog.path, ProfitLog.max_bytes,
+                                                          ProfitLog.backups))
+                ProfitLog.writer.start()
+            return ProfitLog.queue
+
+    @staticmethod
+    def running():
+        """
+            Whether the writer thread of this process is running
+        """
+        return ProfitLog.writer is not None and ProfitLog.writer.is_alive()
+
+    @staticmethod
+    def attach(log_queue):
+        """
+            Worker initializer, records of the worker are pushed to the queue of the main process
+        :param log_queue: queue returned by start
+        """
+        ProfitLog.queue = log_queue
+
+    @staticmethod
+    def log(operation, chunk=None, **stats):
+        """
+            Pushing one record, never waits for the file
+        :param operation: operation name
+        :param chunk: id of the chunk, its first row position
+        :param stats: values to record
+        """
+        record = dict({'timestamp': datetime.now().isoformat(timespec='milliseconds'), 'operation': operation,
+                       'chunk': chunk, 'pid': os.getpid()}, **stats)
+        log_queue = ProfitLog.queue
+        if log_queue is None or (ProfitLog.owner == os.getpid() and not ProfitLog.running()):
+            log_queue = ProfitLog.start()
+        log_queue.put(record)
+
+    @staticmethod
+    def chunk_id(chunk):
+        """
+            Position of the first row of the chunk, None for an empty chunk
+        """
+        return int(chunk.index[0]) if len(chunk) else None
+
+    @staticmethod
+    def write_loop(log_queue, path, max_bytes, backups):
+        """
+            Writer thread, writes the records in batches until a None record arrives
+        """
+        stopping = False
+        while not stopping:
+            records = [log_queue.get()]
+            while len(records) < PROFIT_LOG_BATCH_SIZE:
+                try:
+                    records.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in records:
+                stopping = True
+                # records sent by workers just before closing may still be in the pipe
+                while True:
+                    try:
+                        records.append(log_queue.get(timeout=0.1))
+                    except queue.Empty:
+                        break
+            lines = ''.join(json.dumps(record, default=Metrics.to_json) + '\n' for record in records
+                            if record is not None)
+            if lines:
+                ProfitLog.write(path, lines, max_bytes, backups)
+
+    @staticmethod
+    def write(path, lines, max_bytes, backups):
+        """
+            Appending lines to the log, rotating it first when it would grow over max_bytes
+        """
+        try:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size > 0 and size + len(lines) > max_bytes:
+                for index in range(backups - 1, 0, -1):
+                    if os.path.exists(f"{path}.{index}"):
+                        os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+                if backups > 0:
+                    os.replace(path, f"{path}.1")
+                else:
+                    os.remove(path)
+            with open(path, 'a', encoding='utf-8') as log_file:
+                log_file.write(lines)
+        except OSError as e:
+            print(f"Error in writing the profit log: {e}")
+
+    @staticmethod
+    def close():
+        """
+            Writing all queued records and stopping the writer thread
+        """
+        with ProfitLog.lock:
+            if ProfitLog.running():
+                ProfitLog.queue.put(None)
+                ProfitLog.writer.join()
+            ProfitLog.writer = None
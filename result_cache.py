@@ -0,0 +1,173 @@
+import pandas as pd
+import numpy as np
+import time
+import os
+import json
+import copy
+import collections
+
+from metrics import Metrics
+
+RESULT_CACHE_SIZE = 128
+# version of the --result-cache file, files of another version are ignored
+RESULT_CACHE_FORMAT = 1
+
+
+class ResultCache:
+    """
+        Results of DataProcessor operations keyed by the dataset fingerprint, with LRU eviction
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, path=None, types=()):
+        self.max_entries = max_entries
+        self.path = path
+        # classes with __slots__ whose results are persisted, e.g. ProfitSummary
+        self.types = {result_type.__name__: result_type for result_type in types}
+        self.fingerprint = None
+        self.data = None
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path is not None:
+            self.load()
+
+    def use(self, fingerprint, data=None):
+        """
+            Switching to another dataset, its results are the only ones kept
+        :param fingerprint: fingerprint of the data the next operations run on, None disables caching
+        :param data: DataFrame the fingerprint was taken of, None disables caching
+        """
+        self.fingerprint = fingerprint
+        self.data = data
+        for key in [key for key in self.entries if key[0] != fingerprint]:
+            del self.entries[key]
+
+    def fold(self, fingerprint, data, fold):
+        """
+            Switching to the data grown by appended rows, the results of the previous data are folded into it
+        :param fingerprint: fingerprint of the grown data, None disables caching
+        :param data: grown DataFrame
+        :param fold: function(operation, params, result) returning the result on the grown data, None drops it
+        """
+        entries = collections.OrderedDict()
+        if fingerprint is not None and self.fingerprint is not None:
+            for (previous, operation, params), result in self.entries.items():
+                folded = fold(operation, params, result) if previous == self.fingerprint else None
+                if folded is not None:
+                    entries[(fingerprint, operation, params)] = folded
+        self.entries = entries
+        self.fingerprint = fingerprint
+        self.data = data
+
+    def memoize(self, data, operation, params, compute):
+        """
+            Result of the operation from the cache, computed and stored on a miss
+        :param data: DataFrame the operation runs on, other frames than the one of the fingerprint are not cached
+        :param operation: operation name
+        :param params: hashable parameters of the operation
+        :param compute: function computing the result
+        :return: a copy of the result, so callers cannot change the cached one
+        """
+        if self.fingerprint is None or self.data is None or data is not self.data:
+            return compute()
+        key = (self.fingerprint, operation, params)
+        start_wall = time.perf_counter()
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            result = copy.deepcopy(self.entries[key])
+            Metrics.record('result cache', time.perf_counter() - start_wall, 0.0, hit=True)
+            return result
+        self.misses += 1
+        result = compute()
+        self.entries[key] = copy.deepcopy(result)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        Metrics.record('result cache', time.perf_counter() - start_wall, 0.0, hit=False)
+        return result
+
+    def stats(self):
+        """
+            Hit and miss statistics
+        :return: dict
+        """
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries), 'max_entries': self.max_entries, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def encode(self, result):
+        """
+            JSON form of a result
+        :param result: dict, DataFrame with a named index or an instance of one of the types
+        :return: dict
+        """
+        if type(result).__name__ in self.types:
+            return {'type': type(result).__name__, 'data': [getattr(result, slot) for slot in result.__slots__]}
+        if isinstance(result, pd.DataFrame):
+            return {'type': 'DataFrame', 'index': result.index.name,
+                    'data': result.reset_index().to_dict(orient='list')}
+        if isinstance(result, dict):
+            return {'type': 'dict', 'data': list(result.items())}
+        raise TypeError(f"Unable to store a {type(result).__name__} result")
+
+    def decode(self, stored):
+        """
+            Result from its JSON form
+        :param stored: dict from encode
+        :return: result
+        """
+        if stored['type'] in self.types:
+            return self.types[stored['type']](*stored['data'])
+        if stored['type'] == 'DataFrame':
+            return pd.DataFrame(stored['data']).set_index(stored['index'])
+        if stored['type'] == 'dict':
+            return {key: value for key, value in stored['data']}
+        raise ValueError(f"Unknown result type '{stored['type']}'")
+
+    @staticmethod
+    def key_from_json(value):
+        """
+            Cache key from its JSON form, the lists JSON made of tuples are tuples again
+        """
+        return tuple(ResultCache.key_from_json(item) for item in value) if isinstance(value, list) else value
+
+    def load(self):
+        """
+            Reading the entries persisted by save, a missing, corrupt or foreign file starts an empty cache
+        """
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+            if stored.get('format') != RESULT_CACHE_FORMAT:
+                raise ValueError(f"not a result cache of format {RESULT_CACHE_FORMAT}")
+            entries = [(ResultCache.key_from_json(key), self.decode(result))
+                       for key, result in stored['entries']]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Warning: Ignoring the result cache '{self.path}'. {e}")
+            return
+        self.entries = collections.OrderedDict(entries[-self.max_entries:])
+
+    def save(self):
+        """
+            Persisting the entries as JSON when the cache has a path, results of other types are not kept
+        """
+        if self.path is None:
+            return
+        try:
+            entries = []
+            for key, result in self.entries.items():
+                try:
+                    entries.append([key, self.encode(result)])
+                except TypeError:
+                    continue
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump({'format': RESULT_CACHE_FORMAT, 'entries': entries}, f,
+                          default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+            os.replace(self.path + '.tmp', self.path)
+        except Exception as e:
+            print(f"Warning: Unable to write the result cache '{self.path}'. {e}")
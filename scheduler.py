@@ -0,0 +1,302 @@
+import pandas as pd
+import multiprocessing as mp
+from multiprocessing import resource_tracker
+import time
+import os
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Metrics, ProfitLog
+from shared_frame import SharedFrame, attach_frame, detach_others
+from store import ColumnStore, PartitionedDataset
+
+# WorkerPool scheduling: serial below SCHEDULER_SERIAL_ROWS, threads up to SCHEDULER_PROCESS_ROWS, processes above
+SCHEDULER_BACKENDS = ('auto', 'serial', 'thread', 'process')
+SCHEDULER_SERIAL_ROWS = 100000
+SCHEDULER_PROCESS_ROWS = 2000000
+SCHEDULER_MEMORY_BUDGET = 512 * 1024 * 1024
+
+
+@contextlib.contextmanager
+def worker_timing():
+    """
+        Timing the task of a worker entry point
+    :return: dict filled with the wall and cpu seconds when the block exits
+    """
+    timing = {}
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield timing
+    finally:
+        timing['wall'] = time.perf_counter() - start_wall
+        timing['cpu'] = time.process_time() - start_cpu
+
+
+def run_on_rows(func, handle, start, stop, args):
+    """
+        Worker entry point, calls func on the attached rows
+    :return: (result, timings of the worker)
+    """
+    # the parent published another frame, the chunks of the previous tasks are gone
+    detach_others(handle['token'])
+    with worker_timing() as timing:
+        result = func(attach_frame(handle, start, stop), *args)
+    return result, timing
+
+
+def run_on_partition(func, root, entry, args):
+    """
+        Worker entry point, reads one partition of a PartitionedDataset and calls func on it
+    :return: (result, timings of the worker)
+    """
+    with worker_timing() as timing:
+        result = func(PartitionedDataset.read_partition(root, entry), *args)
+    return result, timing
+
+
+def run_on_file(func, file_path, args):
+    """
+        Worker entry point, calls func on the path of one file
+    :return: (result, timings of the worker)
+    """
+    with worker_timing() as timing:
+        result = func(file_path, *args)
+    return result, timing
+
+
+def run_on_slice(func, data, start, stop, args):
+    """
+        Serial and thread entry point, calls func on rows start:stop indexed by row position like in the workers
+    """
+    chunk = data.iloc[start:stop]
+    chunk.index = pd.RangeIndex(start, stop)
+    return func(chunk, *args)
+
+
+class WorkerPool:
+    """
+        Long-lived scheduler, runs chunks serially, in a thread pool or in a process pool
+    """
+    def __init__(self, processes=None, backend='auto', memory_budget=SCHEDULER_MEMORY_BUDGET):
+        if backend not in SCHEDULER_BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', choose from: {', '.join(SCHEDULER_BACKENDS)}")
+        self.processes = max(1, processes or WorkerPool.available_cores())
+        self.backend = backend
+        self.memory_budget = memory_budget
+        self.pool = None
+        self.threads = None
+        self.data = None
+        self.frame = None
+        # version of the data of the owner, bumped by changed, and the version that was published
+        self.version = 0
+        self.published = None
+
+    @staticmethod
+    def available_cores():
+        """
+            Cores this process may run on
+        """
+        try:
+            return len(os.sched_getaffinity(0))
+        except AttributeError:
+            return os.cpu_count() or 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def changed(self):
+        """
+            Marking the data of the owner as changed, the next task publishes it again
+        """
+        self.version += 1
+
+    def is_published(self, data):
+        """
+            Whether the workers have the current version of data
+        """
+        return self.data is data and self.published == self.version
+
+    def publish(self, data):
+        """
+            Publishing the DataFrame to shared memory, republishing when another DataFrame or version is passed
+        :param data: DataFrame to publish
+        :return: handle of the published frame
+        """
+        if not self.is_published(data):
+            self.release()
+            self.frame = ColumnStore.of(data) or SharedFrame(data)
+            self.data = data
+            self.published = self.version
+        return self.frame.handle
+
+    def plan(self, data):
+        """
+            Choosing the backend and the row ranges for data
+        :param data: DataFrame to process
+        :return: (backend, list of (start, stop))
+        """
+        rows = len(data)
+        backend = self.backend
+        if backend == 'auto':
+            if self.processes == 1 or rows < SCHEDULER_SERIAL_ROWS:
+                backend = 'serial'
+            elif self.is_published(data) or rows >= SCHEDULER_PROCESS_ROWS:
+                # publishing is paid once per dataset, after that processes are the cheapest to reuse
+                backend = 'process'
+            else:
+                backend = 'thread'
+        workers = 1 if backend == 'serial' else self.processes
+        # the chunks processed at the same time have to fit in the memory budget
+        row_bytes = data.memory_usage(index=False).sum() / rows if rows else 0
+        budget_rows = int(self.memory_budget // max(row_bytes * workers, 1))
+        chunk_size = max(1, min(-(-rows // workers), budget_rows))
+        return backend, [(start, min(start + chunk_size, rows)) for start in range(0, rows, chunk_size)]
+
+    def map(self, func, data, *args):
+        """
+            Running func(chunk, *args) on every row range of data with the planned backend
+        :param func: picklable function taking a DataFrame chunk
+        :param data: DataFrame to process
+        :return: list of results in row order
+        """
+        backend, ranges = self.plan(data)
+        if backend == 'process':
+            return self.map_processes(func, data, ranges, args)
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        if backend == 'thread':
+            if self.threads is None:
+                self.threads = ThreadPoolExecutor(max_workers=self.processes)
+            futures = [self.threads.submit(run_on_slice, func, data, start, stop, args) for start, stop in ranges]
+            results = [future.result() for future in futures]
+        else:
+            results = [run_on_slice(func, data, start, stop, args) for start, stop in ranges]
+        Metrics.record('worker compute', time.perf_counter() - start_wall, time.process_time() - start_cpu,
+                       rows=len(data), workers=1 if backend == 'serial' else self.processes, backend=backend,
+                       chunks=len(ranges))
+        return results
+
+    def map_processes(self, func, data, ranges, args):
+        """
+            Running func on the row ranges in the process pool
+        :return: list of results in row order
+        """
+        with Metrics.stage('publish') as record:
+            published = self.is_published(data)
+            handle = self.publish(data)
+            record['bytes'] = 0 if published else self.frame.nbytes
+        self.start_workers()
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        tasks = [(func, handle, start, stop, args) for start, stop in ranges]
+        outputs = self.pool.starmap(run_on_rows, tasks)
+        wall = time.perf_counter() - start_wall
+        timings = [timing for _, timing in outputs]
+        compute_wall = max((timing['wall'] for timing in timings), default=0.0)
+        # time the parent waited beyond the slowest worker went to chunking, pickling and scheduling
+        Metrics.record('dispatch', wall - compute_wall, time.process_time() - start_cpu, rows=len(data))
+        Metrics.record('worker compute', compute_wall, sum(timing['cpu'] for timing in timings),
+                       rows=len(data), workers=min(self.processes, len(timings)), backend='process',
+                       chunks=len(timings))
+        return [result for result, _ in outputs]
+
+    def start_workers(self):
+        """
+            Starting the process pool on first use
+        """
+        if self.pool is None:
+            with Metrics.stage('start workers'):
+                # workers share the tracker of this process, otherwise a worker attaching shared memory first
+                # (after a mapped ColumnStore) starts its own tracker, which unlinks the blocks when it exits
+                resource_tracker.ensure_running()
+                self.pool = mp.Pool(processes=self.processes, initializer=ProfitLog.attach,
+                                    initargs=(ProfitLog.start(),))
+
+    def map_partitions(self, func, root, entries, *args):
+        """
+            Running func(partition, *args) on every partition of a PartitionedDataset, each read by its worker
+        :param func: picklable function taking a DataFrame
+        :param root: dataset directory
+        :param entries: partitions from PartitionedDataset.partitions
+        :return: list of results in partition order
+        """
+        rows = sum(entry['rows'] for entry in entries)
+        # nothing is published, the workers read their own files
+        backend = self.file_backend(len(entries) > 1 and rows >= SCHEDULER_SERIAL_ROWS)
+        return self.map_tasks(run_on_partition, [(func, root, entry, args) for entry in entries], backend, rows=rows)
+
+    def map_files(self, func, files, *args, bytes_moved=None):
+        """
+            Running func(file_path, *args) on every file in its own worker
+        :param func: picklable function reading one file, e.g. FileLoader.read_file
+        :param files: file paths
+        :param bytes_moved: size of the files for the metrics record
+        :return: list of results in file order
+        """
+        backend = self.file_backend(len(files) > 1)
+        return self.map_tasks(run_on_file, [(func, file_path, args) for file_path in files], backend,
+                              bytes_moved=bytes_moved)
+
+    def file_backend(self, parallel):
+        """
+            Backend for tasks that read their own files, auto runs them in processes when it pays off
+        :param parallel: whether the tasks are worth spreading over the workers
+        """
+        if self.backend != 'auto':
+            return self.backend
+        return 'process' if parallel and self.processes > 1 else 'serial'
+
+    def map_tasks(self, entry_point, tasks, backend, **stats):
+        """
+            Running entry_point(*task) for every task, entry points return (result, timings of the worker)
+        :param entry_point: module level function like run_on_partition
+        :param tasks: list of argument tuples
+        :param backend: 'serial', 'thread' or 'process'
+        :param stats: rows or bytes_moved of the metrics record
+        :return: list of results in task order
+        """
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        if backend == 'process':
+            self.start_workers()
+            outputs = self.pool.starmap(entry_point, tasks)
+        elif backend == 'thread':
+            if self.threads is None:
+                self.threads = ThreadPoolExecutor(max_workers=self.processes)
+            outputs = [future.result() for future in [self.threads.submit(entry_point, *task) for task in tasks]]
+        else:
+            outputs = [entry_point(*task) for task in tasks]
+        cpu = sum(timing['cpu'] for _, timing in outputs) if backend == 'process' else time.process_time() - start_cpu
+        Metrics.record('worker compute', time.perf_counter() - start_wall, cpu,
+                       workers=1 if backend == 'serial' else self.processes, backend=backend, chunks=len(tasks),
+                       **stats)
+        return [result for result, _ in outputs]
+
+    def release(self):
+        """
+            Releasing the published frame
+        """
+        if self.frame is not None:
+            self.frame.close()
+        self.frame = None
+        self.data = None
+        self.published = None
+
+    def close(self):
+        """
+            Stopping the workers and releasing the shared memory
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.threads is not None:
+            self.threads.shutdown()
+            self.threads = None
+        self.release()
@@ -0,0 +1,101 @@
+import json
+import os
+import asyncio
+import socket
+
+from metrics import Metrics
+
+SOCKET_PATH = 'beta.sock'
+
+
+class AnalyticsServer:
+    """
+        Answering batch analyses from the aggregates in memory over a local Unix socket
+    """
+
+    def __init__(self, merged, parse, socket_path=SOCKET_PATH):
+        self.merged = merged
+        # function turning the analyses of a request into a plan, e.g. BatchPlan.parse
+        self.parse = parse
+        self.socket_path = socket_path
+        self.queries = 0
+        self.server = None
+        self.loop = None
+
+    def answer(self, request):
+        """
+            Answering one request from the aggregates in memory
+        :param request: dict
+        :return: response dict
+        """
+        try:
+            if request.get('command') == 'ping':
+                return {'ok': True, 'queries': self.queries, 'rows': self.merged['rows']}
+            with Metrics.operation('query'):
+                report = self.parse(request['analyses']).report(self.merged)
+            self.queries += 1
+            return {'ok': True, 'report': report}
+        except Exception as e:
+            return {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+    async def handle(self, reader, writer):
+        """
+            Serving one client connection, it may send any number of requests
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = self.answer(json.loads(line))
+                except ValueError as e:
+                    response = {'ok': False, 'error': f"Invalid request: {e}"}
+                writer.write(json.dumps(response, default=Metrics.to_json).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """
+            Accepting clients until stop() is called
+        """
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_unix_server(self.handle, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        print(f"Serving {self.merged['rows']} rows on {self.socket_path}")
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        """
+            Stopping the server, callable from any thread
+        """
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+
+def query_server(request, socket_path=SOCKET_PATH, timeout=30):
+    """
+        Thin client, sending one request to a running AnalyticsServer
+    :param request: dict, e.g. {"analyses": ["region"]}
+    :param socket_path: path of the server socket
+    :param timeout: seconds to wait for the answer
+    :return: response dict
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with client.makefile('rb') as f:
+            return json.loads(f.readline())
@@ -0,0 +1,137 @@
+import pandas as pd
+import numpy as np
+from multiprocessing import shared_memory
+import os
+import threading
+
+
+class SharedFrame:
+    """
+        DataFrame columns published once into shared memory, workers only receive the handle
+    """
+    _counter = 0
+
+    def __init__(self, data):
+        SharedFrame._counter += 1
+        self.blocks = []
+        self.nbytes = 0
+        self.handle = {'token': f"{os.getpid()}-{SharedFrame._counter}", 'rows': len(data), 'columns': []}
+        try:
+            for name in data.columns:
+                self.publish_column(name, data[name])
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def encode_column(column):
+        """
+            Encoding a column as one fixed-width array, text columns are stored as integer codes
+        :param column: column values
+        :return: (kind, array, categories or None)
+        """
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            return 'category', column.array.codes, list(column.cat.categories)
+        if pd.api.types.is_numeric_dtype(column.dtype) or pd.api.types.is_datetime64_dtype(column.dtype):
+            return 'array', column.to_numpy(), None
+        values, uniques = pd.factorize(column)
+        return 'text', values, list(uniques)
+
+    def publish_column(self, name, column):
+        """
+            Copying one column into a shared memory block
+        :param name: column name
+        :param column: column values
+        """
+        kind, values, categories = SharedFrame.encode_column(column)
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        self.blocks.append(block)
+        self.nbytes += values.nbytes
+        np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+        self.handle['columns'].append({
+            'name': name, 'kind': kind, 'shm': block.name, 'dtype': values.dtype.str, 'categories': categories,
+        })
+
+    def close(self):
+        """
+            Releasing the shared memory blocks
+        """
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def map_file(path, dtype, rows):
+    """
+        Read-only mapping of one column file
+    """
+    if rows == 0:
+        # an empty file cannot be mapped
+        return np.empty(0, dtype=np.dtype(dtype))
+    return np.memmap(path, dtype=np.dtype(dtype), mode='r', shape=(rows,))
+
+
+# token of every attached frame -> its shared memory blocks and mapped files, kept until detach_frame
+_attached_frames = {}
+_attached_lock = threading.Lock()
+
+
+def attach_frame(handle, start, stop):
+    """
+        Rebuilding rows start:stop of a published frame on top of the shared memory, without copying
+    :param handle: SharedFrame.handle
+    :param start: first row
+    :param stop: row after the last one
+    :return: read-only DataFrame indexed by row position
+    """
+    with _attached_lock:
+        blocks = _attached_frames.setdefault(handle['token'], {})
+        for spec in handle['columns']:
+            key = spec.get('shm') or spec['file']
+            if key not in blocks:
+                if 'shm' in spec:
+                    blocks[key] = shared_memory.SharedMemory(name=spec['shm'])
+                else:
+                    blocks[key] = map_file(spec['file'], spec['dtype'], handle['rows'])
+
+    columns = {}
+    for spec in handle['columns']:
+        block = blocks[spec.get('shm') or spec['file']]
+        if 'shm' in spec:
+            values = np.ndarray((handle['rows'],), dtype=np.dtype(spec['dtype']), buffer=block.buf)[start:stop]
+            values.flags.writeable = False
+        else:
+            # a plain view, so results computed from the mapping are ordinary arrays
+            values = block.view(np.ndarray)[start:stop]
+        if spec['kind'] == 'category':
+            # the codes were written by this module, validating them again would copy them
+            dtype = pd.CategoricalDtype(spec['categories'])
+            columns[spec['name']] = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+        elif spec['kind'] == 'text':
+            lookup = np.append(np.array(spec['categories'], dtype=object), np.nan)
+            columns[spec['name']] = lookup[values]
+        else:
+            columns[spec['name']] = values
+    return pd.DataFrame(columns, index=pd.RangeIndex(start, stop), copy=False)
+
+
+def detach_frame(token):
+    """
+        Closing the shared memory blocks attached for a frame, no DataFrame built on them may be left
+    :param token: token of the handle passed to attach_frame
+    """
+    with _attached_lock:
+        blocks = _attached_frames.pop(token, {})
+    for block in blocks.values():
+        if isinstance(block, shared_memory.SharedMemory):
+            block.close()
+
+
+def detach_others(token):
+    """
+        Closing every attached frame but the one of token
+    :param token: token of the handle still in use
+    """
+    for other in [other for other in _attached_frames if other != token]:
+        detach_frame(other)
@@ -0,0 +1,299 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import weakref
+import shutil
+from urllib.parse import quote
+
+from metrics import Metrics
+from shared_frame import SharedFrame, attach_frame
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# version of the load cache, the column store and the partitioned dataset files
+CACHE_VERSION = 3
+# Hive-style partitioned layout: <root>/Region=Europe/Country=Norway/part-0.npz with the manifest in <root>/dataset.json
+PARTITION_COLUMNS = ['Region', 'Country']
+PARTITION_MANIFEST = 'dataset.json'
+PARTITION_DEFAULT = '__HIVE_DEFAULT_PARTITION__'
+
+
+def encode_columns(data):
+    """
+        Encoding DataFrame columns into plain NumPy arrays, text columns are stored as codes and uniques
+    :param data: DataFrame to encode
+    :return: (dict of arrays, list of column specs)
+    """
+    arrays = {}
+    columns = []
+    for index, name in enumerate(data.columns):
+        column = data[name]
+        key = f"c{index}"
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            arrays[key] = column.cat.codes.to_numpy()
+            arrays[key + '_uniques'] = column.cat.categories.to_numpy(dtype=str)
+            columns.append({'name': name, 'key': key, 'kind': 'category'})
+        elif pd.api.types.is_numeric_dtype(column.dtype) or pd.api.types.is_datetime64_dtype(column.dtype):
+            arrays[key] = column.to_numpy()
+            columns.append({'name': name, 'key': key, 'kind': 'array'})
+        else:
+            codes, uniques = pd.factorize(column)
+            arrays[key] = codes
+            arrays[key + '_uniques'] = np.asarray(uniques, dtype=str)
+            columns.append({'name': name, 'key': key, 'kind': 'text'})
+    return arrays, columns
+
+
+def decode_columns(arrays, columns):
+    """
+        Rebuilding the DataFrame from arrays produced by encode_columns
+    :param arrays: mapping of array names to arrays
+    :param columns: list of column specs
+    :return: DataFrame
+    """
+    decoded = {}
+    for spec in columns:
+        values = arrays[spec['key']]
+        if spec['kind'] == 'category':
+            decoded[spec['name']] = pd.Categorical.from_codes(values, arrays[spec['key'] + '_uniques'])
+        elif spec['kind'] == 'text':
+            # code -1 marks a missing value and picks the trailing NaN
+            lookup = np.append(arrays[spec['key'] + '_uniques'].astype(object), np.nan)
+            decoded[spec['name']] = lookup[values]
+        else:
+            decoded[spec['name']] = values
+    return pd.DataFrame(decoded)
+
+
+class ColumnStore:
+    """
+        The csv converted once into one binary file per column, opened with np.memmap
+    """
+    # id of every opened DataFrame -> (weak reference to it, ColumnStore)
+    opened = {}
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.nbytes = 0
+
+    @staticmethod
+    def path(file_path):
+        return f"{file_path}.store"
+
+    @staticmethod
+    def write(file_path, data, source_key):
+        """
+            Writing the store, the new directory replaces the old one only when it is complete
+        :param file_path: path to the csv file
+        :param data: parsed DataFrame
+        :param source_key: key of the source file the data was parsed from
+        """
+        store_path = ColumnStore.path(file_path)
+        staging_path = f"{store_path}.tmp-{os.getpid()}"
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(staging_path)
+        try:
+            columns = []
+            for index, name in enumerate(data.columns):
+                kind, values, categories = SharedFrame.encode_column(data[name])
+                if kind == 'text':
+                    # code -1 is a missing value for a categorical as well, so text is mapped as a category
+                    kind = 'category'
+                file_name = f"{index}.bin"
+                np.ascontiguousarray(values).tofile(os.path.join(staging_path, file_name))
+                columns.append({'name': name, 'kind': kind, 'file': file_name, 'dtype': values.dtype.str,
+                                'categories': categories})
+            meta = {'key': source_key, 'rows': len(data), 'columns': columns}
+            with open(os.path.join(staging_path, 'store.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, default=Metrics.to_json)
+            shutil.rmtree(store_path, ignore_errors=True)
+            os.replace(staging_path, store_path)
+        except Exception:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+
+    @staticmethod
+    def open(file_path, source_key):
+        """
+            Mapping the store of the csv file
+        :param file_path: path to the csv file
+        :param source_key: current key of the source file
+        :return: read-only DataFrame backed by the mapped files, None when the store is missing or outdated
+        """
+        store_path = ColumnStore.path(file_path)
+        try:
+            with open(os.path.join(store_path, 'store.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('key') != source_key:
+            return None
+        handle = {
+            'token': f"store-{os.path.abspath(store_path)}-{meta['key']['mtime_ns']}",
+            'rows': meta['rows'],
+            'columns': [dict(spec, file=os.path.abspath(os.path.join(store_path, spec['file'])))
+                        for spec in meta['columns']],
+        }
+        data = attach_frame(handle, 0, meta['rows'])
+        ColumnStore.opened[id(data)] = (weakref.ref(data), ColumnStore(handle))
+        weakref.finalize(data, ColumnStore.opened.pop, id(data), None)
+        return data
+
+    @staticmethod
+    def of(data):
+        """
+            Store the DataFrame was opened from, when all of its columns are still the mapped files
+        :param data: DataFrame
+        :return: ColumnStore or None
+        """
+        entry = ColumnStore.opened.get(id(data))
+        if entry is None or entry[0]() is not data:
+            return None
+        store = entry[1]
+        names = [spec['name'] for spec in store.handle['columns']]
+        if len(data) != store.handle['rows'] or list(data.columns) != names:
+            return None
+        for spec in store.handle['columns']:
+            column = data[spec['name']]
+            if spec['kind'] == 'category':
+                if not isinstance(column.dtype, pd.CategoricalDtype):
+                    return None
+                values = column.array.codes
+            else:
+                values = column.to_numpy()
+            if not ColumnStore.is_mapped(values, spec['file']):
+                return None
+        return store
+
+    @staticmethod
+    def is_mapped(values, path):
+        """
+            Whether values is the whole mapping of the file, not a copy or a slice of it
+        """
+        base = values
+        while not isinstance(base, np.memmap) and isinstance(base.base, np.ndarray):
+            base = base.base
+        if not isinstance(base, np.memmap):
+            return len(values) == 0
+        return base.filename == path and len(values) == len(base) and values.ctypes.data == base.ctypes.data
+
+    def close(self):
+        """
+            Nothing to release, the files stay mapped by the DataFrame
+        """
+
+
+class PartitionedDataset:
+    """
+        Sales data split into one file per Region and Country in a Hive-style directory tree
+    """
+
+    @staticmethod
+    def is_dataset(root):
+        return os.path.isdir(root) and os.path.isfile(os.path.join(root, PARTITION_MANIFEST))
+
+    @staticmethod
+    def write(data, root, by=PARTITION_COLUMNS):
+        """
+            Writing data partitioned by the by columns, the new tree replaces the old one only when it is complete
+        :param data: DataFrame loaded with the sales schema
+        :param root: destination directory, it must not exist or be a partitioned dataset
+        :param by: partition columns, outermost first
+        :return: manifest dict
+        """
+        if os.path.exists(root) and not PartitionedDataset.is_dataset(root):
+            raise ValueError(f"'{root}' exists and is not a partitioned dataset")
+        file_format = 'parquet' if PARQUET_AVAILABLE else 'npz'
+        staging_path = f"{root}.tmp-{os.getpid()}"
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(staging_path)
+        try:
+            entries = []
+            # rows without a Region or Country go to the default partition, validation rejects them later
+            groups = data.groupby(list(by), observed=True, dropna=False, sort=True).indices
+            for key, positions in groups.items():
+                key = key if isinstance(key, tuple) else (key,)
+                values = {column: None if pd.isna(value) else str(value) for column, value in zip(by, key)}
+                directories = [f"{column}={PARTITION_DEFAULT if value is None else quote(value, safe=' ')}"
+                               for column, value in values.items()]
+                relative_path = '/'.join(directories + [f"part-0.{file_format}"])
+                path = os.path.join(staging_path, *relative_path.split('/'))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                part = data.iloc[positions].drop(columns=list(by)).reset_index(drop=True)
+                entry = {'path': relative_path, 'values': values, 'rows': len(part)}
+                if file_format == 'parquet':
+                    part.to_parquet(path, index=False)
+                else:
+                    arrays, entry['columns'] = encode_columns(part)
+                    with open(path, 'wb') as f:
+                        np.savez(f, **arrays)
+                entry['bytes'] = os.path.getsize(path)
+                entries.append(entry)
+            manifest = {'version': CACHE_VERSION, 'format': file_format, 'by': list(by),
+                        'columns': list(data.columns), 'rows': len(data), 'partitions': entries}
+            with open(os.path.join(staging_path, PARTITION_MANIFEST), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, default=Metrics.to_json)
+            shutil.rmtree(root, ignore_errors=True)
+            os.replace(staging_path, root)
+            return manifest
+        except Exception:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+
+    @staticmethod
+    def partitions(root, countries=None, regions=None):
+        """
+            Pruning the partitions to the requested countries and regions
+        :param root: dataset directory
+        :param countries: countries to keep, None for all of them
+        :param regions: regions to keep, None for all of them
+        :return: (manifest, list of partition entries)
+        """
+        with open(os.path.join(root, PARTITION_MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != CACHE_VERSION:
+            raise ValueError("The dataset was written by another version, export it again")
+        wanted = {'Country': countries, 'Region': regions}
+        entries = [entry for entry in manifest['partitions']
+                   if all(keys is None or entry['values'].get(column) in keys for column, keys in wanted.items()
+                          if column in entry['values'])]
+        return manifest, entries
+
+    @staticmethod
+    def read_partition(root, entry):
+        """
+            Reading one partition, the partition columns are restored from its values
+        :param root: dataset directory
+        :param entry: partition entry of the manifest
+        :return: DataFrame
+        """
+        path = os.path.join(root, *entry['path'].split('/'))
+        if entry['path'].endswith('.parquet'):
+            part = pd.read_parquet(path)
+        else:
+            with np.load(path, allow_pickle=False) as arrays:
+                part = decode_columns(arrays, entry['columns'])
+        for column, value in entry['values'].items():
+            codes = np.full(len(part), -1 if value is None else 0, dtype=np.int8)
+            part[column] = pd.Categorical.from_codes(codes, [] if value is None else [value])
+        return part
+
+    @staticmethod
+    def read(root, manifest, entries, concat):
+        """
+            Reading and concatenating partitions
+        :param root: dataset directory
+        :param manifest: manifest of the dataset
+        :param entries: partitions to read
+        :param concat: function concatenating the partitions, e.g. FileLoader.concat
+        :return: DataFrame with the columns in the exported order
+        """
+        parts = [PartitionedDataset.read_partition(root, entry) for entry in entries]
+        if not parts:
+            return pd.DataFrame(columns=manifest['columns'])
+        return concat(parts)[manifest['columns']]